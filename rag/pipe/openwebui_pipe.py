@@ -2,14 +2,360 @@
 title: RAG ANSTAT
 description: Recherche documentaire sur les publications statistiques ANSTAT avec RAG
 author: ANSTAT
-version: 2.2
+version: 3.0
 """
 
 from pydantic import BaseModel, Field
-from typing import Optional, Union, Generator
+from typing import Optional, Union, Generator, AsyncGenerator
 import requests
+from requests.adapters import HTTPAdapter
+import asyncio
 import json
+import os
+from json.decoder import scanstring
 import re
+import threading
+import time
+import unicodedata
+from contextlib import contextmanager
+from collections import OrderedDict, deque
+
+try:
+    import httpx
+except ImportError:  # Pas de client async : le pipe reste en mode synchrone
+    httpx = None
+
+try:
+    from transformers import AutoTokenizer
+except ImportError:  # Comptage approximatif des tokens (caracteres / 3)
+    AutoTokenizer = None
+
+
+class _DependencyError(Exception):
+    """Dependance (rag-search, vLLM) en echec ou disjoncteur ouvert."""
+
+
+class _CircuitBreaker:
+    """
+    Disjoncteur par dependance, sur une fenetre glissante des derniers appels.
+    S'ouvre si le taux d'erreurs ou d'appels lents depasse son seuil ;
+    apres BREAKER_COOLDOWN, un seul appel test est laisse passer (semi-ouvert).
+    """
+
+    CLOSED, OPEN, HALF_OPEN = "FERME", "OUVERT", "SEMI-OUVERT"
+
+    def __init__(self, name: str):
+        self.name = name
+        self.window = 20
+        self.min_calls = 5
+        self.error_rate = 0.5
+        self.slow_seconds = 8.0
+        self.slow_rate = 0.8
+        self.cooldown = 30.0
+        self.state = self.CLOSED
+        self._calls = deque()
+        self._opened_at = 0.0
+        self._probe_in_flight = False
+        self._lock = threading.Lock()
+
+    def configure(self, window: int, min_calls: int, error_rate: float,
+                  slow_seconds: float, slow_rate: float, cooldown: float):
+        self.window = window
+        self.min_calls = min_calls
+        self.error_rate = error_rate
+        self.slow_seconds = slow_seconds
+        self.slow_rate = slow_rate
+        self.cooldown = cooldown
+
+    def is_open(self) -> bool:
+        """Vrai si les appels sont refuses (sans consommer l'appel test)."""
+        with self._lock:
+            return self.state == self.OPEN and time.monotonic() - self._opened_at < self.cooldown
+
+    def retry_in(self) -> float:
+        return max(0.0, self.cooldown - (time.monotonic() - self._opened_at))
+
+    def allow(self) -> bool:
+        with self._lock:
+            if self.state == self.OPEN:
+                if time.monotonic() - self._opened_at < self.cooldown:
+                    return False
+                self._transition(self.HALF_OPEN, "fin du delai, appel test")
+            if self.state == self.HALF_OPEN:
+                if self._probe_in_flight:
+                    return False
+                self._probe_in_flight = True
+            return True
+
+    def release(self):
+        """Libere l'appel test sans resultat (requete annulee)."""
+        with self._lock:
+            self._probe_in_flight = False
+
+    def record(self, ok: bool, latency: float):
+        with self._lock:
+            self._probe_in_flight = False
+            if self.state == self.HALF_OPEN:
+                if ok:
+                    self._calls.clear()
+                    self._transition(self.CLOSED, f"appel test reussi en {latency:.2f}s")
+                else:
+                    self._open("appel test en echec")
+                return
+
+            self._calls.append((ok, latency))
+            while len(self._calls) > self.window:
+                self._calls.popleft()
+            if self.state != self.CLOSED or len(self._calls) < self.min_calls:
+                return
+            n = len(self._calls)
+            errors = sum(1 for c_ok, _ in self._calls if not c_ok) / n
+            slow = sum(1 for _, c_lat in self._calls if c_lat > self.slow_seconds) / n
+            if errors >= self.error_rate:
+                self._open(f"erreurs {errors:.0%} sur {n} appels")
+            elif slow >= self.slow_rate:
+                self._open(f"appels > {self.slow_seconds}s : {slow:.0%} sur {n}")
+
+    def _open(self, reason: str):
+        self._opened_at = time.monotonic()
+        self._transition(self.OPEN, f"{reason}, reessai dans {self.cooldown:.0f}s")
+
+    def _transition(self, state: str, reason: str):
+        if state != self.state:
+            print(f"[Breaker] {self.name} : {self.state} -> {state} ({reason})")
+        self.state = state
+
+
+class _RetryBudget:
+    """
+    Budget de retries en jetons : chaque requete credite `ratio` jeton,
+    chaque retry en consomme un. Pendant une panne, les retries restent
+    limites a une fraction du trafic au lieu de le multiplier.
+    """
+
+    def __init__(self, ratio: float, max_tokens: float = 10.0):
+        self.ratio = ratio
+        self.max_tokens = max_tokens
+        self._tokens = max_tokens
+        self._lock = threading.Lock()
+
+    def on_request(self):
+        with self._lock:
+            self._tokens = min(self.max_tokens, self._tokens + self.ratio)
+
+    def try_spend(self) -> bool:
+        with self._lock:
+            if self._tokens >= 1.0:
+                self._tokens -= 1.0
+                return True
+            return False
+
+
+class _TTLCache:
+    """
+    Cache LRU borne avec expiration (TTL), partage entre les threads du pipe.
+    Peut etre persiste sur disque en JSON (ecriture atomique).
+    """
+
+    def __init__(self, max_size: int, ttl: float, path: str = "", save_every: int = 20):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.path = path
+        self.save_every = save_every
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self._unsaved = 0
+        if path:
+            self._load()
+
+    def get(self, key: str):
+        with self._lock:
+            item = self._data.get(key)
+            if item is not None and time.time() - item[0] > self.ttl:
+                del self._data[key]
+                item = None
+            if item is None:
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return item[1]
+
+    def __contains__(self, key: str) -> bool:
+        """Presence d'une entree non expiree, sans compter de hit/miss ni toucher l'ordre LRU."""
+        with self._lock:
+            item = self._data.get(key)
+            return item is not None and time.time() - item[0] <= self.ttl
+
+    def put(self, key: str, value):
+        with self._lock:
+            self._data[key] = (time.time(), value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+            self._unsaved += 1
+            should_save = self.path and self._unsaved >= self.save_every
+        if should_save:
+            self.save()
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+        self.save()
+
+    def hit_rate(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    def __len__(self):
+        return len(self._data)
+
+    def _load(self):
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                entries = json.load(f)
+        except FileNotFoundError:
+            return
+        except Exception as e:
+            print(f"[Cache] Lecture impossible de {self.path} : {e}")
+            return
+        now = time.time()
+        for key, (ts, value) in entries:
+            if now - ts <= self.ttl:
+                self._data[key] = (ts, value)
+        while len(self._data) > self.max_size:
+            self._data.popitem(last=False)
+        print(f"[Cache] {len(self._data)} entrees chargees depuis {self.path}")
+
+    def save(self):
+        if not self.path:
+            return
+        with self._lock:
+            entries = [[key, list(item)] for key, item in self._data.items()]
+            self._unsaved = 0
+        tmp_path = f"{self.path}.tmp"
+        try:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(entries, f, ensure_ascii=False)
+            os.replace(tmp_path, self.path)
+        except Exception as e:
+            print(f"[Cache] Ecriture impossible de {self.path} : {e}")
+
+
+def _normalize_question(question: str) -> str:
+    """Minuscules, sans accents ni ponctuation, espaces compactes."""
+    text = unicodedata.normalize("NFKD", question.lower())
+    text = "".join(c for c in text if not unicodedata.combining(c))
+    text = re.sub(r"[^\w%]+", " ", text)
+    return " ".join(text.split())
+
+
+class _TokenCoalescer:
+    """
+    Regroupe les tokens du stream avant de les rendre a OpenWebUI.
+    Le premier token part immediatement (latence percue), les suivants
+    par paquets de `flush_chars` caracteres ou toutes les `flush_ms` ms.
+    En async, le stream attend le token suivant au plus `remaining()` secondes
+    et vide le tampon a l'echeance. En synchrone, iter_lines bloque : l'echeance
+    n'est verifiee qu'a l'arrivee d'un token, une pause de vLLM retient donc
+    le tampon (au plus flush_chars caracteres) jusqu'au token suivant.
+    """
+
+    def __init__(self, flush_ms: float, flush_chars: int):
+        self.interval = flush_ms / 1000.0
+        self.max_chars = flush_chars
+        self.tokens = 0
+        self.flushes = 0
+        self._parts = []
+        self._size = 0
+        self._last_flush = None
+
+    def push(self, token: str) -> str:
+        """Ajoute un token ; retourne le texte a emettre ("" tant qu'on accumule)."""
+        self._parts.append(token)
+        self._size += len(token)
+        self.tokens += 1
+        now = time.monotonic()
+        if (self._last_flush is None or self._size >= self.max_chars
+                or now - self._last_flush >= self.interval):
+            return self._take(now)
+        return ""
+
+    def flush(self) -> str:
+        """Vide le tampon (fin de stream, ou echeance atteinte sans nouveau token)."""
+        return self._take(time.monotonic()) if self._parts else ""
+
+    def remaining(self) -> Optional[float]:
+        """Secondes avant l'envoi du tampon par le temps, None s'il est vide."""
+        if not self._parts or self._last_flush is None:
+            return None
+        return max(0.0, self._last_flush + self.interval - time.monotonic())
+
+    def _take(self, now: float) -> str:
+        text = "".join(self._parts)
+        self._parts = []
+        self._size = 0
+        self._last_flush = now
+        self.flushes += 1
+        return text
+
+
+class _Timings:
+    """
+    Chronometrage d'une requete (horloge monotone) : duree de chaque phase,
+    temps jusqu'au premier token de vLLM et debit de decodage.
+    """
+
+    PHASE_LABELS = {
+        "intent": "classification",
+        "retrieval": "recherche",
+        "hyde": "HyDE",
+        "cache": "cache de reponses",
+        "prompt": "construction du prompt",
+    }
+
+    def __init__(self):
+        self.start = time.monotonic()
+        self.phases = {}
+        self.tokens = 0
+        self._llm_start = None
+        self._first_token = None
+        self._end = None
+
+    @contextmanager
+    def phase(self, name: str):
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            self.phases[name] = self.phases.get(name, 0.0) + time.monotonic() - start
+
+    def llm_started(self):
+        self._llm_start = time.monotonic()
+
+    def first_token(self):
+        if self._first_token is None:
+            self._first_token = time.monotonic()
+
+    def finish(self, tokens: int):
+        self.tokens = tokens
+        self._end = time.monotonic()
+
+    def summary(self) -> dict:
+        """Durees en ms, tokens streames et tokens/s."""
+        end = self._end or time.monotonic()
+        data = {f"{name}_ms": round(seconds * 1000) for name, seconds in self.phases.items()}
+        if self._llm_start is not None and self._first_token is not None:
+            decode = end - self._first_token
+            data["ttft_ms"] = round((self._first_token - self._llm_start) * 1000)
+            data["decode_ms"] = round(decode * 1000)
+            data["tokens"] = self.tokens
+            data["tokens_per_s"] = round(self.tokens / decode, 1) if decode > 0 else None
+        data["total_ms"] = round((end - self.start) * 1000)
+        return data
 
 
 class Pipe:
@@ -48,33 +394,874 @@ class Pipe:
             default=90,
             description="Timeout en secondes pour les appels HTTP",
         )
+        CONTEXT_TOKEN_BUDGET: int = Field(
+            default=2500,
+            description="Tokens max occupes par les extraits de sources dans le prompt",
+        )
+        TOKENIZER_NAME: str = Field(
+            default="",
+            description="Tokenizer HuggingFace pour compter les tokens (vide = LLM_MODEL)",
+        )
+        HTTP_POOL_SIZE: int = Field(
+            default=32,
+            description="Connexions keep-alive gardees ouvertes par service (rag-search, vLLM)",
+        )
+        HTTP_MAX_RETRIES: int = Field(
+            default=2,
+            description="Nouvelles tentatives sur erreur de connexion ou 502/503/504 (dans la limite du budget)",
+        )
+        HTTP_RETRY_BACKOFF: float = Field(
+            default=0.3,
+            description="Facteur de backoff exponentiel entre deux tentatives (secondes)",
+        )
+        RETRY_BUDGET_RATIO: float = Field(
+            default=0.2,
+            description="Retries autorises par requete en moyenne (budget par dependance)",
+        )
+        INTENT_TIMEOUT: float = Field(
+            default=5.0,
+            description="Deadline (s) du classifieur d'intention (au-dela : heuristique)",
+        )
+        SEARCH_TIMEOUT: float = Field(
+            default=15.0,
+            description="Deadline (s) de l'appel au service de recherche",
+        )
+        LLM_FIRST_TOKEN_TIMEOUT: float = Field(
+            default=30.0,
+            description="Delai max (s) d'attente du premier token, puis entre deux tokens",
+        )
+        BREAKER_WINDOW: int = Field(
+            default=20,
+            description="Nombre d'appels recents observes par disjoncteur",
+        )
+        BREAKER_MIN_CALLS: int = Field(
+            default=5,
+            description="Appels minimum dans la fenetre avant de pouvoir ouvrir le disjoncteur",
+        )
+        BREAKER_ERROR_RATE: float = Field(
+            default=0.5,
+            description="Taux d'erreurs qui ouvre le disjoncteur",
+        )
+        BREAKER_SLOW_SECONDS: float = Field(
+            default=8.0,
+            description="Au-dela de cette latence (s), un appel compte comme lent",
+        )
+        BREAKER_SLOW_RATE: float = Field(
+            default=0.8,
+            description="Taux d'appels lents qui ouvre le disjoncteur",
+        )
+        BREAKER_COOLDOWN: float = Field(
+            default=30.0,
+            description="Duree (s) d'ouverture du disjoncteur avant un appel test",
+        )
+        SESSION_CACHE_SIZE: int = Field(
+            default=256,
+            description="Nombre de conversations dont les sources sont gardees pour les questions de suivi (0 = desactive)",
+        )
+        SESSION_TTL: int = Field(
+            default=1800,
+            description="Duree de vie (s) des sources gardees pour une conversation",
+        )
+        SESSION_SIMILARITY: float = Field(
+            default=0.75,
+            description="Similarite cosinus minimale avec le tour precedent pour reutiliser ses sources",
+        )
+        SESSION_FOLLOWUP_MAX_WORDS: int = Field(
+            default=8,
+            description="Longueur max (mots) d'une question de suivi elliptique (\"et en milieu rural ?\")",
+        )
+        STREAM_FLUSH_MS: float = Field(
+            default=50.0,
+            description="Regroupement des tokens : delai max (ms) entre deux envois a OpenWebUI (0 = token par token)",
+        )
+        STREAM_FLUSH_CHARS: int = Field(
+            default=64,
+            description="Regroupement des tokens : envoi des que le tampon atteint ce nombre de caracteres",
+        )
+        ANSWER_CACHE_SIZE: int = Field(
+            default=512,
+            description="Nombre de reponses RAG gardees en cache (0 = desactive)",
+        )
+        ANSWER_CACHE_TTL: int = Field(
+            default=86400,
+            description="Duree de vie (s) d'une reponse en cache",
+        )
+        ANSWER_CACHE_PATH: str = Field(
+            default="",
+            description="Fichier JSON de persistance du cache de reponses (vide = memoire seule)",
+        )
+        SHOW_TIMINGS: bool = Field(
+            default=False,
+            description="Ajoute sous les sources un bloc repliable avec le temps de chaque phase",
+        )
+        ASYNC_MODE: bool = Field(
+            default=True,
+            description="Pipeline asynchrone (httpx) ; desactiver pour revenir au mode synchrone",
+        )
+        DEBUG: bool = Field(
+            default=False,
+            description="Affiche les statistiques du pool HTTP dans les logs",
+        )
+
+    INTENT_SYSTEM_MESSAGE = (
+        "Reponds uniquement par OUI ou NON. "
+        "Est-ce que ce message necessite une recherche dans des documents "
+        "statistiques officiels (rapports, enquetes, donnees chiffrees) ? "
+        "NON si c'est une salutation, une question sur toi-meme, ou un message conversationnel. "
+        "OUI si c'est une question sur des donnees, statistiques, ou informations factuelles."
+    )
+
+    DIRECT_SYSTEM_MESSAGE = (
+        "Tu es l'assistant documentaire de l'ANSTAT "
+        "(Agence Nationale de la Statistique de Cote d'Ivoire). "
+        "Reponds de maniere courte et amicale en francais. "
+        "Si l'utilisateur pose une vraie question sur des donnees statistiques, "
+        "invite-le a reformuler pour que tu puisses chercher dans les documents."
+    )
+
+    RAG_SYSTEM_MESSAGE = (
+        "Tu es l'assistant documentaire de l'ANSTAT "
+        "(Agence Nationale de la Statistique de Cote d'Ivoire). "
+        "On te fournit des extraits de documents officiels. "
+        "Reponds en francais de maniere claire et structuree. "
+        "Donne les chiffres exacts trouves dans les extraits, "
+        "puis explique et contextualise les donnees pour aider l'utilisateur a comprendre. "
+        "Tu peux comparer des periodes, souligner des tendances, "
+        "et mettre en perspective les resultats. "
+        "Cite toujours le document et la page."
+    )
+
+    # Debut du message utilisateur identique pour toutes les requetes :
+    # avec le message systeme, il forme un prefixe que le prefix caching
+    # de vLLM reutilise d'une question a l'autre.
+    RAG_PROMPT_PREFIX = (
+        "Reponds en utilisant les donnees des extraits ci-dessous. "
+        "Donne les chiffres exacts, puis explique et contextualise. "
+        "Indique le document et la page pour chaque information.\n\n"
+        "EXTRAITS DE DOCUMENTS OFFICIELS ANSTAT :\n\n"
+    )
+
+    # Budget de contexte restant en dessous duquel plus aucun extrait utile ne tient
+    MIN_SOURCE_TOKENS = 64
+
+    LLM_UNAVAILABLE_MESSAGE = (
+        "Le modele de langage est momentanement indisponible. "
+        "Merci de reessayer dans quelques instants."
+    )
+
+    SEARCH_DEGRADED_NOTICE = (
+        "_La recherche documentaire est momentanement indisponible : "
+        "reponse sans consultation des documents._\n\n"
+    )
+
+    TIMEOUT_NOTICE = "\n\n_(Reponse interrompue : delai de generation depasse)_"
+
+    # Statuts pour lesquels la requete n'a pas ete traitee : retry sans risque
+    RETRYABLE_STATUSES = (502, 503, 504)
+
+    CACHED_MARKER = "_(Reponse en cache)_\n\n"
+
+    SEARCH_UNAVAILABLE_MESSAGE = (
+        "Je n'ai pas pu effectuer la recherche dans les documents. "
+        "Le service de recherche est peut-etre indisponible."
+    )
 
     def __init__(self):
         self.valves = self.Valves()
+        self._session = None
+        self._session_config = None
+        self._session_lock = threading.Lock()
+        self._aclient = None
+        self._aclient_config = None
+        self._aclient_loop = None
+        # Clients httpx tenus par des requetes en cours (reponses en streaming comprises) :
+        # un client remplace n'est ferme qu'a la fin de sa derniere requete
+        self._aclient_lock = threading.Lock()
+        self._aclient_users = {}
+        self._aclient_retired = {}
+        self._aclient_streams = {}
+        self._tokenizer = None
+        self._tokenizer_name = None
+        # Verrou propre : un telechargement du tokenizer ne bloque ni la session ni les caches
+        self._tokenizer_lock = threading.Lock()
+        self._session_cache = None
+        self._session_cache_config = None
+        self._answer_cache = None
+        self._answer_cache_config = None
+        self._answer_cache_scope = None
+        self._index_version = ""
+        self._breakers = {
+            "rag-search": _CircuitBreaker("rag-search"),
+            "llm": _CircuitBreaker("llm"),
+        }
+        self._retry_budgets = {name: _RetryBudget(0.2) for name in self._breakers}
 
     def pipes(self):
         return [
             {"id": "rag-anstat", "name": "RAG ANSTAT"},
         ]
 
-    def _search(self, query: str) -> list:
-        """Appelle le service de recherche RAG."""
+    # ------------------------------------------------------------------
+    # Clients HTTP (sync : requests, async : httpx)
+    # ------------------------------------------------------------------
+
+    def _get_session(self) -> requests.Session:
+        """
+        Session HTTP partagee par toutes les conversations du process OpenWebUI.
+        Les connexions TCP vers rag-search-service et qwen25-service sont
+        gardees ouvertes (keep-alive) et reutilisees d'un appel a l'autre.
+        La session est recreee si les Valves du pool changent.
+        """
+        config = self.valves.HTTP_POOL_SIZE
+        with self._session_lock:
+            if self._session is not None and self._session_config == config:
+                return self._session
+
+            pool_size = config
+            # Les retries sont geres par _request (disjoncteur + budget)
+            adapter = HTTPAdapter(
+                pool_connections=4,
+                pool_maxsize=pool_size,
+                max_retries=0,
+            )
+            session = requests.Session()
+            session.mount("http://", adapter)
+            session.mount("https://", adapter)
+            session.headers.update({
+                "Content-Type": "application/json",
+                "Connection": "keep-alive",
+            })
+
+            # Fermer l'ancienne session libere ses connexions inactives ; celles
+            # d'un stream en cours restent ouvertes et sont fermees a leur liberation.
+            if self._session is not None:
+                self._session.close()
+            self._session = session
+            self._session_config = config
+            print(f"[HTTP Pool] Session creee (pool={pool_size})")
+            return session
+
+    def _get_async_client(self) -> "httpx.AsyncClient":
+        """
+        Client httpx partage, lie a la boucle asyncio d'OpenWebUI.
+        Meme politique que la session synchrone : pool keep-alive borne,
+        retries geres par _arequest (disjoncteur + budget).
+        """
+        loop = asyncio.get_running_loop()
+        config = (id(loop), self.valves.HTTP_POOL_SIZE)
+        if self._aclient is not None and self._aclient_config == config:
+            return self._aclient
+
+        if self._aclient is not None:
+            self._retire_async_client(self._aclient, self._aclient_loop)
+
+        _, pool_size = config
+        limits = httpx.Limits(
+            max_connections=pool_size * 2,
+            max_keepalive_connections=pool_size,
+            keepalive_expiry=60.0,
+        )
+        self._aclient = httpx.AsyncClient(
+            transport=httpx.AsyncHTTPTransport(limits=limits),
+            headers={"Content-Type": "application/json"},
+        )
+        self._aclient_config = config
+        self._aclient_loop = loop
+        print(f"[HTTP Pool] Client async cree (pool={pool_size})")
+        return self._aclient
+
+    def _hold_async_client(self, client: "httpx.AsyncClient"):
+        with self._aclient_lock:
+            self._aclient_users[client] = self._aclient_users.get(client, 0) + 1
+
+    def _release_async_client(self, client: "httpx.AsyncClient"):
+        """Fin d'une requete ; ferme le client s'il a ete remplace et n'a plus de requete en cours."""
+        with self._aclient_lock:
+            users = self._aclient_users.pop(client) - 1
+            if users:
+                self._aclient_users[client] = users
+                return
+            if client not in self._aclient_retired:
+                return
+            loop = self._aclient_retired.pop(client)
+        self._close_async_client(client, loop)
+
+    def _retire_async_client(self, client: "httpx.AsyncClient", loop: asyncio.AbstractEventLoop):
+        """Client remplace : ferme tout de suite s'il est libre, sinon a la fin de sa derniere requete."""
+        with self._aclient_lock:
+            if self._aclient_users.get(client):
+                self._aclient_retired[client] = loop
+                return
+        self._close_async_client(client, loop)
+
+    @staticmethod
+    def _close_async_client(client: "httpx.AsyncClient", loop: asyncio.AbstractEventLoop):
+        """
+        Ferme un client remplace et libre sur sa propre boucle (ses connexions y sont liees).
+        Boucle deja fermee : ses connexions sont mortes avec elle, rien a liberer.
+        """
+        if loop is None or loop.is_closed() or not loop.is_running():
+            return
+        asyncio.run_coroutine_threadsafe(client.aclose(), loop)
+
+    def _log_pool_stats(self, label: str):
+        """Affiche l'etat des pools de connexions (Valve DEBUG)."""
+        if not self.valves.DEBUG:
+            return
+        if self._session is not None:
+            adapter = self._session.get_adapter("http://")
+            pools = adapter.poolmanager.pools
+            for key in list(pools.keys()):
+                pool = pools.get(key)
+                if pool is None:
+                    continue
+                print(
+                    f"[HTTP Pool] {label} {pool.host}:{pool.port} "
+                    f"connexions_creees={pool.num_connections} "
+                    f"requetes={pool.num_requests} "
+                    f"inactives={sum(1 for c in pool.pool.queue if c is not None) if pool.pool else 0}"
+                )
+        if self._aclient is not None:
+            # httpcore n'expose pas d'API publique de stats : lecture defensive
+            pool = getattr(getattr(self._aclient, "_transport", None), "_pool", None)
+            connections = list(getattr(pool, "connections", []) or [])
+            idle = sum(1 for c in connections if c.is_idle())
+            print(
+                f"[HTTP Pool] {label} async connexions_ouvertes={len(connections)} "
+                f"inactives={idle}"
+            )
+
+    # ------------------------------------------------------------------
+    # Disjoncteurs, budget de retries et deadlines par phase
+    # ------------------------------------------------------------------
+
+    def _breaker(self, dependency: str) -> _CircuitBreaker:
+        breaker = self._breakers[dependency]
+        breaker.configure(
+            self.valves.BREAKER_WINDOW,
+            self.valves.BREAKER_MIN_CALLS,
+            self.valves.BREAKER_ERROR_RATE,
+            self.valves.BREAKER_SLOW_SECONDS,
+            self.valves.BREAKER_SLOW_RATE,
+            self.valves.BREAKER_COOLDOWN,
+        )
+        return breaker
+
+    def _admit(self, dependency: str) -> _CircuitBreaker:
+        """Verifie le disjoncteur avant un appel ; leve _DependencyError s'il est ouvert."""
+        breaker = self._breaker(dependency)
+        if not breaker.allow():
+            print(
+                f"[Breaker] {dependency} {breaker.state} : echec rapide "
+                f"(appel test dans {breaker.retry_in():.0f}s)"
+            )
+            raise _DependencyError(f"{dependency} indisponible (disjoncteur {breaker.state})")
+        budget = self._retry_budgets[dependency]
+        budget.ratio = self.valves.RETRY_BUDGET_RATIO
+        budget.on_request()
+        return breaker
+
+    def _should_retry(self, dependency: str, attempt: int, backoff: float, deadline: float) -> bool:
+        """Retry seulement si tentatives, deadline, disjoncteur et budget le permettent."""
+        if attempt >= self.valves.HTTP_MAX_RETRIES:
+            return False
+        if time.monotonic() + backoff >= deadline or self._breakers[dependency].is_open():
+            return False
+        if not self._retry_budgets[dependency].try_spend():
+            print(f"[Retry] {dependency} : budget de retries epuise")
+            return False
+        return True
+
+    def _request(self, dependency: str, url: str, payload: dict,
+                 timeout: float, stream: bool = False) -> requests.Response:
+        """
+        POST protege par le disjoncteur de la dependance.
+        Les erreurs de connexion et les 502/503/504 sont retentes avec backoff
+        tant que la deadline de la phase et le budget le permettent.
+        En streaming, `timeout` borne l'attente de chaque octet (premier token compris).
+        """
+        breaker = self._admit(dependency)
+        deadline = time.monotonic() + timeout
+        attempt = 0
+        while True:
+            start = time.monotonic()
+            remaining = max(deadline - start, 0.1)
+            try:
+                resp = self._get_session().post(
+                    url, json=payload, stream=stream,
+                    timeout=timeout if stream else remaining,
+                )
+                error = None
+                if resp.status_code in self.RETRYABLE_STATUSES:
+                    error = f"status {resp.status_code}"
+            except requests.RequestException as e:
+                resp, error = None, f"{type(e).__name__}: {e}"
+            except Exception:
+                # Erreur inattendue : comptee comme un echec, l'appel test semi-ouvert est libere
+                breaker.record(False, time.monotonic() - start)
+                raise
+            latency = time.monotonic() - start
+
+            if error is None:
+                breaker.record(resp.status_code < 500, latency)
+                return resp
+            breaker.record(False, latency)
+
+            backoff = self.valves.HTTP_RETRY_BACKOFF * (2 ** attempt)
+            if not self._should_retry(dependency, attempt, backoff, deadline):
+                if resp is not None:
+                    return resp
+                raise _DependencyError(f"{dependency} : {error}")
+            print(f"[Retry] {dependency} : {error}, tentative {attempt + 2} dans {backoff:.1f}s")
+            if resp is not None:
+                resp.close()
+            time.sleep(backoff)
+            attempt += 1
+
+    async def _arequest(self, dependency: str, url: str, payload: dict,
+                        timeout: float, stream: bool = False) -> "httpx.Response":
+        """
+        Version async de _request ; en streaming, l'appelant ferme la reponse (_aclose_stream).
+        Le client reste tenu jusque-la : remplace entre-temps, il n'est pas ferme sous le stream.
+        """
+        breaker = self._admit(dependency)
+        client = self._get_async_client()
+        self._hold_async_client(client)
+        resp = None
+        try:
+            resp = await self._asend(dependency, breaker, client, url, payload, timeout, stream)
+        finally:
+            if stream and resp is not None:
+                self._aclient_streams[resp] = client
+            else:
+                self._release_async_client(client)
+        return resp
+
+    async def _aclose_stream(self, resp: "httpx.Response"):
+        """Ferme une reponse en streaming de _arequest et libere son client."""
+        try:
+            await resp.aclose()
+        finally:
+            client = self._aclient_streams.pop(resp, None)
+            if client is not None:
+                self._release_async_client(client)
+
+    async def _asend(self, dependency: str, breaker: _CircuitBreaker, client: "httpx.AsyncClient",
+                     url: str, payload: dict, timeout: float, stream: bool) -> "httpx.Response":
+        """Envoi avec retries (backoff, deadline, budget) pour _arequest."""
+        deadline = time.monotonic() + timeout
+        attempt = 0
+        while True:
+            start = time.monotonic()
+            remaining = max(deadline - start, 0.1)
+            try:
+                request = client.build_request(
+                    "POST", url, json=payload,
+                    timeout=timeout if stream else remaining,
+                )
+                resp = await client.send(request, stream=stream)
+                error = None
+                if resp.status_code in self.RETRYABLE_STATUSES:
+                    error = f"status {resp.status_code}"
+            except httpx.HTTPError as e:
+                resp, error = None, f"{type(e).__name__}: {e}"
+            except asyncio.CancelledError:
+                breaker.release()
+                raise
+            except Exception:
+                # Erreur inattendue : comptee comme un echec, l'appel test semi-ouvert est libere
+                breaker.record(False, time.monotonic() - start)
+                raise
+            latency = time.monotonic() - start
+
+            if error is None:
+                breaker.record(resp.status_code < 500, latency)
+                return resp
+            breaker.record(False, latency)
+
+            backoff = self.valves.HTTP_RETRY_BACKOFF * (2 ** attempt)
+            if not self._should_retry(dependency, attempt, backoff, deadline):
+                if resp is not None:
+                    return resp
+                raise _DependencyError(f"{dependency} : {error}")
+            print(f"[Retry] {dependency} : {error}, tentative {attempt + 2} dans {backoff:.1f}s")
+            if resp is not None:
+                await resp.aclose()
+            await asyncio.sleep(backoff)
+            attempt += 1
+
+    def _log_breakers(self):
+        if self.valves.DEBUG:
+            for name, breaker in self._breakers.items():
+                print(f"[Breaker] {name} : {breaker.state} ({len(breaker._calls)} appels observes)")
+
+    # ------------------------------------------------------------------
+    # Requetes (communes aux modes sync et async)
+    # ------------------------------------------------------------------
+
+    def _search_payload(self, query: str, with_embedding: bool = False) -> dict:
+        payload = {
+            "query": query,
+            "top_k_rerank": self.valves.TOP_K_RERANK,
+        }
+        if with_embedding:
+            # Embedding de la requete calcule par la recherche : pas d'appel /embed en plus
+            payload["return_embedding"] = True
+        return payload
+
+    def _rag_url(self, path: str) -> str:
+        """URL d'un autre endpoint du service de recherche (/embed, /rerank)."""
+        return self.valves.RAG_SEARCH_URL.rsplit("/", 1)[0] + path
+
+    def _intent_payload(self, question: str) -> dict:
+        return {
+            "model": self.valves.LLM_MODEL,
+            "messages": [
+                {"role": "system", "content": self.INTENT_SYSTEM_MESSAGE},
+                {"role": "user", "content": question},
+            ],
+            "max_tokens": 5,
+            "temperature": 0.0,
+            "stream": False,
+        }
+
+    def _direct_payload(self, question: str) -> dict:
+        return {
+            "model": self.valves.LLM_MODEL,
+            "messages": [
+                {"role": "system", "content": self.DIRECT_SYSTEM_MESSAGE},
+                {"role": "user", "content": question},
+            ],
+            "max_tokens": 200,
+            "temperature": 0.7,
+            "stream": True,
+        }
+
+    def _rag_payload(self, rag_prompt: str) -> dict:
+        return {
+            "model": self.valves.LLM_MODEL,
+            "messages": [
+                {"role": "system", "content": self.RAG_SYSTEM_MESSAGE},
+                {"role": "user", "content": rag_prompt},
+            ],
+            "max_tokens": self.valves.LLM_MAX_TOKENS,
+            "temperature": self.valves.LLM_TEMPERATURE,
+            "repetition_penalty": 1.15,
+            "stream": True,
+        }
+
+    def _parse_intent(self, question: str, data: dict) -> bool:
+        answer = data["choices"][0]["message"]["content"].strip().upper()
+        print(f"[Intent] '{question[:50]}' → {answer}")
+        return answer.startswith("NON")
+
+    def _is_conversational_heuristic(self, question: str) -> bool:
+        """Fallback : message court sans mot-cle documentaire."""
+        q = question.strip()
+        return len(q.split()) <= 4 and not re.search(r'\d|taux|donnee|rapport|enquete|statistique', q, re.IGNORECASE)
+
+    def _parse_sse_line(self, line):
+        """
+        Decode une ligne SSE de vLLM (str ou bytes).
+        Retourne (termine, token) ; token vaut "" pour les lignes sans contenu.
+        Chemin rapide : seule la chaine du champ "content" est decodee
+        (scanstring), sans construire le dict complet du chunk.
+        """
+        if isinstance(line, bytes):
+            if not line.startswith(b"data: "):
+                return False, ""
+            line = line.decode("utf-8", "replace")
+        elif not line or not line.startswith("data: "):
+            return False, ""
+        if line.startswith("[DONE]", 6):
+            return True, ""
+        # Une cle "content" non echappee ne peut etre que celle du delta
+        pos = line.find('"content":', 6)
+        if pos < 0:
+            return False, ""
+        pos += 10
+        while line[pos:pos + 1] == " ":
+            pos += 1
+        if line.startswith("null", pos):
+            return False, ""
+        if line[pos:pos + 1] == '"':
+            try:
+                return False, scanstring(line, pos + 1)[0]
+            except ValueError:
+                pass
+        try:
+            chunk = json.loads(line[6:])
+            delta = chunk.get("choices", [{}])[0].get("delta", {})
+            return False, delta.get("content", "") or ""
+        except json.JSONDecodeError:
+            return False, ""
+
+    def _coalescer(self) -> _TokenCoalescer:
+        return _TokenCoalescer(self.valves.STREAM_FLUSH_MS, self.valves.STREAM_FLUSH_CHARS)
+
+    def _log_coalescer(self, coalescer: _TokenCoalescer):
+        if self.valves.DEBUG:
+            print(f"[Stream] {coalescer.tokens} tokens en {coalescer.flushes} envois")
+
+    def _log_timings(self, timings: _Timings, path: str) -> dict:
+        """Ligne de log JSON (une par requete) pour suivre les regressions de latence."""
+        summary = dict(timings.summary(), path=path)
+        print(f"[RAG Timing] {json.dumps(summary)}")
+        return summary
+
+    def _format_timings(self, summary: dict) -> str:
+        """Bloc repliable (<details>) affiche sous les sources."""
+        lines = [
+            f"- {label} : {summary[f'{name}_ms']} ms"
+            for name, label in _Timings.PHASE_LABELS.items()
+            if f"{name}_ms" in summary
+        ]
+        if "ttft_ms" in summary:
+            lines.append(f"- premier token (vLLM) : {summary['ttft_ms']} ms")
+            lines.append(
+                f"- generation : {summary['decode_ms']} ms, {summary['tokens']} tokens "
+                f"({summary['tokens_per_s']} tokens/s)"
+            )
+        return (
+            f"\n<details>\n<summary>Temps de reponse : {summary['total_ms'] / 1000:.2f} s</summary>\n\n"
+            + "\n".join(lines)
+            + "\n</details>\n"
+        )
+
+    # ------------------------------------------------------------------
+    # Sources de session (questions de suivi)
+    # ------------------------------------------------------------------
+
+    # Marqueurs d'ellipse seulement : une question courte qui commence par une
+    # preposition ("Pour le PIB 2020 ?", "En 2019, le taux de chomage ?") est nouvelle
+    _FOLLOW_UP_PATTERN = re.compile(
+        r"^\s*(et|mais|aussi|ou|egalement|également|qu['\u2019]en est-il|idem|pareil|"
+        r"de meme|de même|meme chose|même chose)\b",
+        re.IGNORECASE,
+    )
+
+    def _get_session_cache(self):
+        """Sources du tour precedent par conversation, recree si les Valves changent."""
+        config = (self.valves.SESSION_CACHE_SIZE, self.valves.SESSION_TTL)
+        if config[0] <= 0:
+            return None
+        with self._session_lock:
+            if self._session_cache is None or self._session_cache_config != config:
+                self._session_cache = _TTLCache(*config)
+                self._session_cache_config = config
+            return self._session_cache
+
+    def _session_entry(self, chat_id: str, messages: list) -> Optional[dict]:
+        """
+        Entree de session du tour precedent, si elle correspond bien a la
+        derniere question de l'historique (sinon : message edite, regeneration
+        d'une autre branche...).
+        """
+        cache = self._get_session_cache()
+        if cache is None or not chat_id:
+            return None
+        entry = cache.get(chat_id)
+        if entry is None:
+            return None
+        previous = [m.get("content", "") for m in messages[:-1] if m.get("role") == "user"]
+        if not previous or previous[-1] != entry["question"]:
+            print(f"[Session] {chat_id[:8]} : historique different du tour en cache, ignore")
+            return None
+        return entry
+
+    def _is_follow_up(self, question: str, entry: Optional[dict]) -> bool:
+        """Question courte et elliptique qui prolonge le tour precedent."""
+        if entry is None:
+            return False
+        if len(question.split()) > self.valves.SESSION_FOLLOWUP_MAX_WORDS:
+            return False
+        return bool(self._FOLLOW_UP_PATTERN.match(question))
+
+    def _should_reuse(self, chat_id: str, entry: dict, embedding: list, follow_up: bool) -> bool:
+        """Compare la question (sans ancre) a celle du tour precedent (embeddings normalises : cosinus = produit scalaire)."""
+        similarity = sum(a * b for a, b in zip(embedding, entry["embedding"]))
+        reuse = similarity >= self.valves.SESSION_SIMILARITY
+        print(
+            f"[Session] {chat_id[:8]} : {'reutilisation des sources' if reuse else 'nouvelle recherche'} "
+            f"(similarite {similarity:.2f} {'>=' if reuse else '<'} {self.valves.SESSION_SIMILARITY:.2f}"
+            f"{', question de suivi' if follow_up else ''})"
+        )
+        return reuse
+
+    def _session_store(self, chat_id: str, entry: dict):
+        cache = self._get_session_cache()
+        if cache is not None and chat_id:
+            cache.put(chat_id, entry)
+
+    def _session_store_search(self, chat_id: str, question: str, entry: Optional[dict],
+                              follow_up: bool, data: dict, embedding: Optional[list]):
+        """Garde les sources de la recherche du tour (celles deja envoyees au LLM) pour le tour suivant."""
+        embedding = embedding if embedding is not None else data.get("embedding")
+        if data.get("results") and embedding is not None:
+            self._session_store(chat_id, {
+                "question": question,
+                "anchor": entry["anchor"] if follow_up else question,
+                "embedding": embedding,
+                "sources": data["results"],
+            })
+
+    # ------------------------------------------------------------------
+    # Cache de reponses
+    # ------------------------------------------------------------------
+
+    def _get_answer_cache(self):
+        """
+        Cache des reponses RAG, recree si les Valves du cache changent et
+        vide quand la version de l'index ou LLM_MODEL change.
+        """
+        config = (
+            self.valves.ANSWER_CACHE_SIZE,
+            self.valves.ANSWER_CACHE_TTL,
+            self.valves.ANSWER_CACHE_PATH,
+        )
+        if config[0] <= 0:
+            return None
+        scope = (self.valves.LLM_MODEL, self._index_version)
+        with self._session_lock:
+            if self._answer_cache is None or self._answer_cache_config != config:
+                self._answer_cache = _TTLCache(*config)
+                self._answer_cache_config = config
+            elif self._answer_cache_scope not in (None, scope) and (
+                    # version "" : pas encore connue (aucune recherche faite)
+                    self._answer_cache_scope[0] != scope[0] or self._answer_cache_scope[1]):
+                print(
+                    f"[Answer Cache] Index ou modele change "
+                    f"({self._answer_cache_scope} -> {scope}), {len(self._answer_cache)} entrees invalidees"
+                )
+                self._answer_cache.clear()
+            self._answer_cache_scope = scope
+            return self._answer_cache
+
+    def _answer_cache_key(self, question: str, sources: list) -> str:
+        """Question normalisee + sources retrouvees (ordre compris) + version index/modele."""
+        source_ids = ",".join(
+            s.get("chunk_id") or f"{s.get('doc')}:{s.get('page')}" for s in sources
+        )
+        return (
+            f"{self.valves.LLM_MODEL}|{self._index_version}|{source_ids}|"
+            f"{_normalize_question(question)}"
+        )
+
+    def _is_cached_question(self, question: str) -> bool:
+        """Question deja traitee par le RAG : le classifieur d'intention est inutile."""
+        cache = self._get_answer_cache()
+        # Simple sondage : ne fausse ni le taux de hits du cache ni son ordre LRU
+        return cache is not None and f"q|{_normalize_question(question)}" in cache
+
+    def _answer_from_cache(self, question: str, sources: list) -> Optional[str]:
+        """Reponse complete (marqueur + reponse + sources) deja generee, ou None."""
+        cache = self._get_answer_cache()
+        if cache is None:
+            return None
+        entry = cache.get(self._answer_cache_key(question, sources))
+        print(f"[Answer Cache] {'hit' if entry is not None else 'miss'} ({len(cache)} entrees)")
+        if entry is None:
+            return None
+        return self.CACHED_MARKER + entry["answer"] + entry["sources"]
+
+    def _answer_to_cache(self, question: str, sources: list, answer: str, sources_text: str):
+        """Garde une reponse terminee normalement (ni coupee, ni vide)."""
+        cache = self._get_answer_cache()
+        if cache is None or not answer.strip() or answer.endswith(self.TIMEOUT_NOTICE):
+            return
+        cache.put(self._answer_cache_key(question, sources), {"answer": answer, "sources": sources_text})
+        cache.put(f"q|{_normalize_question(question)}", True)
+
+    # ------------------------------------------------------------------
+    # Mode synchrone (fallback)
+    # ------------------------------------------------------------------
+
+    def _search(self, query: str) -> Optional[list]:
+        """
+        Appelle le service de recherche RAG.
+        Retourne None si le service est en echec (distinct de "aucun resultat").
+        """
+        data = self._search_response(query)
+        return data.get("results", []) if data is not None else None
+
+    def _search_response(self, query: str, with_embedding: bool = False) -> Optional[dict]:
+        """Reponse complete de /search (resultats, index_version, embedding si demande), None en cas d'echec."""
         try:
-            resp = requests.post(
+            resp = self._request(
+                "rag-search",
                 self.valves.RAG_SEARCH_URL,
-                json={
-                    "query": query,
-                    "top_k_rerank": self.valves.TOP_K_RERANK,
-                },
-                timeout=self.valves.REQUEST_TIMEOUT,
+                self._search_payload(query, with_embedding),
+                self.valves.SEARCH_TIMEOUT,
             )
             if resp.status_code == 200:
-                return resp.json().get("results", [])
+                data = resp.json()
+                self._index_version = data.get("index_version", self._index_version)
+                return data
             print(f"[RAG] Search error (status {resp.status_code}): {resp.text}")
-            return []
         except Exception as e:
             print(f"[RAG] Search failed: {e}")
-            return []
+        return None
+
+    def _embed(self, query: str) -> Optional[list]:
+        """Embedding normalise de la requete (endpoint /embed), None en cas d'echec."""
+        try:
+            resp = self._request(
+                "rag-search", self._rag_url("/embed"), {"query": query}, self.valves.SEARCH_TIMEOUT
+            )
+            if resp.status_code == 200:
+                return resp.json()["embedding"]
+            print(f"[Session] Embedding error (status {resp.status_code})")
+        except Exception as e:
+            print(f"[Session] Embedding failed: {e}")
+        return None
+
+    def _rerank(self, query: str, candidates: list) -> Optional[list]:
+        """Re-classe des sources deja connues avec le cross-encoder (endpoint /rerank)."""
+        try:
+            resp = self._request(
+                "rag-search",
+                self._rag_url("/rerank"),
+                {"query": query, "candidates": candidates, "top_k_rerank": len(candidates)},
+                self.valves.SEARCH_TIMEOUT,
+            )
+            if resp.status_code == 200:
+                return resp.json().get("results", [])
+            print(f"[Session] Rerank error (status {resp.status_code})")
+        except Exception as e:
+            print(f"[Session] Rerank failed: {e}")
+        return None
+
+    def _retrieve(self, question: str, chat_id: str, entry: Optional[dict],
+                  follow_up: bool) -> Optional[list]:
+        """
+        Sources de la question. Si elle est proche du tour precedent de la
+        conversation, les sources de ce tour sont re-classees au lieu de
+        relancer une recherche globale. Une question de suivi elliptique est
+        completee par la question d'origine du fil pour la recherche et le
+        re-classement, mais la comparaison porte sur la question seule : l'ancre,
+        commune aux deux tours, gonflerait la similarite.
+        La comparaison n'a lieu que s'il y a un tour precedent (appel /embed) ;
+        sinon l'embedding garde pour le tour suivant vient de la recherche elle-meme.
+        """
+        if self._get_session_cache() is None or not chat_id:
+            return self._search(question)
+
+        query = f"{entry['anchor']} {question}" if follow_up else question
+        embedding = None
+        if entry is not None:
+            embedding = self._embed(question)
+            if embedding is not None and self._should_reuse(chat_id, entry, embedding, follow_up):
+                sources = self._rerank(query, entry["sources"])
+                if sources:
+                    self._session_store(chat_id, dict(entry, question=question))
+                    return sources[:self.valves.TOP_K_RERANK]
+
+        # Sans tour precedent, query == question : l'embedding renvoye est celui de la question
+        data = self._search_response(query, with_embedding=entry is None)
+        if data is None:
+            return None
+        self._session_store_search(chat_id, question, entry, follow_up, data, embedding)
+        return data.get("results", [])
 
     def _extract_key_sentences(self, text: str) -> str:
         """
@@ -108,26 +1295,91 @@ class Pipe:
 
         return result if result else text[:1500]
 
-    def _build_prompt(self, question: str, sources: list) -> str:
-        """Construit le prompt RAG avec les sources."""
+    def _get_tokenizer(self):
+        """
+        Tokenizer du LLM (Qwen), charge une seule fois.
+        Retourne None si transformers ou le tokenizer est indisponible :
+        le comptage passe alors en approximation.
+        """
+        name = self.valves.TOKENIZER_NAME or self.valves.LLM_MODEL
+        with self._tokenizer_lock:
+            if self._tokenizer_name != name:
+                self._tokenizer_name = name
+                self._tokenizer = None
+                if AutoTokenizer is not None:
+                    try:
+                        self._tokenizer = AutoTokenizer.from_pretrained(name)
+                        print(f"[Prompt] Tokenizer charge : {name}")
+                    except Exception as e:
+                        print(f"[Prompt] Tokenizer {name} indisponible, comptage approximatif : {e}")
+            return self._tokenizer
+
+    def _count_tokens(self, text: str) -> int:
+        tokenizer = self._get_tokenizer()
+        if tokenizer is None:
+            return len(text) // 3 + 1
+        return len(tokenizer.encode(text, add_special_tokens=False))
+
+    def _truncate_tokens(self, text: str, max_tokens: int) -> str:
+        tokenizer = self._get_tokenizer()
+        if tokenizer is None:
+            return text[:max_tokens * 3]
+        ids = tokenizer.encode(text, add_special_tokens=False)
+        return tokenizer.decode(ids[:max_tokens])
+
+    def _build_prompt(self, question: str, sources: list):
+        """
+        Construit le prompt RAG dans un budget de tokens fixe.
+        Ordre : prefixe stable (instructions), sources, puis question.
+        Les sources sont prises par rang ; une source qui depasse le budget
+        restant est ecartee et les suivantes, plus courtes, sont encore essayees.
+        Seule la premiere source est tronquee si elle depasse a elle seule le budget.
+        Retourne (prompt, sources retenues, statistiques).
+        """
+        budget = self.valves.CONTEXT_TOKEN_BUDGET
         context = ""
-        for i, s in enumerate(sources, 1):
+        used = 0
+        packed = []
+        truncated = 0
+        for s in sources:
             extracted = self._extract_key_sentences(s["content"])
-            context += (
-                f"--- SOURCE {i} : {s['doc']} (page {s['page']}) ---\n"
-                f"{extracted}\n\n"
-            )
+            header = f"--- SOURCE {len(packed) + 1} : {s['doc']} (page {s['page']}) ---\n"
+            block = f"{header}{extracted}\n\n"
+            tokens = self._count_tokens(block)
+            if used + tokens > budget:
+                if packed:
+                    continue
+                remaining = budget - self._count_tokens(header)
+                block = f"{header}{self._truncate_tokens(extracted, max(remaining, 0))}\n\n"
+                tokens = self._count_tokens(block)
+                truncated += 1
+            context += block
+            used += tokens
+            packed.append(s)
+            if budget - used < self.MIN_SOURCE_TOKENS:
+                break
 
         prompt = (
-            f"EXTRAITS DE DOCUMENTS OFFICIELS ANSTAT :\n\n"
+            f"{self.RAG_PROMPT_PREFIX}"
             f"{context}"
-            f"QUESTION : {question}\n\n"
-            f"Reponds en utilisant les donnees ci-dessus. "
-            f"Donne les chiffres exacts, puis explique et contextualise. "
-            f"Indique le document et la page pour chaque information."
+            f"QUESTION : {question}"
         )
 
-        return prompt
+        stats = {
+            "prefix_tokens": self._count_tokens(self.RAG_SYSTEM_MESSAGE + self.RAG_PROMPT_PREFIX),
+            "context_tokens": used,
+            "question_tokens": self._count_tokens(question),
+            "sources_packed": len(packed),
+            "sources_total": len(sources),
+            "sources_truncated": truncated,
+        }
+        print(
+            f"[Prompt] {stats['sources_packed']}/{stats['sources_total']} sources, "
+            f"{used}/{budget} tokens de contexte "
+            f"(prefixe stable {stats['prefix_tokens']}, question {stats['question_tokens']}, "
+            f"tronquees {truncated})"
+        )
+        return prompt, packed, stats
 
     def _format_sources(self, sources: list) -> str:
         """Formate les sources pour les ajouter a la fin de la reponse."""
@@ -140,88 +1392,81 @@ class Pipe:
         """
         Utilise le LLM pour determiner si le message necessite une recherche documentaire.
         Appel non-streaming, max 5 tokens, timeout court.
-        Fallback sur heuristique simple en cas d'echec.
+        Fallback sur heuristique simple en cas d'echec ou de disjoncteur ouvert.
         """
         try:
-            resp = requests.post(
+            resp = self._request(
+                "llm",
                 f"{self.valves.LLM_API_URL}/chat/completions",
-                json={
-                    "model": self.valves.LLM_MODEL,
-                    "messages": [
-                        {
-                            "role": "system",
-                            "content": (
-                                "Reponds uniquement par OUI ou NON. "
-                                "Est-ce que ce message necessite une recherche dans des documents "
-                                "statistiques officiels (rapports, enquetes, donnees chiffrees) ? "
-                                "NON si c'est une salutation, une question sur toi-meme, ou un message conversationnel. "
-                                "OUI si c'est une question sur des donnees, statistiques, ou informations factuelles."
-                            ),
-                        },
-                        {"role": "user", "content": question},
-                    ],
-                    "max_tokens": 5,
-                    "temperature": 0.0,
-                    "stream": False,
-                },
-                headers={"Content-Type": "application/json"},
-                timeout=10,
+                self._intent_payload(question),
+                self.valves.INTENT_TIMEOUT,
             )
             if resp.status_code == 200:
-                answer = resp.json()["choices"][0]["message"]["content"].strip().upper()
-                print(f"[Intent] '{question[:50]}' → {answer}")
-                return answer.startswith("NON")
+                return self._parse_intent(question, resp.json())
         except Exception as e:
             print(f"[Intent] Erreur classifieur, fallback heuristique : {e}")
-        # Fallback : message court sans mot-cle documentaire
-        q = question.strip()
-        return len(q.split()) <= 4 and not re.search(r'\d|taux|donnee|rapport|enquete|statistique', q, re.IGNORECASE)
+        return self._is_conversational_heuristic(question)
 
-    def _stream_direct(self, question: str) -> Generator:
-        """Appelle le LLM sans contexte RAG pour les messages conversationnels."""
-        system_message = (
-            "Tu es l'assistant documentaire de l'ANSTAT "
-            "(Agence Nationale de la Statistique de Cote d'Ivoire). "
-            "Reponds de maniere courte et amicale en francais. "
-            "Si l'utilisateur pose une vraie question sur des donnees statistiques, "
-            "invite-le a reformuler pour que tu puisses chercher dans les documents."
+    def _stream_chat(self, payload: dict, timings: _Timings = None) -> Generator:
+        """
+        Streame les tokens d'une completion vLLM.
+        Leve _DependencyError si vLLM est indisponible, RuntimeError si le statut n'est pas 200.
+        Au-dela de REQUEST_TIMEOUT, la generation est coupee (la connexion fermee l'arrete cote vLLM).
+        """
+        if timings is not None:
+            timings.llm_started()
+        resp = self._request(
+            "llm",
+            f"{self.valves.LLM_API_URL}/chat/completions",
+            payload,
+            self.valves.LLM_FIRST_TOKEN_TIMEOUT,
+            stream=True,
         )
+        with resp:
+            if resp.status_code != 200:
+                raise RuntimeError(f"Erreur LLM (status {resp.status_code})")
+            deadline = time.monotonic() + self.valves.REQUEST_TIMEOUT
+            coalescer = self._coalescer()
+            # Lignes en bytes, decodees en UTF-8 par _parse_sse_line
+            # (vLLM n'annonce pas de charset : requests supposerait du latin-1).
+            # Lecture bloquante : l'envoi par le temps attend le token suivant (voir _TokenCoalescer)
+            for line in resp.iter_lines():
+                done, token = self._parse_sse_line(line)
+                if done:
+                    break
+                if token:
+                    text = coalescer.push(token)
+                    if text:
+                        if timings is not None:
+                            timings.first_token()
+                        yield text
+                if time.monotonic() > deadline:
+                    print(f"[RAG Pipe] Generation coupee apres {self.valves.REQUEST_TIMEOUT}s")
+                    if timings is not None:
+                        timings.finish(coalescer.tokens)
+                    yield coalescer.flush() + self.TIMEOUT_NOTICE
+                    return
+            tail = coalescer.flush()
+            if tail:
+                yield tail
+            if timings is not None:
+                timings.finish(coalescer.tokens)
+            self._log_coalescer(coalescer)
+
+    def _stream_direct(self, question: str, notice: str = "", timings: _Timings = None) -> Generator:
+        """Appelle le LLM sans contexte RAG pour les messages conversationnels."""
+        if notice:
+            yield notice
         try:
-            with requests.post(
-                f"{self.valves.LLM_API_URL}/chat/completions",
-                json={
-                    "model": self.valves.LLM_MODEL,
-                    "messages": [
-                        {"role": "system", "content": system_message},
-                        {"role": "user", "content": question},
-                    ],
-                    "max_tokens": 200,
-                    "temperature": 0.7,
-                    "stream": True,
-                },
-                headers={"Content-Type": "application/json"},
-                timeout=self.valves.REQUEST_TIMEOUT,
-                stream=True,
-            ) as resp:
-                for line in resp.iter_lines(decode_unicode=True):
-                    if not line or not line.startswith("data: "):
-                        continue
-                    data = line[6:]
-                    if data.strip() == "[DONE]":
-                        break
-                    try:
-                        chunk = json.loads(data)
-                        token = chunk.get("choices", [{}])[0].get("delta", {}).get("content", "")
-                        if token:
-                            yield token
-                    except json.JSONDecodeError:
-                        continue
+            yield from self._stream_chat(self._direct_payload(question), timings)
         except Exception as e:
-            yield "Bonjour ! Comment puis-je vous aider ?"
+            yield self.LLM_UNAVAILABLE_MESSAGE if notice else "Bonjour ! Comment puis-je vous aider ?"
+        if timings is not None:
+            self._log_timings(timings, "degraded" if notice else "direct")
 
-    def pipe(self, body: dict) -> Union[str, Generator]:
+    def _pipe_sync(self, body: dict, chat_id: str = None) -> Union[str, Generator]:
         """
-        Pipeline RAG complet :
+        Pipeline RAG complet (mode synchrone) :
         1. Recherche dans les documents (FAISS + reranking)
         2. Extraction des phrases cles avec chiffres
         3. Construction du prompt
@@ -236,82 +1481,348 @@ class Pipe:
             return "Veuillez poser une question."
 
         print(f"[RAG Pipe] Question: {question[:100]}...")
+        self._log_breakers()
+        timings = _Timings()
+
+        # Disjoncteur LLM ouvert : seule une reponse deja en cache peut etre servie
+        llm_down = self._breaker("llm").is_open()
+        if llm_down and self._get_answer_cache() is None:
+            print(f"[RAG Pipe] LLM indisponible (disjoncteur ouvert), reponse immediate")
+            return self.LLM_UNAVAILABLE_MESSAGE
 
-        # Bypass RAG pour les messages conversationnels
-        if self._is_conversational(question):
+        # Bypass RAG pour les messages conversationnels (sauf question de suivi ou deja en cache)
+        entry = self._session_entry(chat_id, messages)
+        follow_up = self._is_follow_up(question, entry)
+        with timings.phase("intent"):
+            conversational = (not follow_up and not self._is_cached_question(question)
+                              and self._is_conversational(question))
+        if conversational:
+            if llm_down:
+                return self.LLM_UNAVAILABLE_MESSAGE
             print(f"[RAG Pipe] Message conversationnel, pas de RAG")
-            return self._stream_direct(question)
+            return self._stream_direct(question, timings=timings)
 
-        # 1. Recherche documentaire
-        sources = self._search(question)
-        print(f"[RAG Pipe] {len(sources)} sources trouvees")
+        # 1. Recherche documentaire (ou sources du tour precedent)
+        with timings.phase("retrieval"):
+            retrieved = self._retrieve(question, chat_id, entry, follow_up)
+        if retrieved is None:
+            if llm_down:
+                return self.LLM_UNAVAILABLE_MESSAGE
+            print(f"[RAG Pipe] Recherche indisponible, bascule sur le mode conversationnel")
+            return self._stream_direct(question, notice=self.SEARCH_DEGRADED_NOTICE, timings=timings)
+        print(f"[RAG Pipe] {len(retrieved)} sources trouvees")
+        self._log_pool_stats("apres recherche")
 
-        if not sources:
-            return (
-                "Je n'ai pas pu effectuer la recherche dans les documents. "
-                "Le service de recherche est peut-etre indisponible."
-            )
+        if not retrieved:
+            return self.SEARCH_UNAVAILABLE_MESSAGE
+
+        # Meme question, memes sources, meme index et modele : reponse deja generee
+        with timings.phase("cache"):
+            cached = self._answer_from_cache(question, retrieved)
+        if cached is not None:
+            summary = self._log_timings(timings, "cache")
+            return cached + (self._format_timings(summary) if self.valves.SHOW_TIMINGS else "")
+        if llm_down:
+            print(f"[RAG Pipe] LLM indisponible (disjoncteur ouvert), pas de reponse en cache")
+            return self.LLM_UNAVAILABLE_MESSAGE
 
         # 2. Construire le prompt avec contexte
-        rag_prompt = self._build_prompt(question, sources)
+        with timings.phase("prompt"):
+            rag_prompt, sources, prompt_stats = self._build_prompt(question, retrieved)
         sources_text = self._format_sources(sources)
 
         # 3. Appeler Qwen2.5 en streaming
-        system_message = (
-            "Tu es l'assistant documentaire de l'ANSTAT "
-            "(Agence Nationale de la Statistique de Cote d'Ivoire). "
-            "On te fournit des extraits de documents officiels. "
-            "Reponds en francais de maniere claire et structuree. "
-            "Donne les chiffres exacts trouves dans les extraits, "
-            "puis explique et contextualise les donnees pour aider l'utilisateur a comprendre. "
-            "Tu peux comparer des periodes, souligner des tendances, "
-            "et mettre en perspective les resultats. "
-            "Cite toujours le document et la page."
-        )
-
         def stream_response():
             try:
-                with requests.post(
-                    f"{self.valves.LLM_API_URL}/chat/completions",
-                    json={
-                        "model": self.valves.LLM_MODEL,
-                        "messages": [
-                            {"role": "system", "content": system_message},
-                            {"role": "user", "content": rag_prompt},
-                        ],
-                        "max_tokens": self.valves.LLM_MAX_TOKENS,
-                        "temperature": self.valves.LLM_TEMPERATURE,
-                        "repetition_penalty": 1.15,
-                        "stream": True,
-                    },
-                    headers={"Content-Type": "application/json"},
-                    timeout=self.valves.REQUEST_TIMEOUT,
-                    stream=True,
-                ) as resp:
-                    if resp.status_code != 200:
-                        yield f"Erreur LLM (status {resp.status_code})"
-                        return
-
-                    for line in resp.iter_lines(decode_unicode=True):
-                        if not line or not line.startswith("data: "):
-                            continue
-                        data = line[6:]
-                        if data.strip() == "[DONE]":
-                            break
-                        try:
-                            chunk = json.loads(data)
-                            delta = chunk.get("choices", [{}])[0].get("delta", {})
-                            token = delta.get("content", "")
-                            if token:
-                                yield token
-                        except json.JSONDecodeError:
-                            continue
-
-                # Ajouter les sources a la fin (connexion deja fermee)
+                answer = []
+                for text in self._stream_chat(self._rag_payload(rag_prompt), timings):
+                    answer.append(text)
+                    yield text
+
+                # Ajouter les sources a la fin (connexion rendue au pool)
+                self._log_pool_stats("fin stream")
                 yield sources_text
+                self._answer_to_cache(question, retrieved, "".join(answer), sources_text)
+                summary = self._log_timings(timings, "rag")
+                if self.valves.SHOW_TIMINGS:
+                    yield self._format_timings(summary)
 
+            except RuntimeError as e:
+                yield str(e)
             except Exception as e:
                 print(f"[RAG Pipe] Stream error: {e}")
                 yield f"\n\nErreur lors de la generation: {e}"
 
         return stream_response()
+
+    # ------------------------------------------------------------------
+    # Mode asynchrone
+    # ------------------------------------------------------------------
+
+    async def _asearch(self, query: str) -> Optional[list]:
+        """Version async de _search."""
+        data = await self._asearch_response(query)
+        return data.get("results", []) if data is not None else None
+
+    async def _asearch_response(self, query: str, with_embedding: bool = False) -> Optional[dict]:
+        """Version async de _search_response."""
+        try:
+            resp = await self._arequest(
+                "rag-search",
+                self.valves.RAG_SEARCH_URL,
+                self._search_payload(query, with_embedding),
+                self.valves.SEARCH_TIMEOUT,
+            )
+            if resp.status_code == 200:
+                data = resp.json()
+                self._index_version = data.get("index_version", self._index_version)
+                return data
+            print(f"[RAG] Search error (status {resp.status_code}): {resp.text}")
+        except Exception as e:
+            print(f"[RAG] Search failed: {e}")
+        return None
+
+    async def _aembed(self, query: str) -> Optional[list]:
+        """Version async de _embed."""
+        try:
+            resp = await self._arequest(
+                "rag-search", self._rag_url("/embed"), {"query": query}, self.valves.SEARCH_TIMEOUT
+            )
+            if resp.status_code == 200:
+                return resp.json()["embedding"]
+            print(f"[Session] Embedding error (status {resp.status_code})")
+        except Exception as e:
+            print(f"[Session] Embedding failed: {e}")
+        return None
+
+    async def _arerank(self, query: str, candidates: list) -> Optional[list]:
+        """Version async de _rerank."""
+        try:
+            resp = await self._arequest(
+                "rag-search",
+                self._rag_url("/rerank"),
+                {"query": query, "candidates": candidates, "top_k_rerank": len(candidates)},
+                self.valves.SEARCH_TIMEOUT,
+            )
+            if resp.status_code == 200:
+                return resp.json().get("results", [])
+            print(f"[Session] Rerank error (status {resp.status_code})")
+        except Exception as e:
+            print(f"[Session] Rerank failed: {e}")
+        return None
+
+    async def _aretrieve(self, question: str, chat_id: str, entry: Optional[dict],
+                         follow_up: bool) -> Optional[list]:
+        """Version async de _retrieve."""
+        if self._get_session_cache() is None or not chat_id:
+            return await self._asearch(question)
+
+        query = f"{entry['anchor']} {question}" if follow_up else question
+        embedding = None
+        if entry is not None:
+            embedding = await self._aembed(question)
+            if embedding is not None and self._should_reuse(chat_id, entry, embedding, follow_up):
+                sources = await self._arerank(query, entry["sources"])
+                if sources:
+                    self._session_store(chat_id, dict(entry, question=question))
+                    return sources[:self.valves.TOP_K_RERANK]
+
+        data = await self._asearch_response(query, with_embedding=entry is None)
+        if data is None:
+            return None
+        self._session_store_search(chat_id, question, entry, follow_up, data, embedding)
+        return data.get("results", [])
+
+    async def _ais_conversational(self, question: str) -> bool:
+        """Version async de _is_conversational."""
+        try:
+            resp = await self._arequest(
+                "llm",
+                f"{self.valves.LLM_API_URL}/chat/completions",
+                self._intent_payload(question),
+                self.valves.INTENT_TIMEOUT,
+            )
+            if resp.status_code == 200:
+                return self._parse_intent(question, resp.json())
+        except Exception as e:
+            print(f"[Intent] Erreur classifieur, fallback heuristique : {e}")
+        return self._is_conversational_heuristic(question)
+
+    async def _astream_chat(self, payload: dict, timings: _Timings = None) -> AsyncGenerator:
+        """Version async de _stream_chat, sans bloquer de thread."""
+        if timings is not None:
+            timings.llm_started()
+        resp = await self._arequest(
+            "llm",
+            f"{self.valves.LLM_API_URL}/chat/completions",
+            payload,
+            self.valves.LLM_FIRST_TOKEN_TIMEOUT,
+            stream=True,
+        )
+        next_line = None
+        try:
+            if resp.status_code != 200:
+                raise RuntimeError(f"Erreur LLM (status {resp.status_code})")
+            deadline = time.monotonic() + self.valves.REQUEST_TIMEOUT
+            coalescer = self._coalescer()
+            finished = False
+            lines = resp.aiter_lines()
+            while True:
+                if next_line is None:
+                    next_line = asyncio.ensure_future(lines.__anext__())
+                # Tampon non vide : envoye a l'echeance meme si vLLM marque une pause.
+                # La lecture en cours n'est pas annulee, elle reste attendue au tour suivant.
+                done, _ = await asyncio.wait({next_line}, timeout=coalescer.remaining())
+                if not done:
+                    yield coalescer.flush()
+                    continue
+                try:
+                    line = next_line.result()
+                except StopAsyncIteration:
+                    break
+                next_line = None
+                # Apres [DONE], on lit la fin du corps sans sortir de la boucle :
+                # une reponse lue jusqu'au bout rend sa connexion au pool.
+                if finished:
+                    continue
+                finished, token = self._parse_sse_line(line)
+                if token:
+                    text = coalescer.push(token)
+                    if text:
+                        if timings is not None:
+                            timings.first_token()
+                        yield text
+                if time.monotonic() > deadline:
+                    print(f"[RAG Pipe] Generation coupee apres {self.valves.REQUEST_TIMEOUT}s")
+                    if timings is not None:
+                        timings.finish(coalescer.tokens)
+                    yield coalescer.flush() + self.TIMEOUT_NOTICE
+                    return
+            tail = coalescer.flush()
+            if tail:
+                yield tail
+            if timings is not None:
+                timings.finish(coalescer.tokens)
+            self._log_coalescer(coalescer)
+        finally:
+            if next_line is not None:
+                next_line.cancel()
+            await self._aclose_stream(resp)
+
+    async def _astream_direct(self, question: str, notice: str = "",
+                              timings: _Timings = None) -> AsyncGenerator:
+        """Version async de _stream_direct."""
+        if notice:
+            yield notice
+        try:
+            async for token in self._astream_chat(self._direct_payload(question), timings):
+                yield token
+        except Exception as e:
+            yield self.LLM_UNAVAILABLE_MESSAGE if notice else "Bonjour ! Comment puis-je vous aider ?"
+        if timings is not None:
+            self._log_timings(timings, "degraded" if notice else "direct")
+
+    async def _astream_response(self, question: str, retrieved: list, rag_prompt: str,
+                                sources_text: str, timings: _Timings) -> AsyncGenerator:
+        """Streame la reponse RAG puis les sources, et la garde en cache."""
+        try:
+            answer = []
+            async for token in self._astream_chat(self._rag_payload(rag_prompt), timings):
+                answer.append(token)
+                yield token
+            self._log_pool_stats("fin stream")
+            yield sources_text
+            self._answer_to_cache(question, retrieved, "".join(answer), sources_text)
+            summary = self._log_timings(timings, "rag")
+            if self.valves.SHOW_TIMINGS:
+                yield self._format_timings(summary)
+        except RuntimeError as e:
+            yield str(e)
+        except Exception as e:
+            print(f"[RAG Pipe] Stream error: {e}")
+            yield f"\n\nErreur lors de la generation: {e}"
+
+    async def _apipe(self, body: dict, chat_id: str = None) -> Union[str, AsyncGenerator]:
+        """Meme pipeline que _pipe_sync, sans bloquer de thread OpenWebUI."""
+        messages = body.get("messages", [])
+        if not messages:
+            return "Aucun message fourni."
+
+        question = messages[-1].get("content", "")
+        if not question.strip():
+            return "Veuillez poser une question."
+
+        print(f"[RAG Pipe] Question (async): {question[:100]}...")
+        self._log_breakers()
+        timings = _Timings()
+
+        llm_down = self._breaker("llm").is_open()
+        if llm_down and self._get_answer_cache() is None:
+            print(f"[RAG Pipe] LLM indisponible (disjoncteur ouvert), reponse immediate")
+            return self.LLM_UNAVAILABLE_MESSAGE
+
+        entry = self._session_entry(chat_id, messages)
+        follow_up = self._is_follow_up(question, entry)
+        with timings.phase("intent"):
+            conversational = (not follow_up and not self._is_cached_question(question)
+                              and await self._ais_conversational(question))
+        if conversational:
+            if llm_down:
+                return self.LLM_UNAVAILABLE_MESSAGE
+            print(f"[RAG Pipe] Message conversationnel, pas de RAG")
+            return self._astream_direct(question, timings=timings)
+
+        with timings.phase("retrieval"):
+            retrieved = await self._aretrieve(question, chat_id, entry, follow_up)
+        if retrieved is None:
+            if llm_down:
+                return self.LLM_UNAVAILABLE_MESSAGE
+            print(f"[RAG Pipe] Recherche indisponible, bascule sur le mode conversationnel")
+            return self._astream_direct(question, notice=self.SEARCH_DEGRADED_NOTICE, timings=timings)
+        print(f"[RAG Pipe] {len(retrieved)} sources trouvees")
+        self._log_pool_stats("apres recherche")
+
+        if not retrieved:
+            return self.SEARCH_UNAVAILABLE_MESSAGE
+
+        with timings.phase("cache"):
+            cached = self._answer_from_cache(question, retrieved)
+        if cached is not None:
+            summary = self._log_timings(timings, "cache")
+            return cached + (self._format_timings(summary) if self.valves.SHOW_TIMINGS else "")
+        if llm_down:
+            print(f"[RAG Pipe] LLM indisponible (disjoncteur ouvert), pas de reponse en cache")
+            return self.LLM_UNAVAILABLE_MESSAGE
+
+        # Tokenisation (et chargement initial du tokenizer) hors de la boucle asyncio
+        with timings.phase("prompt"):
+            rag_prompt, sources, prompt_stats = await asyncio.to_thread(
+                self._build_prompt, question, retrieved
+            )
+        sources_text = self._format_sources(sources)
+        return self._astream_response(question, retrieved, rag_prompt, sources_text, timings)
+
+    async def _iterate_in_thread(self, generator: Generator) -> AsyncGenerator:
+        """Consomme un generateur synchrone token par token dans un thread."""
+        sentinel = object()
+        while True:
+            token = await asyncio.to_thread(next, generator, sentinel)
+            if token is sentinel:
+                break
+            yield token
+
+    async def pipe(self, body: dict, __metadata__: Optional[dict] = None) -> Union[str, AsyncGenerator]:
+        """
+        Point d'entree OpenWebUI.
+        Mode async (httpx) par defaut ; sinon le pipeline synchrone tourne
+        dans un thread pour ne pas bloquer la boucle d'OpenWebUI.
+        `__metadata__` (fourni par OpenWebUI) donne l'identifiant de conversation.
+        """
+        chat_id = (__metadata__ or {}).get("chat_id")
+        if self.valves.ASYNC_MODE and httpx is not None:
+            return await self._apipe(body, chat_id)
+
+        result = await asyncio.to_thread(self._pipe_sync, body, chat_id)
+        if isinstance(result, str):
+            return result
+        return self._iterate_in_thread(result)
@@ -0,0 +1,182 @@
+# ============================================================================
+# ANSTAT_ANNOTATION.py
+# ANNOTATION DES CHUNKS PAR DOMAINE STATISTIQUE
+# Python 3.12
+# ============================================================================
+#
+# Taxonomie configurable (domaine -> mots-clés) compilée en un seul automate:
+# tous les mots-clés sont cherchés en une passe par chunk. Les annotations
+# deviennent des colonnes du corpus (domains, primary_domain), reprises dans
+# chunk_map.json pour la recherche filtrée de l'API (/search "domains").
+#
+# Fichier de taxonomie (JSON): {"domaine": ["mot-clé", "préfixe*", ...], ...}
+# - casse et accents ignorés, espaces multiples équivalents à un seul ; écrire les ligatures
+#   (œ, æ) pour accepter aussi leur forme décomposée (oe, ae)
+# - mot-clé entier par défaut ; "*" final pour un préfixe (chôm* -> chômage, chômeurs)
+# - un mot-clé peut appartenir à plusieurs domaines
+
+import json
+import hashlib
+import re
+import unicodedata
+from collections import Counter
+from functools import lru_cache
+from pathlib import Path
+from typing import List, Dict, Any
+
+DEFAULT_TAXONOMY = {
+    "pauvrete": [
+        "pauvreté", "pauvre*", "seuil de pauvreté", "extrême pauvreté", "vulnérab*", "inégalit*",
+        "indice de gini", "privation*", "insécurité alimentaire", "transferts monétaires"
+    ],
+    "emploi": [
+        "emploi*", "chômage", "chômeur*", "sous-emploi", "main-d'œuvre", "taux d'activité",
+        "salarié*", "salaire*", "secteur informel", "travailleur*", "inactivité"
+    ],
+    "sante": [
+        "santé", "sanitaire*", "maladie*", "paludisme", "vih", "sida", "vaccin*", "nutrition",
+        "malnutrition", "mortalité infantile", "mortalité maternelle", "hôpita*", "soins"
+    ],
+    "demographie": [
+        "démograph*", "population*", "recensement*", "rgph", "natalité", "fécondité", "naissance*",
+        "décès", "mortalité", "espérance de vie", "migration*", "migrant*", "ménage*"
+    ],
+    "education": [
+        "éducation", "scolari*", "école*", "élève*", "enseignement", "alphabétisation",
+        "analphabét*", "étudiant*", "abandon scolaire"
+    ],
+    "agriculture": [
+        "agricole*", "agriculture", "cacao", "café", "anacarde", "vivrier*", "élevage", "pêche",
+        "récolte*", "exploitation agricole", "production agricole"
+    ],
+    "prix": [
+        "inflation", "ipc", "indice des prix", "prix à la consommation", "coût de la vie",
+        "pouvoir d'achat"
+    ],
+    "finances_publiques": [
+        "budget*", "budgétaire*", "finances publiques", "dépenses publiques", "recettes fiscales",
+        "fiscal*", "impôt*", "dette publique", "déficit budgétaire"
+    ],
+    "comptes_nationaux": [
+        "pib", "produit intérieur brut", "croissance économique", "valeur ajoutée",
+        "comptes nationaux", "investissement*", "formation brute de capital"
+    ],
+    "commerce_exterieur": [
+        "exportation*", "importation*", "commerce extérieur", "balance commerciale", "douane*",
+        "échanges extérieurs"
+    ]
+}
+
+# Ligatures et apostrophes typographiques, avant la suppression des accents (NFKD)
+FOLD_TABLE = str.maketrans({"œ": "oe", "Œ": "oe", "æ": "ae", "Æ": "ae", "’": "'", "‘": "'"})
+
+# Caractère d'un mot-clé (sans accent) -> variantes acceptées dans le texte (casse ignorée)
+CHAR_VARIANTS = {
+    "a": "[aàâä]", "e": "[eéèêë]", "i": "[iîï]", "o": "[oôö]", "u": "[uùûü]", "y": "[yÿ]",
+    "c": "[cç]", "œ": "(?:œ|oe)", "æ": "(?:æ|ae)", "'": "['’‘]", " ": r"\s+"
+}
+
+
+def fold(text: str) -> str:
+    """Minuscules sans accents ni espaces multiples: forme commune des mots-clés et des occurrences"""
+    text = unicodedata.normalize("NFKD", text.translate(FOLD_TABLE).lower())
+    return " ".join(text.encode("ascii", "ignore").decode("ascii").split())
+
+
+def strip_accents(keyword: str) -> str:
+    """Mot-clé en minuscules sans accents, ligatures gardées (elles ont leurs variantes)"""
+    keyword = unicodedata.normalize("NFKD", keyword.lower())
+    return " ".join("".join(c for c in keyword if not unicodedata.combining(c)).split())
+
+
+class KeywordAutomaton:
+    """
+    Mots-clés compilés en une expression régulière arborescente (trie): les mots partageant un
+    préfixe partagent un chemin, une seule passe sur le texte brut trouve toutes les occurrences
+    (la plus longue en premier à chaque position), casse et accents ignorés par le motif lui-même.
+    Coût indépendant du nombre de mots-clés, contrairement à une recherche mot par mot.
+    """
+
+    def __init__(self, keywords: List[str]):
+        trie = {}
+        for keyword in keywords:
+            prefix = keyword.endswith("*")
+            node = trie
+            for char in strip_accents(keyword.rstrip("*")):
+                node = node.setdefault(char, {})
+            # Fin de mot-clé: "" = mot entier, "*" = préfixe (le préfixe l'emporte)
+            node[""] = "*" if prefix or node.get("") == "*" else ""
+        self.pattern = re.compile(r"(?<!\w)" + self._compile(trie), re.IGNORECASE)
+
+    @classmethod
+    def _compile(cls, node: Dict[str, Any]) -> str:
+        alternatives = [CHAR_VARIANTS.get(char, re.escape(char)) + cls._compile(child)
+                        for char, child in sorted(node.items()) if char]
+        if "" in node:
+            alternatives.append("" if node[""] == "*" else r"(?!\w)")
+        if len(alternatives) == 1:
+            return alternatives[0]
+        return "(?:" + "|".join(alternatives) + ")"
+
+    def count(self, text: str) -> Counter:
+        """Occurrences de chaque mot-clé (forme fold(), sans "*")"""
+        return Counter(fold(match) for match in self.pattern.findall(text))
+
+
+class TaxonomyAnnotator:
+    """Annotation d'un chunk par les domaines de la taxonomie dont il contient des mots-clés"""
+
+    # Colonnes ajoutées au corpus
+    columns = {"domains": list, "primary_domain": str}
+
+    def __init__(self, taxonomy: Dict[str, List[str]], min_hits: int = 1):
+        self.taxonomy = taxonomy
+        self.min_hits = min_hits
+        self.keyword_domains = {}
+        for domain, keywords in taxonomy.items():
+            for keyword in keywords:
+                self.keyword_domains.setdefault(fold(keyword.rstrip("*")), []).append(domain)
+        self.order = {domain: rank for rank, domain in enumerate(taxonomy)}
+        self.automaton = KeywordAutomaton([k for keywords in taxonomy.values() for k in keywords])
+
+    def fingerprint(self) -> str:
+        """Empreinte de la taxonomie (entre dans celle de la configuration de chunking)"""
+        params = {"taxonomy": self.taxonomy, "min_hits": self.min_hits}
+        return hashlib.sha256(json.dumps(params, sort_keys=True).encode()).hexdigest()[:16]
+
+    def annotate(self, text: str) -> Dict[str, Any]:
+        """Domaines par nombre d'occurrences décroissant (ordre de la taxonomie à égalité)"""
+        hits = Counter()
+        for keyword, count in self.automaton.count(text).items():
+            for domain in self.keyword_domains.get(keyword, ()):
+                hits[domain] += count
+        domains = sorted((d for d, n in hits.items() if n >= self.min_hits),
+                         key=lambda d: (-hits[d], self.order[d]))
+        return {"domains": domains, "primary_domain": domains[0] if domains else None}
+
+
+def load_taxonomy(taxonomy_file: Path) -> Dict[str, List[str]]:
+    """Taxonomie JSON {domaine: [mots-clés]}"""
+    with open(taxonomy_file, "r", encoding="utf-8") as f:
+        taxonomy = json.load(f)
+    if not isinstance(taxonomy, dict) or not all(
+        isinstance(keywords, list) and all(isinstance(k, str) and k.rstrip("*") for k in keywords)
+        for keywords in taxonomy.values()
+    ):
+        raise ValueError(f"Taxonomie invalide: {taxonomy_file} (attendu {{domaine: [mots-clés]}})")
+    return taxonomy
+
+
+@lru_cache(maxsize=4)
+def load_annotator(taxonomy_file: Path = None, min_hits: int = 1) -> TaxonomyAnnotator:
+    """Annotateur de la taxonomie (défaut: DEFAULT_TAXONOMY), compilé une fois par processus"""
+    taxonomy = load_taxonomy(taxonomy_file) if taxonomy_file else DEFAULT_TAXONOMY
+    return TaxonomyAnnotator(taxonomy, min_hits)
+
+
+if __name__ == "__main__":
+    import sys
+
+    # Test rapide: python anstat_annotation.py "texte" [taxonomie.json]
+    annotator = load_annotator(Path(sys.argv[2]) if len(sys.argv) > 2 else None)
+    print(annotator.annotate(sys.argv[1] if len(sys.argv) > 1 else ""))
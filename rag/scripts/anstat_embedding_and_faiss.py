@@ -3,11 +3,20 @@
 # Version optimisée pour documents institutionnels
 # =========================================================
 
+import argparse
+import atexit
+import hashlib
 import json
+import multiprocessing
+import os
+import time
 import unicodedata
 import re
+import zlib
+from functools import lru_cache
+from itertools import islice
 from pathlib import Path
-from typing import List, Dict, Any, Tuple
+from typing import List, Dict, Any, Iterable, Iterator, Optional, Tuple
 import numpy as np
 from tqdm import tqdm
 from sentence_transformers import SentenceTransformer
@@ -17,6 +26,8 @@ import faiss
 # CONFIGURATION
 # -----------------------
 CHUNKS_DIR = Path("./chunks_output_fast")  # Tes chunks ultra rapides
+# Corpus de la préparation (une ligne JSON par chunk) ; à défaut, anciens fichiers *_chunks.json
+CORPUS_FILE = CHUNKS_DIR / "corpus.jsonl"
 OUTPUT_DIR = Path("./embeddings_optimized")
 EMBEDDING_MODEL_NAME = "dangvantuan/sentence-camembert-base"  # MEILLEUR pour français
 # Ou: "sentence-transformers/paraphrase-multilingual-MiniLM-L12-v2"
@@ -25,6 +36,59 @@ EMBEDDING_MODEL_NAME = "sentence-transformers/paraphrase-multilingual-MiniLM-L12
 FAISS_INDEX_FILE = OUTPUT_DIR / "faiss_index.bin"
 CHUNK_MAP_FILE = OUTPUT_DIR / "chunk_map.json"
 METADATA_FILE = OUTPUT_DIR / "metadata.json"
+EMBEDDINGS_FILE = OUTPUT_DIR / "embeddings.npy"
+# Groupes de quasi-doublons écartés (audit)
+DUPLICATES_FILE = OUTPUT_DIR / "duplicates.json"
+# Position FAISS -> chunk_id (null = chunk supprime par une mise a jour incrementale)
+INDEX_IDS_FILE = OUTPUT_DIR / "index_ids.json"
+# Quasi-doublons écartés (chunk_id -> chunk gardé + entrée chunk_map): réindexés si le chunk
+# gardé est supprimé par une mise à jour incrémentale
+DROPPED_CHUNKS_FILE = OUTPUT_DIR / "dropped_chunks.json"
+# Journal des mises à jour incrémentales (une ligne JSON par opération: ajout, suppression,
+# quasi-doublons) et vecteurs float32 bruts des ajouts. Une mise à jour n'écrit que sa
+# modification ; les fichiers de base ne sont réécrits qu'à la compaction (journal vidé).
+JOURNAL_FILE = OUTPUT_DIR / "index_journal.jsonl"
+JOURNAL_VECTORS_FILE = OUTPUT_DIR / "journal_vectors.f32"
+
+# Cache persistant des embeddings (un sous-dossier par modele)
+EMBEDDING_CACHE_DIR = OUTPUT_DIR / "embedding_cache"
+
+# Quasi-doublons: similarité de Jaccard estimée (MinHash sur des shingles de mots) au-dela de laquelle
+# un chunk est écarté
+DEDUP_THRESHOLD = 0.85
+DEDUP_SHINGLE_SIZE = 5
+DEDUP_PERMUTATIONS = 128
+# Signatures MinHash des chunks indexés (uint32, une ligne par position de l'index): une mise à
+# jour incrémentale ne compare les nouveaux chunks qu'aux chunks des mêmes bandes LSH
+DEDUP_SIGNATURES_FILE = OUTPUT_DIR / "dedup_signatures.npy"
+
+# Taille des lots de la construction en flux (chunks embeddés et ajoutés à l'index d'un coup)
+BUILD_BATCH_SIZE = 1024
+# Encodage multi-processus: ENCODE_WORKERS processus de ENCODE_THREADS threads torch chacun
+# (0 ou 1 = encodage dans le processus principal). Textes répartis par lots de ENCODE_SHARD_SIZE.
+ENCODE_WORKERS = 0
+ENCODE_THREADS = 2
+ENCODE_SHARD_SIZE = 256
+# Débit cumulé de l'encodage (textes / secondes), pour régler processus et threads
+ENCODE_STATS = {"texts": 0, "seconds": 0.0}
+# Au-dela, l'index FlatIP est converti en IVF
+IVF_THRESHOLD = 10000
+# Codage des vecteurs dans l'index: "flat" (float32), "sq8" (1 octet par dimension) ou "pq" (PQ_M octets
+# par vecteur). Avec sq8/pq, l'API re-score exactement la liste courte (top_k x RESCORE_FACTOR)
+# depuis embeddings.npy.
+INDEX_TYPE = "flat"
+PQ_M = 48
+# PQ 8 bits: 256 centroïdes par sous-espace à entraîner ; en dessous, repli sur SQ8
+PQ_MIN_TRAIN = 256
+RESCORE_FACTOR = 4
+# Points d'entraînement des index IVF/SQ8/PQ (>= 39 x 256 centroïdes recommandés par FAISS)
+TRAIN_SAMPLE = 25600
+
+# Compaction de l'index au-dela de cette proportion de positions supprimees
+COMPACT_RATIO = 0.2
+
+# Point de reprise de la construction en flux, mis à jour après chaque lot (supprimé à la fin)
+BUILD_CHECKPOINT_FILE = OUTPUT_DIR / "build_checkpoint.json"
 
 OUTPUT_DIR.mkdir(parents=True, exist_ok=True)
 
@@ -55,209 +119,1110 @@ def clean_text_enhanced(text: str) -> str:
     
     return text.strip()
 
-def load_and_filter_chunks(chunks_dir: Path) -> List[Dict[str, Any]]:
-    """Charge et filtre intelligemment les chunks"""
-    all_chunks = []
-    json_files = list(chunks_dir.glob("*_chunks.json"))
+def fsync_path(path: Path):
+    """Force l'écriture sur disque d'un fichier déjà fermé"""
+    with open(path, "rb") as f:
+        os.fsync(f.fileno())
+
+def atomic_write_json(path: Path, data: Any, **kwargs):
+    """Écriture atomique et durable (temporaire + fsync + rename): jamais de fichier partiel"""
+    tmp_path = path.with_suffix(path.suffix + ".tmp")
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(data, f, ensure_ascii=False, **kwargs)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+def load_and_filter_chunks(chunks_dir: Path, verbose: bool = True) -> Iterator[Dict[str, Any]]:
+    """Charge et filtre intelligemment les chunks, en flux (corpus.jsonl, sinon un fichier à la fois)"""
+    corpus_file = chunks_dir / CORPUS_FILE.name
+    if corpus_file.exists():
+        if verbose:
+            print(f"📁 Corpus: {corpus_file}")
+        yield from iter_corpus_chunks(corpus_file)
+        return
     
-    print(f"📁 Fichiers trouvés: {len(json_files)}")
+    json_files = sorted(chunks_dir.glob("*_chunks.json"))
     
-    for file_path in tqdm(json_files, desc="Chargement des chunks"):
-        try:
-            with open(file_path, "r", encoding="utf-8") as f:
-                data = json.load(f)
-            
-            # Gestion des deux formats possibles
-            if isinstance(data, dict):
-                # Format: {"chunks": [...], "metadata": {...}}
-                chunks_list = data.get("chunks", [])
-                doc_metadata = data.get("metadata", {})
-            else:
-                # Format: liste directe
-                chunks_list = data
-                doc_metadata = {"document_name": file_path.stem}
+    if verbose:
+        print(f"📁 Fichiers trouvés: {len(json_files)}")
+    
+    for file_path in tqdm(json_files, desc="Chargement des chunks", disable=not verbose):
+        yield from load_chunks_file(file_path)
+
+def iter_corpus_chunks(corpus_file: Path) -> Iterator[Dict[str, Any]]:
+    """Chunks filtrés d'un corpus JSONL (colonnes à plat de la préparation), ligne par ligne"""
+    with open(corpus_file, "r", encoding="utf-8") as f:
+        for line in f:
+            chunk = chunk_from_corpus_row(json.loads(line))
+            if chunk:
+                yield chunk
+
+def chunk_from_corpus_row(row: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    """Chunk filtré depuis une ligne du corpus (None si écarté)"""
+    chunk = {
+        "chunk_id": row["chunk_id"],
+        "text": row["text"],
+        "metadata": {k: v for k, v in row.items() if k not in ("chunk_id", "text") and v is not None}
+    }
+    return filter_chunk(chunk, row["document_name"], row["source_file"])
+
+def load_chunks_file(file_path: Path) -> List[Dict[str, Any]]:
+    """Charge et filtre les chunks d'un fichier *_chunks.json (ou d'un corpus .jsonl)"""
+    if file_path.suffix == ".jsonl":
+        return list(iter_corpus_chunks(file_path))
+    
+    all_chunks = []
+    try:
+        with open(file_path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        
+        # Gestion des deux formats possibles
+        if isinstance(data, dict):
+            # Format: {"chunks": [...], "metadata": {...}}
+            chunks_list = data.get("chunks", [])
+            doc_metadata = data.get("metadata", {})
+        else:
+            # Format: liste directe
+            chunks_list = data
+            doc_metadata = {"document_name": file_path.stem}
+        
+        for chunk in chunks_list:
+            filtered = filter_chunk(chunk, doc_metadata.get("document_name", file_path.stem), file_path.name)
+            if filtered:
+                all_chunks.append(filtered)
             
-            for chunk in chunks_list:
-                # Vérifier la structure
-                if not isinstance(chunk, dict):
-                    continue
-                
-                # Extraire le texte (support multiple formats)
-                text = ""
-                if "content" in chunk:
-                    text = chunk["content"]
-                elif "text" in chunk:
-                    text = chunk["text"]
-                else:
-                    continue
-                
-                # Nettoyer
-                cleaned_text = clean_text_enhanced(text)
-                
-                # FILTRES DE QUALITÉ
-                # 1. Longueur minimale
-                if len(cleaned_text) < 100:
-                    continue
-                
-                # 2. Longueur maximale
-                if len(cleaned_text) > 3000:
-                    cleaned_text = cleaned_text[:3000] + "..."
-                
-                # 3. Vérifier que c'est du vrai texte
-                if cleaned_text.isnumeric() or len(set(cleaned_text)) < 10:
-                    continue
-                
-                # 4. Ratio de mots uniques (éviter les répétitions)
-                words = cleaned_text.split()
-                if len(words) < 15:
-                    continue
-                
-                unique_ratio = len(set(words)) / len(words)
-                if unique_ratio < 0.3:  # Trop répétitif
-                    continue
-                
-                # Préparer les métadonnées
-                metadata = chunk.get("metadata", {})
-                if isinstance(metadata, dict):
-                    # Enrichir avec les métadonnées du document
-                    metadata.update({
-                        "document_name": doc_metadata.get("document_name", file_path.stem),
-                        "source_file": str(file_path.name),
-                        "chunk_length": len(cleaned_text),
-                        "word_count": len(words)
-                    })
-                else:
-                    metadata = {
-                        "document_name": doc_metadata.get("document_name", file_path.stem),
-                        "source_file": str(file_path.name)
-                    }
-                
-                # ID du chunk
-                chunk_id = chunk.get("chunk_id")
-                if not chunk_id:
-                    import hashlib
-                    chunk_id = hashlib.md5(cleaned_text.encode()).hexdigest()[:16]
-                
-                all_chunks.append({
-                    "chunk_id": chunk_id,
-                    "content": cleaned_text,
-                    "metadata": metadata,
-                    "original_text": text[:500]  # Garder un extrait original
-                })
-                
-        except Exception as e:
-            print(f"⚠️ Erreur avec {file_path.name}: {str(e)}")
+    except Exception as e:
+        print(f"⚠️ Erreur avec {file_path.name}: {str(e)}")
     
     return all_chunks
 
-def deduplicate_chunks(chunks: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
-    """Supprime les doublons sémantiques"""
-    if len(chunks) <= 1:
-        return chunks
+def filter_chunk(chunk: Dict[str, Any], document_name: str, source_file: str) -> Optional[Dict[str, Any]]:
+    """Nettoie un chunk et applique les filtres de qualité (None si écarté)"""
+    # Vérifier la structure
+    if not isinstance(chunk, dict):
+        return None
     
-    # Méthode simple: basée sur les débuts de texte
-    seen_starts = set()
-    unique_chunks = []
-    
-    for chunk in chunks:
+    # Extraire le texte (support multiple formats)
+    text = ""
+    if "content" in chunk:
         text = chunk["content"]
-        if len(text) < 100:
-            signature = text
-        else:
-            signature = text[:150]  # 150 premiers caractères
+    elif "text" in chunk:
+        text = chunk["text"]
+    else:
+        return None
+    
+    # Nettoyer
+    cleaned_text = clean_text_enhanced(text)
+    
+    # FILTRES DE QUALITÉ
+    # 1. Longueur minimale
+    if len(cleaned_text) < 100:
+        return None
+    
+    # 2. Longueur maximale
+    if len(cleaned_text) > 3000:
+        cleaned_text = cleaned_text[:3000] + "..."
+    
+    # 3. Vérifier que c'est du vrai texte
+    if cleaned_text.isnumeric() or len(set(cleaned_text)) < 10:
+        return None
+    
+    # 4. Ratio de mots uniques (éviter les répétitions)
+    words = cleaned_text.split()
+    if len(words) < 15:
+        return None
+    
+    unique_ratio = len(set(words)) / len(words)
+    if unique_ratio < 0.3:  # Trop répétitif
+        return None
+    
+    # Préparer les métadonnées
+    metadata = chunk.get("metadata", {})
+    if isinstance(metadata, dict):
+        # Enrichir avec les métadonnées du document
+        metadata.update({
+            "document_name": document_name,
+            "source_file": source_file,
+            "chunk_length": len(cleaned_text),
+            "word_count": len(words)
+        })
+    else:
+        metadata = {
+            "document_name": document_name,
+            "source_file": source_file
+        }
+    
+    # ID du chunk
+    chunk_id = chunk.get("chunk_id")
+    if not chunk_id:
+        chunk_id = hashlib.md5(cleaned_text.encode()).hexdigest()[:16]
+    
+    return {
+        "chunk_id": chunk_id,
+        "content": cleaned_text,
+        "metadata": metadata,
+        "original_text": text[:500]  # Garder un extrait original
+    }
+
+class NearDuplicateIndex:
+    """
+    Détection des quasi-doublons: signature MinHash des shingles de mots de chaque chunk,
+    indexée par bandes (LSH). Un chunk n'est comparé qu'aux chunks gardés partageant au moins
+    une bande avec lui, ce qui garde un temps ~linéaire sur le corpus.
+    """
+    
+    PRIME = 4294967291  # plus grand premier < 2^32
+    
+    def __init__(self, threshold: float = DEDUP_THRESHOLD, num_perm: int = DEDUP_PERMUTATIONS,
+                 shingle_size: int = DEDUP_SHINGLE_SIZE):
+        rng = np.random.default_rng(1)
+        self.a = rng.integers(1, 2**31, num_perm, dtype=np.uint64)
+        self.b = rng.integers(0, 2**32, num_perm, dtype=np.uint64)
+        self.threshold = threshold
+        self.shingle_size = shingle_size
+        # Bandes x lignes: plus haut seuil LSH (1/bandes)^(1/lignes) sous le seuil demandé (rappel),
+        # les candidats étant ensuite vérifiés sur la signature complète
+        divisors = [d for d in range(1, num_perm + 1) if num_perm % d == 0]
+        self.bands = max(
+            (b for b in divisors if (1 / b) ** (b / num_perm) <= threshold),
+            key=lambda b: (1 / b) ** (b / num_perm), default=num_perm
+        )
+        self.rows = num_perm // self.bands
+        self.band_weights = rng.integers(1, 2**63, self.rows, dtype=np.uint64) | np.uint64(1)
+        self.buckets = [{} for _ in range(self.bands)]
+        self.signatures = []
+        self.kept = []  # (chunk_id, source_file) des chunks gardés
+        self.clusters = {}  # position du chunk gardé -> doublons écartés
+        self.dropped = {}  # chunk_id écarté -> {"kept": chunk gardé, **entrée chunk_map}
+        self.removed = 0
+    
+    def signature(self, text: str) -> np.ndarray:
+        words = text.lower().split()
+        k = self.shingle_size
+        shingles = {" ".join(words[i:i + k]) for i in range(max(len(words) - k + 1, 1))}
+        hashes = np.fromiter((zlib.crc32(s.encode("utf-8")) for s in shingles), dtype=np.uint64, count=len(shingles))
+        return ((np.outer(hashes, self.a) + self.b) % self.PRIME).min(axis=0).astype(np.uint32)
+    
+    def _bands(self, signature: np.ndarray):
+        for band in range(self.bands):
+            yield band, signature[band * self.rows:(band + 1) * self.rows].tobytes()
+    
+    def add(self, chunk_id: str, source_file: str, text: str, signature: np.ndarray = None):
+        signature = self.signature(text) if signature is None else signature
+        position = len(self.signatures)
+        for band, key in self._bands(signature):
+            self.buckets[band].setdefault(key, []).append(position)
+        self.signatures.append(signature)
+        self.kept.append((chunk_id, source_file))
+    
+    def load_candidates(self, entries: List[Tuple[str, str]], signatures: np.ndarray, probes: List[np.ndarray]):
+        """
+        Charge, parmi des chunks déjà indexés ((chunk_id, source_file) et signatures alignées),
+        ceux qui partagent au moins une bande LSH avec une des signatures sondes: les seuls
+        qu'un check() de ces sondes peut trouver. Hachage vectorisé des bandes, sans shingling.
+        """
+        if not len(signatures) or not probes:
+            return
+        probes = np.array(probes, dtype=np.uint32)
+        hit = np.zeros(len(signatures), dtype=bool)
+        for band in range(self.bands):
+            columns = slice(band * self.rows, (band + 1) * self.rows)
+            hit |= np.isin(signatures[:, columns].astype(np.uint64) @ self.band_weights,
+                           probes[:, columns].astype(np.uint64) @ self.band_weights)
+        for position in np.flatnonzero(hit):
+            self.add(*entries[position], "", signature=signatures[position])
+    
+    def check(self, chunk_id: str, source_file: str, text: str) -> Optional[Tuple[str, float]]:
+        """Renvoie (chunk gardé, similarité) si le chunk est un quasi-doublon, sinon l'ajoute à l'index"""
+        signature = self.signature(text)
+        candidates = set()
+        for band, key in self._bands(signature):
+            candidates.update(self.buckets[band].get(key, ()))
         
-        if signature not in seen_starts:
-            seen_starts.add(signature)
-            unique_chunks.append(chunk)
-        else:
-            print(f"📝 Doublon détecté et supprimé: {chunk['chunk_id']}")
+        best, best_similarity = None, 0.0
+        for position in candidates:
+            similarity = float(np.mean(self.signatures[position] == signature))
+            if similarity > best_similarity:
+                best, best_similarity = position, similarity
+        
+        if best is not None and best_similarity >= self.threshold:
+            self.removed += 1
+            self.clusters.setdefault(best, []).append(
+                {"chunk_id": chunk_id, "source_file": source_file, "similarity": round(best_similarity, 3)}
+            )
+            return self.kept[best][0], best_similarity
+        
+        self.add(chunk_id, source_file, text, signature)
+        return None
     
-    return unique_chunks
+    def report(self) -> List[Dict[str, Any]]:
+        """Groupes de quasi-doublons, les plus grands d'abord"""
+        clusters = [
+            {"kept": {"chunk_id": self.kept[position][0], "source_file": self.kept[position][1]},
+             "duplicates": duplicates}
+            for position, duplicates in self.clusters.items()
+        ]
+        return sorted(clusters, key=lambda cluster: -len(cluster["duplicates"]))
 
-def create_embeddings_batched(chunks: List[Dict[str, Any]], model_name: str, batch_size: int = 32) -> Tuple[np.ndarray, Dict[str, Dict[str, Any]]]:
-    """Crée embeddings par batch pour gérer la mémoire"""
-    print(f"🔧 Chargement du modèle: {model_name}")
-    model = SentenceTransformer(model_name)
+class DocumentFingerprints:
+    """
+    Empreinte par document (source_file) de ses chunks filtrés, avant déduplication: somme des
+    empreintes (chunk_id, contenu), indépendante de l'ordre. Enregistrée dans metadata.json, elle
+    permet à une mise à jour incrémentale depuis le corpus de ne remplacer que les documents modifiés.
+    """
     
-    # Préparer les textes
-    texts = [chunk["content"] for chunk in chunks]
+    def __init__(self):
+        self.sums = {}
+    
+    def add(self, chunk: Dict[str, Any]):
+        digest = hashlib.sha256(f"{chunk['chunk_id']}\0{chunk['content']}".encode("utf-8")).digest()
+        source_file = chunk["metadata"].get("source_file", "")
+        self.sums[source_file] = (self.sums.get(source_file, 0) + int.from_bytes(digest[:8], "big")) % 2**64
+    
+    def to_dict(self) -> Dict[str, str]:
+        return {source_file: f"{total:016x}" for source_file, total in self.sums.items()}
+
+def iter_unique_chunks(chunks: Iterable[Dict[str, Any]], verbose: bool = True,
+                       dedup: NearDuplicateIndex = None,
+                       fingerprints: DocumentFingerprints = None) -> Iterator[Dict[str, Any]]:
+    """Supprime les quasi-doublons au fil de l'eau (MinHash + LSH, voir NearDuplicateIndex)"""
+    dedup = dedup or NearDuplicateIndex()
+    
+    for chunk in chunks:
+        if fingerprints is not None:
+            fingerprints.add(chunk)
+        duplicate = dedup.check(chunk["chunk_id"], chunk["metadata"].get("source_file", ""), chunk["content"])
+        if duplicate is None:
+            yield chunk
+            continue
+        dedup.dropped[chunk["chunk_id"]] = {"kept": duplicate[0], **chunk_entry(chunk)}
+        if verbose:
+            print(f"📝 Doublon détecté et supprimé: {chunk['chunk_id']} (~{duplicate[1]:.0%} de {duplicate[0]})")
+
+def deduplicate_chunks(chunks: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Supprime les doublons sémantiques"""
+    return list(iter_unique_chunks(chunks))
+
+def iter_batches(items: Iterable[Any], size: int) -> Iterator[List[Any]]:
+    """Regroupe un flux en lots de taille fixe"""
+    iterator = iter(items)
+    while True:
+        batch = list(islice(iterator, size))
+        if not batch:
+            return
+        yield batch
+
+class EmbeddingCache:
+    """
+    Cache persistant des embeddings, adressé par le contenu: sha256(texte nettoyé) -> vecteur.
+    Un dossier par modèle, deux fichiers en ajout seul:
+    - keys.txt: une empreinte par ligne, dans l'ordre des vecteurs
+    - vectors.f32: matrice float32 brute (n x dim), lue par np.memmap
+    """
+    
+    def __init__(self, model_name: str, cache_dir: Path = EMBEDDING_CACHE_DIR):
+        self.dir = cache_dir / re.sub(r"[^A-Za-z0-9_.-]+", "__", model_name)
+        self.dir.mkdir(parents=True, exist_ok=True)
+        self.keys_file = self.dir / "keys.txt"
+        self.vectors_file = self.dir / "vectors.f32"
+        self.meta_file = self.dir / "meta.json"
+        self.model_name = model_name
+        self.dim = None
+        if self.meta_file.exists():
+            with open(self.meta_file, "r", encoding="utf-8") as f:
+                self.dim = json.load(f)["dim"]
+        
+        # Clés complètes seulement (une ligne interrompue n'a pas de saut de ligne final)
+        keys = self.keys_file.read_text(encoding="utf-8").split("\n")[:-1] if self.keys_file.exists() else []
+        nbytes = self.vectors_file.stat().st_size if self.vectors_file.exists() else 0
+        rows = nbytes // (4 * self.dim) if self.dim else 0
+        self.size = min(len(keys), rows)
+        if len(keys) != self.size or nbytes != self.size * 4 * (self.dim or 0):
+            # Écriture interrompue: on revient au dernier état cohérent
+            self.keys_file.write_text("".join(k + "\n" for k in keys[:self.size]), encoding="utf-8")
+            if self.vectors_file.exists():
+                os.truncate(self.vectors_file, self.size * 4 * (self.dim or 0))
+        self.positions = {key: pos for pos, key in enumerate(keys[:self.size])}
     
-    print(f"⚡ Création des embeddings ({len(texts)} textes)...")
+    @staticmethod
+    def key(text: str) -> str:
+        return hashlib.sha256(text.encode("utf-8")).hexdigest()
     
-    # Encoder par batch
-    embeddings = model.encode(
+    def vectors(self) -> np.ndarray:
+        if not self.size:
+            return np.empty((0, self.dim or 0), dtype=np.float32)
+        return np.memmap(self.vectors_file, dtype=np.float32, mode="r", shape=(self.size, self.dim))
+    
+    def append(self, keys: List[str], vectors: np.ndarray):
+        vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+        if self.dim is None:
+            self.dim = vectors.shape[1]
+            atomic_write_json(self.meta_file, {"model": self.model_name, "dim": self.dim})
+        # Vecteurs d'abord (et sur disque): des clés sans vecteur seraient ignorées au prochain chargement
+        with open(self.vectors_file, "ab") as f:
+            f.write(vectors.tobytes())
+            f.flush()
+            os.fsync(f.fileno())
+        with open(self.keys_file, "a", encoding="utf-8") as f:
+            f.write("".join(k + "\n" for k in keys))
+            f.flush()
+            os.fsync(f.fileno())
+        for key in keys:
+            self.positions[key] = self.size
+            self.size += 1
+
+@lru_cache(maxsize=1)
+def load_embedding_model(model_name: str) -> SentenceTransformer:
+    print(f"🔧 Chargement du modèle: {model_name}")
+    return SentenceTransformer(model_name)
+
+# Modèle du processus d'encodage (un par worker)
+_worker_model = None
+
+def _init_encode_worker(model_name: str, threads: int):
+    global _worker_model
+    import torch
+    torch.set_num_threads(threads)
+    _worker_model = SentenceTransformer(model_name, device="cpu")
+
+def _encode_shard(texts: List[str]) -> np.ndarray:
+    return _worker_model.encode(
         texts,
-        batch_size=batch_size,
-        show_progress_bar=True,
+        batch_size=32,
+        show_progress_bar=False,
         normalize_embeddings=True,
         convert_to_numpy=True
     )
+
+@lru_cache(maxsize=1)
+def get_encode_pool(model_name: str, workers: int, threads: int):
+    """Pool de workers d'encodage, créé une fois (chaque worker charge le modèle)"""
+    print(f"🔧 Démarrage de {workers} processus d'encodage ({threads} threads chacun)")
+    pool = multiprocessing.get_context("spawn").Pool(
+        workers, initializer=_init_encode_worker, initargs=(model_name, threads)
+    )
+    atexit.register(pool.terminate)
+    return pool
+
+def encode_texts(texts: List[str], model_name: str, batch_size: int = 32, show_progress: bool = True) -> np.ndarray:
+    """Encode les textes triés par longueur (moins de padding), sur plusieurs processus si configuré"""
+    start = time.perf_counter()
+    order = sorted(range(len(texts)), key=lambda i: len(texts[i]))
+    sorted_texts = [texts[i] for i in order]
     
-    # Créer le mapping
-    chunk_map = {}
-    for chunk in chunks:
-        chunk_map[chunk["chunk_id"]] = {
-            "document_id": chunk["metadata"].get("document_name", "unknown"),
-            "page_number": chunk["metadata"].get("page_number", -1),
-            "content": chunk["content"],
-            "source_file": chunk["metadata"].get("source_file", ""),
-            "word_count": chunk["metadata"].get("word_count", 0),
-            "original_preview": chunk.get("original_text", "")[:200]
-        }
+    if ENCODE_WORKERS > 1:
+        # Lots de longueurs voisines répartis entre les workers, résultats remis dans l'ordre
+        pool = get_encode_pool(model_name, ENCODE_WORKERS, ENCODE_THREADS)
+        shards = [sorted_texts[i:i + ENCODE_SHARD_SIZE] for i in range(0, len(sorted_texts), ENCODE_SHARD_SIZE)]
+        vectors = np.vstack(list(tqdm(pool.imap(_encode_shard, shards), total=len(shards),
+                                      desc="Encodage", disable=not show_progress)))
+    else:
+        vectors = load_embedding_model(model_name).encode(
+            sorted_texts,
+            batch_size=batch_size,
+            show_progress_bar=show_progress,
+            normalize_embeddings=True,
+            convert_to_numpy=True
+        )
     
-    return embeddings.astype(np.float32), chunk_map
+    embeddings = np.empty_like(vectors)
+    embeddings[order] = vectors
+    ENCODE_STATS["texts"] += len(texts)
+    ENCODE_STATS["seconds"] += time.perf_counter() - start
+    return embeddings
+
+def encode_throughput() -> str:
+    workers = max(ENCODE_WORKERS, 1)
+    threads = ENCODE_THREADS if ENCODE_WORKERS > 1 else "tous les"
+    rate = ENCODE_STATS["texts"] / max(ENCODE_STATS["seconds"], 1e-9)
+    return (f"{ENCODE_STATS['texts']} textes en {ENCODE_STATS['seconds']:.1f}s "
+            f"({rate:.1f} textes/s, {workers} processus x {threads} threads)")
 
-def build_optimized_faiss_index(embeddings: np.ndarray, use_gpu: bool = False):
-    """Construit un index FAISS optimisé"""
-    dim = embeddings.shape[1]
+def embed_with_cache(texts: List[str], cache: EmbeddingCache, batch_size: int = 32, show_progress: bool = True) -> Tuple[np.ndarray, int]:
+    """Embeddings des textes, seuls les absents du cache sont encodés ; renvoie aussi le nombre de hits"""
+    keys = [EmbeddingCache.key(text) for text in texts]
     
-    # Pour meilleure qualité: Index FlatIP (cosine similarity)
-    index = faiss.IndexFlatIP(dim)
+    # Textes à encoder (absents du cache, sans doublon)
+    missing = {}
+    for text, key in zip(texts, keys):
+        if key not in cache.positions and key not in missing:
+            missing[key] = text
+    hits = len(texts) - sum(1 for key in keys if key in missing)
     
-    # Normaliser les embeddings (déjà fait par SentenceTransformer)
-    index.add(embeddings)
+    if missing:
+        # Encoder par batch
+        new_embeddings = encode_texts(list(missing.values()), cache.model_name, batch_size, show_progress)
+        cache.append(list(missing.keys()), new_embeddings)
+    
+    cached = cache.vectors()
+    return np.asarray(cached[[cache.positions[key] for key in keys]], dtype=np.float32), hits
+
+def chunk_entry(chunk: Dict[str, Any]) -> Dict[str, Any]:
+    """Entrée chunk_map d'un chunk"""
+    return {
+        "document_id": chunk["metadata"].get("document_name", "unknown"),
+        "page_number": chunk["metadata"].get("page_number", -1),
+        "content": chunk["content"],
+        "source_file": chunk["metadata"].get("source_file", ""),
+        "word_count": chunk["metadata"].get("word_count", 0),
+        "domains": chunk["metadata"].get("domains") or [],  # Filtre "domains" de /search
+        "original_preview": chunk.get("original_text", "")[:200]
+    }
+
+def chunk_from_entry(chunk_id: str, entry: Dict[str, Any]) -> Dict[str, Any]:
+    """Chunk reconstitué depuis son entrée chunk_map (inverse de chunk_entry)"""
+    return {
+        "chunk_id": chunk_id,
+        "content": entry["content"],
+        "metadata": {
+            "document_name": entry.get("document_id", "unknown"),
+            "page_number": entry.get("page_number", -1),
+            "source_file": entry.get("source_file", ""),
+            "word_count": entry.get("word_count", 0),
+            "domains": entry.get("domains") or [],
+        },
+        "original_text": entry.get("original_preview", "")
+    }
+
+def create_embeddings_batched(chunks: List[Dict[str, Any]], model_name: str, batch_size: int = 32) -> Tuple[np.ndarray, Dict[str, Dict[str, Any]]]:
+    """Crée embeddings par batch pour gérer la mémoire (seuls les textes absents du cache sont encodés)"""
+    texts = [chunk["content"] for chunk in chunks]
+    embeddings, hits = embed_with_cache(texts, EmbeddingCache(model_name), batch_size)
+    print(f"♻️ Cache embeddings: {hits}/{len(texts)} réutilisés ({100 * hits / max(len(texts), 1):.1f}%)")
+    if ENCODE_STATS["texts"]:
+        print(f"⚡ Encodage: {encode_throughput()}")
+    
+    # Créer le mapping
+    chunk_map = {chunk["chunk_id"]: chunk_entry(chunk) for chunk in chunks}
+    
+    return embeddings, chunk_map
+
+def iter_embedded_batches(chunks: Iterable[Dict[str, Any]], cache: EmbeddingCache,
+                          batch_size: int = BUILD_BATCH_SIZE) -> Iterator[Tuple[List[Dict[str, Any]], np.ndarray, int]]:
+    """Lots de batch_size chunks avec leurs embeddings et le nombre de hits du cache"""
+    for batch in iter_batches(chunks, batch_size):
+        embeddings, hits = embed_with_cache([c["content"] for c in batch], cache, show_progress=False)
+        yield batch, embeddings, hits
+
+def effective_index_type(index_type: str, n: int) -> str:
+    """Codage réellement utilisé pour n vecteurs (PQ impossible à entraîner sous PQ_MIN_TRAIN)"""
+    if index_type == "pq" and n < PQ_MIN_TRAIN:
+        print(f"⚠️ {n} vecteurs: trop peu pour entraîner PQ{PQ_M} (min {PQ_MIN_TRAIN}), index SQ8 à la place")
+        return "sq8"
+    return index_type
+
+def build_index_from_vectors(vectors: np.ndarray, index_type: str = INDEX_TYPE, batch_size: int = BUILD_BATCH_SIZE):
+    """Index FAISS construit depuis une matrice sur disque (memmap), entraîné sur un échantillon"""
+    n, dim = vectors.shape
+    index_type = effective_index_type(index_type, n)
     
     # Option: ajouter une couche de clustering pour vitesse
-    if embeddings.shape[0] > 10000:
-        print("🔧 Création d'index IVF pour meilleure performance...")
-        nlist = min(100, embeddings.shape[0] // 100)
-        quantizer = faiss.IndexFlatIP(dim)
-        index = faiss.IndexIVFFlat(quantizer, dim, nlist, faiss.METRIC_INNER_PRODUCT)
-        index.train(embeddings)
-        index.add(embeddings)
+    ivf = f"IVF{min(100, n // 100)}," if n > IVF_THRESHOLD else ""
+    codec = {"flat": "Flat", "sq8": "SQ8", "pq": f"PQ{PQ_M}"}[index_type]
+    index = faiss.index_factory(dim, ivf + codec, faiss.METRIC_INNER_PRODUCT)
+    
+    if not index.is_trained:
+        sample = np.sort(np.random.default_rng(0).choice(n, size=min(n, TRAIN_SAMPLE), replace=False))
+        index.train(np.ascontiguousarray(vectors[sample]))
+    for start in range(0, n, batch_size):
+        index.add(np.ascontiguousarray(vectors[start:start + batch_size]))
+    if ivf:
         index.nprobe = 10  # Compromis vitesse/précision
     
     return index
 
-def save_all_data(embeddings: np.ndarray, chunk_map: Dict[str, Dict[str, Any]], index: faiss.IndexFlatIP, chunks: List[Dict[str, Any]]):
-    """Sauvegarde complète"""
-    # 1. Embeddings
-    np.savez_compressed(OUTPUT_DIR / "embeddings.npz", embeddings=embeddings)
+def exact_top_k(queries: np.ndarray, vectors: np.ndarray, k: int, batch_size: int = BUILD_BATCH_SIZE) -> np.ndarray:
+    """Top-k exact (produit scalaire) par parcours en lots de la matrice sur disque"""
+    top_scores = np.full((len(queries), k), -np.inf, dtype=np.float32)
+    top_ids = np.full((len(queries), k), -1, dtype=np.int64)
+    for start in range(0, len(vectors), batch_size):
+        block = np.asarray(vectors[start:start + batch_size])
+        scores = np.hstack([top_scores, queries @ block.T])
+        ids = np.hstack([top_ids, np.broadcast_to(np.arange(start, start + len(block)), (len(queries), len(block)))])
+        best = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+        top_scores = np.take_along_axis(scores, best, axis=1)
+        top_ids = np.take_along_axis(ids, best, axis=1)
+    return top_ids
+
+def recall_check(index, vectors: np.ndarray, k: int = 10, num_queries: int = 200) -> Dict[str, Any]:
+    """
+    Rappel du top-k par rapport à une recherche exacte (Flat), sur des requêtes tirées du corpus:
+    index seul, puis liste courte de k x RESCORE_FACTOR re-scorée exactement (comme l'API).
+    """
+    n = len(vectors)
+    k = min(k, n)
+    sample = np.sort(np.random.default_rng(1).choice(n, size=min(n, num_queries), replace=False))
+    queries = np.ascontiguousarray(vectors[sample])
+    expected = exact_top_k(queries, vectors, k)
+    
+    shortlist = min(k * RESCORE_FACTOR, n)
+    _, found = index.search(queries, shortlist)
+    recall_index, recall_rescored = 0.0, 0.0
+    for query, row, truth in zip(queries, found, expected):
+        truth = set(truth.tolist())
+        row = row[row >= 0]
+        recall_index += len(truth & set(row[:k].tolist())) / k
+        rescored = row[np.argsort(-(np.asarray(vectors[row]) @ query))[:k]]
+        recall_rescored += len(truth & set(rescored.tolist())) / k
+    
+    return {
+        "k": k,
+        "queries": len(queries),
+        "shortlist": shortlist,
+        "recall_index": round(recall_index / len(queries), 4),
+        "recall_rescored": round(recall_rescored / len(queries), 4)
+    }
+
+def chunks_source_signature(chunks_dir: Path) -> str:
+    """Empreinte des entrées de la construction (fichiers de chunks, modèle, déduplication)"""
+    corpus_file = chunks_dir / CORPUS_FILE.name
+    files = [corpus_file] if corpus_file.exists() else sorted(chunks_dir.glob("*_chunks.json"))
+    params = {
+        "files": [(path.name, path.stat().st_size, path.stat().st_mtime_ns) for path in files],
+        "model": EMBEDDING_MODEL_NAME,
+        "dedup": [DEDUP_THRESHOLD, DEDUP_SHINGLE_SIZE, DEDUP_PERMUTATIONS]
+    }
+    return hashlib.sha256(json.dumps(params).encode()).hexdigest()[:16]
+
+def load_build_checkpoint(signature: str, paths: List[Path]) -> Optional[Dict[str, Any]]:
+    """Point de reprise valable pour ces entrées et ces fichiers temporaires, sinon None"""
+    if not BUILD_CHECKPOINT_FILE.exists():
+        return None
+    try:
+        with open(BUILD_CHECKPOINT_FILE, "r", encoding="utf-8") as f:
+            checkpoint = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if checkpoint.get("source") != signature or any(
+            not path.exists() or path.stat().st_size < offset for path, offset in zip(paths, checkpoint["offsets"])):
+        print("ℹ️ Point de reprise obsolète (chunks modifiés): construction complète")
+        return None
+    return checkpoint
+
+def build_index_streaming(chunks_dir: Path, batch_size: int = BUILD_BATCH_SIZE, index_type: str = INDEX_TYPE,
+                          embedded: Iterable[Tuple[List[Dict[str, Any]], np.ndarray, int]] = None,
+                          dedup: NearDuplicateIndex = None,
+                          fingerprints: DocumentFingerprints = None) -> Tuple[Any, Dict[str, Any]]:
+    """
+    Construction en flux, à mémoire bornée: fichiers -> filtrage -> déduplication -> lots
+    de batch_size chunks. Chaque lot est embeddé, ajouté à l'index et écrit sur disque
+    (chunk_map.json, index_ids.json, embeddings.npy) avant de passer au suivant.
+    L'index est construit à la fin depuis embeddings.npy (memmap), une fois le total connu
+    (Flat, ou IVF au-delà de IVF_THRESHOLD ; sq8/pq): pas d'index en mémoire pendant le flux.
+    Après chaque lot, les fichiers temporaires sont synchronisés sur disque et leur taille notée
+    dans build_checkpoint.json: une construction interrompue reprend au lot suivant.
+    embedded (avec le dedup et les empreintes qui l'ont vu passer) remplace la lecture de
+    chunks_dir par des lots déjà embeddés (anstat_pipeline.py, sans reprise).
+    """
+    stats = {"total_chunks": 0, "total_length": 0, "min_length": None, "max_length": 0,
+             "total_words": 0, "cache_hits": 0, "near_duplicates": 0}
+    n, dim = 0, None
+    
+    vectors_tmp = EMBEDDINGS_FILE.with_suffix(".f32.tmp")
+    chunk_map_tmp = CHUNK_MAP_FILE.with_suffix(".json.tmp")
+    ids_tmp = INDEX_IDS_FILE.with_suffix(".json.tmp")
+    signature, checkpoint = None, None
+    if embedded is None:
+        signature = chunks_source_signature(chunks_dir)
+        checkpoint = load_build_checkpoint(signature, [vectors_tmp, chunk_map_tmp, ids_tmp])
+        dedup = NearDuplicateIndex()
+        fingerprints = DocumentFingerprints()
+        chunks = iter_unique_chunks(load_and_filter_chunks(chunks_dir), dedup=dedup, fingerprints=fingerprints)
+        if checkpoint:
+            # Reprise: fichiers ramenés au dernier lot complet, chunks déjà écrits repassés
+            # dans la déduplication sans être embeddés
+            stats, dim = checkpoint["stats"], checkpoint["dim"]
+            n = stats["total_chunks"]
+            for path, offset in zip((vectors_tmp, chunk_map_tmp, ids_tmp), checkpoint["offsets"]):
+                os.truncate(path, offset)
+            for _ in islice(chunks, n):
+                pass
+            print(f"⏯️ Reprise de la construction après {n} chunks")
+        embedded = iter_embedded_batches(chunks, EmbeddingCache(EMBEDDING_MODEL_NAME), batch_size)
     
-    # 2. Mapping chunks
-    with open(CHUNK_MAP_FILE, "w", encoding="utf-8") as f:
-        json.dump(chunk_map, f, ensure_ascii=False, indent=2)
+    mode = "a" if checkpoint else "w"
+    with open(vectors_tmp, mode + "b") as vectors_out, \
+         open(chunk_map_tmp, mode, encoding="utf-8") as chunk_map_out, \
+         open(ids_tmp, mode, encoding="utf-8") as ids_out:
+        if not checkpoint:
+            chunk_map_out.write("{")
+            ids_out.write("[")
+        
+        for batch, embeddings, hits in embedded:
+            dim = embeddings.shape[1]
+            vectors_out.write(embeddings.tobytes())
+            n += len(batch)
+            
+            # chunk_map écrit entrée par entrée (un chunk_id répété garde sa dernière valeur, comme un dict)
+            for chunk in batch:
+                sep = "," if stats["total_chunks"] else ""
+                chunk_map_out.write(f"{sep}\n{json.dumps(chunk['chunk_id'])}: "
+                                    f"{json.dumps(chunk_entry(chunk), ensure_ascii=False)}")
+                ids_out.write(sep + json.dumps(chunk["chunk_id"]))
+                
+                length = len(chunk["content"])
+                stats["total_chunks"] += 1
+                stats["total_length"] += length
+                stats["min_length"] = length if stats["min_length"] is None else min(stats["min_length"], length)
+                stats["max_length"] = max(stats["max_length"], length)
+                stats["total_words"] += chunk["metadata"].get("word_count", 0)
+            stats["cache_hits"] += hits
+            
+            # Point de reprise: lot complet sur disque, puis tailles des fichiers
+            if signature:
+                offsets = []
+                for f in (vectors_out, chunk_map_out, ids_out):
+                    f.flush()
+                    os.fsync(f.fileno())
+                    offsets.append(os.fstat(f.fileno()).st_size)
+                atomic_write_json(BUILD_CHECKPOINT_FILE, {"source": signature, "dim": dim,
+                                                          "offsets": offsets, "stats": stats})
+        
+        chunk_map_out.write("\n}")
+        ids_out.write("]")
     
-    # 3. Index FAISS
-    faiss.write_index(index, str(FAISS_INDEX_FILE))
+    # Rapport d'audit des quasi-doublons
+    stats["near_duplicates"] = dedup.removed
+    signatures_tmp = DEDUP_SIGNATURES_FILE.with_suffix(".tmp.npy")
+    np.save(signatures_tmp, np.array(dedup.signatures, dtype=np.uint32).reshape(-1, len(dedup.a)))
+    fsync_path(signatures_tmp)
+    atomic_write_json(DUPLICATES_FILE, {"threshold": dedup.threshold, "bands": dedup.bands, "rows": dedup.rows,
+                                        "removed": dedup.removed, "clusters": dedup.report()}, indent=2)
+    atomic_write_json(DROPPED_CHUNKS_FILE, dedup.dropped)
     
-    # 4. Métadonnées complètes
+    if not n:
+        for path in (vectors_tmp, chunk_map_tmp, ids_tmp, signatures_tmp):
+            path.unlink()
+        BUILD_CHECKPOINT_FILE.unlink(missing_ok=True)
+        return None, stats
+    
+    # Matrice des embeddings en .npy (copie par lots depuis le fichier brut)
+    raw = np.memmap(vectors_tmp, dtype=np.float32, mode="r", shape=(n, dim))
+    embeddings_tmp = EMBEDDINGS_FILE.with_suffix(".tmp.npy")
+    stored = np.lib.format.open_memmap(embeddings_tmp, mode="w+", dtype=np.float32, shape=(n, dim))
+    for start in range(0, n, batch_size):
+        stored[start:start + batch_size] = raw[start:start + batch_size]
+    stored.flush()
+    del stored, raw
+    fsync_path(embeddings_tmp)
+    
+    stored = np.load(embeddings_tmp, mmap_mode="r")
+    index_type = effective_index_type(index_type, n)
+    # Flat: produit scalaire exact (similarité cosinus, vecteurs normalisés)
+    index = build_index_from_vectors(stored, index_type, batch_size)
+    if index_type != "flat" or n > IVF_THRESHOLD:
+        print(f"🔧 Index {'IVF ' if n > IVF_THRESHOLD else ''}{index_type} pour meilleure performance")
+        stats["recall_check"] = recall_check(index, stored)
+        print(f"🎯 Rappel top-{stats['recall_check']['k']} vs Flat: {stats['recall_check']['recall_index']:.3f} "
+              f"(index seul), {stats['recall_check']['recall_rescored']:.3f} (re-scoring exact de "
+              f"{stats['recall_check']['shortlist']} candidats)")
+    del stored
+    
+    # Remplacement atomique des fichiers, l'index FAISS en dernier
+    for path in (chunk_map_tmp, ids_tmp):
+        fsync_path(path)
+    os.replace(embeddings_tmp, EMBEDDINGS_FILE)
+    os.replace(chunk_map_tmp, CHUNK_MAP_FILE)
+    os.replace(ids_tmp, INDEX_IDS_FILE)
+    os.replace(signatures_tmp, DEDUP_SIGNATURES_FILE)
+    index_tmp = FAISS_INDEX_FILE.with_suffix(".bin.tmp")
+    faiss.write_index(index, str(index_tmp))
+    fsync_path(index_tmp)
+    os.replace(index_tmp, FAISS_INDEX_FILE)
+    # Construction terminée: le point de reprise, le fichier brut et le journal ne servent plus
+    clear_journal()
+    BUILD_CHECKPOINT_FILE.unlink(missing_ok=True)
+    vectors_tmp.unlink()
+    stats["index_bytes"] = FAISS_INDEX_FILE.stat().st_size
+    
+    # Métadonnées complètes
     metadata = {
-        "total_chunks": len(chunks),
-        "embedding_dim": embeddings.shape[1],
+        "total_chunks": stats["total_chunks"],
+        "embedding_dim": dim,
         "model_used": EMBEDDING_MODEL_NAME,
+        "index_type": index_type,
+        "index_bytes": stats["index_bytes"],
+        "recall_check": stats.get("recall_check"),
         "chunk_stats": {
-            "avg_length": np.mean([len(c["content"]) for c in chunks]),
-            "min_length": min([len(c["content"]) for c in chunks]),
-            "max_length": max([len(c["content"]) for c in chunks]),
-            "total_words": sum([c["metadata"].get("word_count", 0) for c in chunks])
-        }
+            "avg_length": stats["total_length"] / stats["total_chunks"],
+            "min_length": stats["min_length"],
+            "max_length": stats["max_length"],
+            "total_words": stats["total_words"]
+        },
+        "embedding_cache_hits": stats["cache_hits"],
+        "near_duplicates_removed": stats["near_duplicates"],
+        "dedup": dedup_params(),
+        "documents": fingerprints.to_dict() if fingerprints else {}
     }
     
-    with open(METADATA_FILE, "w", encoding="utf-8") as f:
-        json.dump(metadata, f, ensure_ascii=False, indent=2)
+    atomic_write_json(METADATA_FILE, metadata, indent=2)
     
     print(f"✅ Données sauvegardées dans {OUTPUT_DIR}")
+    return index, stats
+
+# -----------------------
+# MISES À JOUR INCRÉMENTALES
+# -----------------------
+
+def load_index_state() -> Tuple[Any, Dict[str, Dict[str, Any]], List[Any], Optional[np.ndarray],
+                            Dict[str, Dict[str, Any]], Dict[str, Any]]:
+    """
+    Charge l'index existant, chunk_map, la table position -> chunk_id, les vecteurs exacts
+    (memmap) et les quasi-doublons écartés, puis rejoue le journal des mises à jour
+    """
+    index = faiss.read_index(str(FAISS_INDEX_FILE))
+    vectors = None
+    if EMBEDDINGS_FILE.exists():
+        vectors = np.load(EMBEDDINGS_FILE, mmap_mode="r")
+        if len(vectors) != index.ntotal:
+            print(f"⚠️ {EMBEDDINGS_FILE.name} non aligné sur l'index ({len(vectors)} != {index.ntotal}), ignoré")
+            vectors = None
+    with open(CHUNK_MAP_FILE, "r", encoding="utf-8") as f:
+        chunk_map = json.load(f)
+    if INDEX_IDS_FILE.exists():
+        with open(INDEX_IDS_FILE, "r", encoding="utf-8") as f:
+            ids = json.load(f)
+    else:
+        ids = list(chunk_map.keys())  # index construit avant index_ids.json
+    dropped = load_dropped_chunks()
+    journal = replay_journal(index, chunk_map, ids, dropped)
+    return index, chunk_map, ids, vectors, dropped, journal
+
+def journal_base_stamp(ntotal: int) -> str:
+    """Fichiers de base auxquels s'applique le journal (même calcul que rag_api)"""
+    return f"{ntotal}:{FAISS_INDEX_FILE.stat().st_size}:{CHUNK_MAP_FILE.stat().st_size}"
+
+def apply_journal_op(op: Dict[str, Any], chunk_map: Dict[str, Dict[str, Any]], ids: List[Any],
+                     dropped: Dict[str, Dict[str, Any]]):
+    """Applique une opération du journal (sauf l'ajout des vecteurs à l'index)"""
+    if op["op"] == "add":
+        ids.extend(op["ids"])
+        chunk_map.update(op["chunks"])
+    elif op["op"] == "remove":
+        for pos in op["positions"]:
+            if ids[pos] is not None:
+                chunk_map.pop(ids[pos], None)
+                ids[pos] = None
+    elif op["op"] == "dropped":
+        for chunk_id, entry in op["changes"].items():
+            if entry is None:
+                dropped.pop(chunk_id, None)
+            else:
+                dropped[chunk_id] = entry
+
+def replay_journal(index, chunk_map: Dict[str, Dict[str, Any]], ids: List[Any],
+                   dropped: Dict[str, Dict[str, Any]]) -> Dict[str, Any]:
+    """
+    Rejoue le journal sur les fichiers de base chargés (vecteurs ajoutés à l'index). Renvoie son
+    état pour append_journal: base (fichiers de base), positions de base, octets et lignes de
+    vecteurs valides. Journal d'un autre index, ou dernière ligne incomplète: ignoré puis écrasé.
+    """
+    journal = {"base": journal_base_stamp(index.ntotal), "positions": index.ntotal, "offset": 0, "rows": 0}
+    if not JOURNAL_FILE.exists():
+        return journal
+    ops, offset = [], 0
+    with open(JOURNAL_FILE, "rb") as f:
+        for line in f:
+            if not line.endswith(b"\n"):
+                break
+            ops.append(json.loads(line))
+            offset += len(line)
+    if not ops or ops[0] != {"op": "base", "stamp": journal["base"]}:
+        print(f"⚠️ {JOURNAL_FILE.name} écrit pour un autre index, ignoré")
+        return journal
+    for op in ops[1:]:
+        apply_journal_op(op, chunk_map, ids, dropped)
+        if op["op"] == "add":
+            journal["rows"] += len(op["ids"])
+    journal["offset"] = offset
+    if journal["rows"]:
+        index.add(np.asarray(read_journal_vectors(journal["rows"], index.d)))
+    print(f"📜 Journal rejoué: {len(ops) - 1} opérations, {journal['rows']} vecteurs ajoutés")
+    return journal
+
+def read_journal_vectors(rows: int, dim: int) -> np.ndarray:
+    """Vecteurs exacts des ajouts du journal (memmap)"""
+    if not rows:
+        return np.empty((0, dim), dtype=np.float32)
+    return np.memmap(JOURNAL_VECTORS_FILE, dtype=np.float32, mode="r", shape=(rows, dim))
+
+def append_journal(journal: Dict[str, Any], ops: List[Dict[str, Any]], embeddings: Optional[np.ndarray] = None):
+    """
+    Ajoute des opérations au journal: vecteurs des ajouts d'abord (après les lignes déjà
+    journalisées), puis les lignes JSON, synchronisés sur disque. Coût proportionnel à la
+    modification ; un journal vide (ou ignoré) est recréé, précédé de sa ligne de base.
+    """
+    fresh = journal["offset"] == 0
+    if embeddings is not None and len(embeddings):
+        mode = "r+b" if JOURNAL_VECTORS_FILE.exists() and not fresh else "wb"
+        with open(JOURNAL_VECTORS_FILE, mode) as f:
+            f.seek(journal["rows"] * embeddings.shape[1] * 4)
+            f.write(np.ascontiguousarray(embeddings, dtype=np.float32).tobytes())
+            f.truncate()
+            f.flush()
+            os.fsync(f.fileno())
+        journal["rows"] += len(embeddings)
+    lines = ([{"op": "base", "stamp": journal["base"]}] if fresh else []) + ops
+    data = "".join(json.dumps(op, ensure_ascii=False) + "\n" for op in lines).encode("utf-8")
+    with open(JOURNAL_FILE, "wb" if fresh else "r+b") as f:
+        f.seek(journal["offset"])
+        f.write(data)
+        f.truncate()
+        f.flush()
+        os.fsync(f.fileno())
+    journal["offset"] += len(data)
+
+def clear_journal():
+    """Journal intégré aux fichiers de base (construction, compaction)"""
+    JOURNAL_FILE.unlink(missing_ok=True)
+    JOURNAL_VECTORS_FILE.unlink(missing_ok=True)
+
+def tombstone_documents(chunk_map: Dict[str, Dict[str, Any]], ids: List[Any], names: set) -> List[int]:
+    """Supprime les chunks des documents (document_id ou source_file) sans toucher à l'index ; renvoie leurs positions"""
+    positions = [
+        pos for pos, chunk_id in enumerate(ids)
+        if chunk_id is not None
+        and (chunk_map.get(chunk_id, {}).get("source_file") in names
+             or chunk_map.get(chunk_id, {}).get("document_id") in names)
+    ]
+    for pos in positions:
+        chunk_map.pop(ids[pos], None)
+        ids[pos] = None
+    return positions
+
+def is_compressed(index) -> bool:
+    """Index SQ8/PQ: vecteurs stockés avec perte (Flat / IVFFlat: exacts)"""
+    return not isinstance(faiss.downcast_index(index), (faiss.IndexFlat, faiss.IndexIVFFlat))
+
+def compact_index(index, ids: List[Any], vectors: Optional[np.ndarray] = None):
+    """
+    Reconstruit l'index sans les positions supprimées, sans re-embedding: depuis les vecteurs
+    exacts (embeddings.npy) s'ils sont disponibles, sinon relus dans l'index (Flat / IVFFlat
+    seulement: réencoder des vecteurs SQ8/PQ décodés cumulerait l'erreur de quantification).
+    """
+    keep = [pos for pos, chunk_id in enumerate(ids) if chunk_id is not None]
+    if vectors is not None:
+        vectors = vectors[keep]
+        kept_vectors = vectors
+    else:
+        if is_compressed(index):
+            raise ValueError("Compaction d'un index compressé impossible sans embeddings.npy")
+        if hasattr(index, "make_direct_map"):
+            index.make_direct_map()  # IVF: nécessaire pour reconstruct_n
+        kept_vectors = index.reconstruct_n(0, index.ntotal)[keep]
+    compacted = faiss.clone_index(index)  # garde l'entraînement IVF/SQ8/PQ
+    compacted.reset()
+    compacted.add(kept_vectors)
+    return compacted, [ids[pos] for pos in keep], vectors
+
+def dedup_params() -> List[int]:
+    """Paramètres dont dépendent les signatures MinHash enregistrées"""
+    return [DEDUP_SHINGLE_SIZE, DEDUP_PERMUTATIONS]
+
+def load_dedup_signatures(ids: List[Any], chunk_map: Dict[str, Dict[str, Any]], base: int) -> np.ndarray:
+    """
+    Signatures MinHash alignées sur les positions de l'index: dedup_signatures.npy pour les
+    positions des fichiers de base (base), recalculées depuis chunk_map pour celles du journal. Absentes,
+    non alignées ou calculées avec d'autres paramètres: toutes recalculées une fois.
+    """
+    metadata = {}
+    if METADATA_FILE.exists():
+        with open(METADATA_FILE, "r", encoding="utf-8") as f:
+            metadata = json.load(f)
+    if DEDUP_SIGNATURES_FILE.exists() and metadata.get("dedup") == dedup_params():
+        signatures = np.load(DEDUP_SIGNATURES_FILE)
+        if len(signatures) == base:
+            return np.vstack([signatures, compute_signatures(ids[base:], chunk_map)])
+        print(f"⚠️ {DEDUP_SIGNATURES_FILE.name} non aligné sur l'index ({len(signatures)} != {base}), recalculé")
+    else:
+        print(f"ℹ️ {DEDUP_SIGNATURES_FILE.name} absent ou obsolète: signatures recalculées depuis chunk_map")
+    return compute_signatures(ids, chunk_map)
+
+def compute_signatures(ids: List[Any], chunk_map: Dict[str, Dict[str, Any]]) -> np.ndarray:
+    """Signatures MinHash de ces positions depuis chunk_map (zéros pour une position supprimée)"""
+    dedup = NearDuplicateIndex()
+    empty = np.zeros(DEDUP_PERMUTATIONS, dtype=np.uint32)  # position supprimée
+    return np.array([
+        dedup.signature(chunk_map[chunk_id]["content"]) if chunk_id in chunk_map else empty
+        for chunk_id in ids
+    ], dtype=np.uint32).reshape(-1, DEDUP_PERMUTATIONS)
+
+def load_dropped_chunks() -> Dict[str, Dict[str, Any]]:
+    """Quasi-doublons écartés (dropped_chunks.json, absent pour un index construit avant)"""
+    if not DROPPED_CHUNKS_FILE.exists():
+        return {}
+    with open(DROPPED_CHUNKS_FILE, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+def readmit_dropped_chunks(dropped: Dict[str, Dict[str, Any]], chunk_map: Dict[str, Dict[str, Any]],
+                           names: set) -> List[Dict[str, Any]]:
+    """
+    Après suppression des documents names: oublie leurs quasi-doublons écartés, et renvoie
+    (retirés de dropped) ceux dont le chunk gardé n'est plus indexé, à réindexer.
+    """
+    readmitted = []
+    for chunk_id, entry in list(dropped.items()):
+        if entry.get("source_file") in names or entry.get("document_id") in names:
+            del dropped[chunk_id]
+        elif entry.get("kept") not in chunk_map:
+            readmitted.append(chunk_from_entry(chunk_id, dropped.pop(chunk_id)))
+    return readmitted
+
+def load_document_fingerprints() -> Dict[str, str]:
+    """Empreintes des documents indexés (metadata.json, voir DocumentFingerprints)"""
+    if not METADATA_FILE.exists():
+        return {}
+    with open(METADATA_FILE, "r", encoding="utf-8") as f:
+        return json.load(f).get("documents", {})
+
+def save_index_state(index, chunk_map: Dict[str, Dict[str, Any]], ids: List[Any], vectors: Optional[np.ndarray] = None,
+                     documents: Dict[str, str] = None, signatures: Optional[np.ndarray] = None,
+                     dropped: Dict[str, Dict[str, Any]] = None):
+    """
+    Réécriture complète des fichiers de base (compaction): écriture atomique (fichier temporaire
+    + rename), l'index FAISS en dernier, puis journal vidé
+    """
+    for path, data in ((CHUNK_MAP_FILE, chunk_map), (INDEX_IDS_FILE, ids), (DROPPED_CHUNKS_FILE, dropped)):
+        if data is not None:
+            atomic_write_json(path, data)
+    for path, matrix in ((EMBEDDINGS_FILE, vectors), (DEDUP_SIGNATURES_FILE, signatures)):
+        if matrix is not None:
+            tmp_path = path.with_suffix(".tmp.npy")
+            np.save(tmp_path, matrix)
+            fsync_path(tmp_path)
+            os.replace(tmp_path, path)
+    tmp_path = FAISS_INDEX_FILE.with_suffix(FAISS_INDEX_FILE.suffix + ".tmp")
+    faiss.write_index(index, str(tmp_path))
+    fsync_path(tmp_path)
+    os.replace(tmp_path, FAISS_INDEX_FILE)
+    clear_journal()
+    save_metadata(index, chunk_map, ids, documents, signatures is not None)
+
+def save_metadata(index, chunk_map: Dict[str, Dict[str, Any]], ids: List[Any], documents: Dict[str, str] = None,
+                  signed: bool = False):
+    """Compteurs et empreintes des documents dans metadata.json (journal compris)"""
+    metadata = {}
+    if METADATA_FILE.exists():
+        with open(METADATA_FILE, "r", encoding="utf-8") as f:
+            metadata = json.load(f)
+    metadata.update({
+        "total_chunks": len(chunk_map),
+        "index_vectors": index.ntotal,
+        "tombstones": sum(1 for chunk_id in ids if chunk_id is None),
+    })
+    if documents is not None:
+        metadata["documents"] = documents
+    if signed:
+        metadata["dedup"] = dedup_params()
+    atomic_write_json(METADATA_FILE, metadata, indent=2)
+
+def incremental_update(chunk_files: List[Path], delete_names: List[str], force_compact: bool = False):
+    """
+    Met à jour l'index existant sans reconstruction complète:
+    - les documents de chunk_files sont ajoutés, ou remplacent leur version précédente ;
+      pour un corpus .jsonl (tous les documents), seuls les documents nouveaux ou dont
+      l'empreinte a changé sont remplacés, et ceux absents du corpus sont supprimés
+    - les documents de delete_names sont supprimés
+    Seuls les nouveaux chunks sont embeddés, et seule la modification est écrite (journal) ;
+    les fichiers de base ne sont réécrits qu'à la compaction, au-delà de COMPACT_RATIO.
+    """
+    print("\n" + "="*60)
+    print("MISE À JOUR INCRÉMENTALE DE L'INDEX")
+    print("="*60 + "\n")
+    
+    index, chunk_map, ids, vectors, dropped, journal = load_index_state()
+    documents = load_document_fingerprints()
+    print(f"📂 Index existant: {index.ntotal} vecteurs, {len(chunk_map)} chunks")
+    
+    # 1. Documents à remplacer (nouvelle version) ou à supprimer
+    names = set(delete_names)
+    new_chunks, replaced = [], {}
+    for path in chunk_files:
+        chunks = load_chunks_file(path)
+        fingerprints = DocumentFingerprints()
+        for chunk in chunks:
+            fingerprints.add(chunk)
+        current = fingerprints.to_dict()
+        if path.suffix == ".jsonl":
+            indexed = (set(documents) | {data.get("source_file") for data in chunk_map.values()}) - {None, ""}
+            changed = {name for name, fingerprint in current.items() if documents.get(name) != fingerprint}
+            gone = indexed - set(current)
+            names |= gone
+            print(f"📄 {path.name}: {len(changed)} documents nouveaux ou modifiés, {len(gone)} retirés, "
+                  f"{len(current) - len(changed)} inchangés")
+            if not documents and indexed:
+                print("ℹ️ Index sans empreintes de documents (metadata.json): tous les documents sont remplacés une fois")
+        else:
+            changed = set(current)
+            names.add(path.name)
+        names |= changed
+        new_chunks.extend(chunk for chunk in chunks if chunk["metadata"]["source_file"] in changed)
+        replaced.update({name: current[name] for name in changed})
+    for name in names:
+        documents.pop(name, None)
+    documents.update(replaced)
+    removed = tombstone_documents(chunk_map, ids, names)
+    print(f"🗑️ {len(removed)} chunks supprimés")
+    ops = [{"op": "remove", "positions": removed}] if removed else []
+    # Quasi-doublons écartés à cause d'un chunk qui vient d'être supprimé: repassés dans la
+    # déduplication après les nouveaux chunks (une nouvelle version du chunk gardé reste prioritaire)
+    known = set(dropped)
+    readmitted = readmit_dropped_chunks(dropped, chunk_map, names)
+    dropped_changes = {chunk_id: None for chunk_id in known - dropped.keys()}
+    if readmitted:
+        print(f"♻️ {len(readmitted)} quasi-doublons réadmis (chunk gardé supprimé)")
+    new_chunks.extend(readmitted)
+    
+    # 2. Ajout: seuls les nouveaux chunks sont embeddés
+    # Quasi-doublons entre nouveaux chunks et avec les chunks restants de l'index: seuls les
+    # chunks indexés des mêmes bandes LSH que les nouveaux sont chargés (signatures enregistrées)
+    signatures = load_dedup_signatures(ids, chunk_map, journal["positions"])
+    dedup = NearDuplicateIndex()
+    live = [pos for pos, chunk_id in enumerate(ids) if chunk_id is not None]
+    dedup.load_candidates([(ids[pos], chunk_map[ids[pos]].get("source_file", "")) for pos in live],
+                          signatures[live], [dedup.signature(chunk["content"]) for chunk in new_chunks])
+    loaded = len(dedup.signatures)
+    new_chunks = list(iter_unique_chunks(new_chunks, dedup=dedup))
+    dropped.update(dedup.dropped)
+    dropped_changes.update(dedup.dropped)
+    signatures = np.vstack([signatures, np.array(dedup.signatures[loaded:], dtype=np.uint32).reshape(-1, len(dedup.a))])
+    embeddings = None
+    if new_chunks:
+        embeddings, new_map = create_embeddings_batched(new_chunks, EMBEDDING_MODEL_NAME)
+        new_ids = [c["chunk_id"] for c in new_chunks]
+        ops.append({"op": "add", "ids": new_ids, "chunks": new_map})
+        index.add(embeddings)
+        ids.extend(new_ids)
+        chunk_map.update(new_map)
+    if dropped_changes:
+        ops.append({"op": "dropped", "changes": dropped_changes})
+    print(f"➕ {len(new_chunks)} chunks ajoutés")
+    
+    # 3. Compaction périodique (réécriture complète des fichiers de base), sinon ajout au journal
+    tombstones = sum(1 for chunk_id in ids if chunk_id is None)
+    compact = tombstones and (force_compact or tombstones / len(ids) > COMPACT_RATIO)
+    if compact and vectors is None and is_compressed(index):
+        print("⚠️ Index compressé sans embeddings.npy: compaction ignorée (reconstruction complète nécessaire)")
+        compact = False
+    if compact:
+        if vectors is not None:
+            # Vecteurs exacts de toutes les positions: fichiers de base, journal, ajouts de cette mise à jour
+            vectors = np.vstack([vectors, read_journal_vectors(journal["rows"], index.d)]
+                                + ([embeddings] if embeddings is not None else []))
+        signatures = signatures[[pos for pos, chunk_id in enumerate(ids) if chunk_id is not None]]
+        index, ids, vectors = compact_index(index, ids, vectors)
+        save_index_state(index, chunk_map, ids, vectors, documents, signatures, dropped)
+        print(f"🔧 Index compacté: {tombstones} positions libérées")
+    else:
+        if ops:
+            append_journal(journal, ops, embeddings)
+        save_metadata(index, chunk_map, ids, documents)
+        print(f"📜 Modification ajoutée au journal ({journal['rows']} vecteurs en attente de compaction)")
+    print(f"\n✅ Index mis à jour: {index.ntotal} vecteurs, {len(chunk_map)} chunks "
+          f"({sum(1 for chunk_id in ids if chunk_id is None)} positions supprimées)")
+    if vectors is None:
+        print("ℹ️ embeddings.npy absent ou non aligné: pas de re-scoring exact avant la prochaine construction complète")
 
 # -----------------------
 # PIPELINE PRINCIPAL
@@ -268,61 +1233,56 @@ def main():
     print("PIPELINE EMBEDDINGS OPTIMISÉ - Documents Institutionnels")
     print("="*60 + "\n")
     
-    # 1. Chargement et filtrage
-    print("📂 Étape 1: Chargement et filtrage des chunks...")
-    chunks = load_and_filter_chunks(CHUNKS_DIR)
+    # 1-4. Chargement, filtrage, déduplication, embeddings et index, lot par lot
+    print(f"📂 Construction en flux (lots de {BUILD_BATCH_SIZE} chunks, index {INDEX_TYPE})...")
+    index, stats = build_index_streaming(CHUNKS_DIR, index_type=INDEX_TYPE)
     
-    if not chunks:
+    if index is None:
         print("❌ Aucun chunk valide trouvé!")
         return
     
-    print(f"✅ {len(chunks)} chunks chargés")
-    
-    # 2. Déduplication
-    print("\n🧹 Étape 2: Déduplication...")
-    chunks = deduplicate_chunks(chunks)
-    print(f"✅ {len(chunks)} chunks uniques après déduplication")
-    
-    # 3. Création des embeddings
-    print("\n⚡ Étape 3: Création des embeddings...")
-    embeddings, chunk_map = create_embeddings_batched(chunks, EMBEDDING_MODEL_NAME)
-    print(f"✅ Embeddings créés: {embeddings.shape}")
-    
-    # 4. Construction de l'index
-    print("\n🔗 Étape 4: Construction de l'index FAISS...")
-    index = build_optimized_faiss_index(embeddings)
-    print(f"✅ Index FAISS créé avec {index.ntotal} vecteurs")
-    
-    # 5. Sauvegarde
-    print("\n💾 Étape 5: Sauvegarde...")
-    save_all_data(embeddings, chunk_map, index, chunks)
-    
-    # 6. Statistiques
+    # 5. Statistiques
+    total = stats["total_chunks"]
     print("\n📊 STATISTIQUES FINALES:")
-    print(f"   • Chunks: {len(chunks)}")
-    print(f"   • Dimensions: {embeddings.shape[1]}")
-    print(f"   • Taille index: {index.ntotal} vecteurs")
+    print(f"   • Chunks: {total}")
+    print(f"   • Dimensions: {index.d}")
+    print(f"   • Taille index: {index.ntotal} vecteurs, {stats['index_bytes'] / 2**20:.1f} Mo "
+          f"(float32: {index.ntotal * index.d * 4 / 2**20:.1f} Mo)")
+    print(f"   • Cache embeddings: {stats['cache_hits']}/{total} réutilisés "
+          f"({100 * stats['cache_hits'] / total:.1f}%)")
+    print(f"   • Quasi-doublons écartés: {stats['near_duplicates']} (détail: {DUPLICATES_FILE.name})")
+    if ENCODE_STATS["texts"]:
+        print(f"   • Encodage: {encode_throughput()}")
     
     # Vérifier la qualité
     print("\n🧪 Test de vérification...")
-    model = SentenceTransformer(EMBEDDING_MODEL_NAME)
+    model = load_embedding_model(EMBEDDING_MODEL_NAME)
     test_queries = [
         "pauvreté en Côte d'Ivoire",
         "statistiques démographiques",
         "enquête EHCVM"
     ]
     
+    hits = {}
     for query_text in test_queries:
         q_emb = model.encode([query_text], normalize_embeddings=True)
         scores, indices = index.search(q_emb, 1)
         
         if indices[0][0] >= 0:
-            chunk_id = list(chunk_map.keys())[indices[0][0]]
-            chunk_data = chunk_map[chunk_id]
-            print(f"\n🔍 Query: '{query_text}'")
-            print(f"   📄 Document: {chunk_data['document_id']}")
-            print(f"   📄 Contenu: {chunk_data['content'][:100]}...")
-            print(f"   ⭐ Score: {scores[0][0]:.3f}")
+            hits[query_text] = (int(indices[0][0]), float(scores[0][0]))
+    
+    # Chunks trouvés: position -> chunk_id -> entrée, dans les fichiers qui viennent d'être écrits
+    with open(INDEX_IDS_FILE, "r", encoding="utf-8") as f:
+        ids = json.load(f)
+    with open(CHUNK_MAP_FILE, "r", encoding="utf-8") as f:
+        chunk_map = json.load(f)
+    
+    for query_text, (position, score) in hits.items():
+        chunk_data = chunk_map[ids[position]]
+        print(f"\n🔍 Query: '{query_text}'")
+        print(f"   📄 Document: {chunk_data['document_id']}")
+        print(f"   📄 Contenu: {chunk_data['content'][:100]}...")
+        print(f"   ⭐ Score: {score:.3f}")
     
     print("\n" + "="*60)
     print("✅ PIPELINE TERMINÉ AVEC SUCCÈS!")
@@ -331,9 +1291,31 @@ def main():
     print(f"📄 Fichiers créés:")
     print(f"   • faiss_index.bin (index de recherche)")
     print(f"   • chunk_map.json (mapping chunk -> metadata)")
-    print(f"   • embeddings.npz (vecteurs)")
+    print(f"   • index_ids.json (position FAISS -> chunk_id)")
+    print(f"   • embeddings.npy (vecteurs, lisibles par np.load(mmap_mode='r'))")
     print(f"   • metadata.json (statistiques)")
     print(f"\n🚀 Prêt pour la recherche RAG!")
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Embeddings et index FAISS des chunks ANSTAT")
+    parser.add_argument("--incremental", nargs="*", type=Path, metavar="CHUNKS_JSON",
+                        help="Ajoute ou remplace ces documents (*_chunks.json) dans l'index existant ; un corpus .jsonl "
+                             "synchronise l'index (documents modifiés remplacés, absents supprimés)")
+    parser.add_argument("--delete", nargs="*", default=[], metavar="DOCUMENT",
+                        help="Supprime ces documents (document_id ou fichier *_chunks.json)")
+    parser.add_argument("--compact", action="store_true",
+                        help="Force la compaction de l'index apres la mise a jour")
+    parser.add_argument("--index-type", choices=["flat", "sq8", "pq"], default=INDEX_TYPE,
+                        help="Codage des vecteurs de l'index (sq8/pq: re-scoring exact dans l'API)")
+    parser.add_argument("--workers", type=int, default=ENCODE_WORKERS,
+                        help="Processus d'encodage (ex: nombre de coeurs / --threads ; 0 = processus principal)")
+    parser.add_argument("--threads", type=int, default=ENCODE_THREADS,
+                        help="Threads torch par processus d'encodage")
+    args = parser.parse_args()
+    ENCODE_WORKERS, ENCODE_THREADS = args.workers, args.threads
+    INDEX_TYPE = args.index_type
+    
+    if args.incremental is not None or args.delete or args.compact:
+        incremental_update(args.incremental or [], args.delete, args.compact)
+    else:
+        main()
\ No newline at end of file
@@ -0,0 +1,388 @@
+# ============================================================
+# PIPELINE COMPLET - ANSTAT
+# PDF -> extraction + chunking -> embeddings -> index FAISS, en une commande
+#
+# Les étapes tournent en même temps, reliées par des files bornées:
+#   extraction (processus, par plages de pages) -> documents (fusion, corpus.jsonl,
+#   filtrage, quasi-doublons, lots) -> embeddings (cache + encodage) -> index (écriture)
+# Débit de chaque étape et occupation des files affichés à la fin (goulots d'étranglement).
+#
+# Usage : python anstat_pipeline.py --documents <dossier PDF>
+# ============================================================
+
+import argparse
+import json
+import queue
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from itertools import islice
+from pathlib import Path
+from typing import Any, Dict, Iterator
+
+import anstat_embedding_and_faiss as emb
+from anstat_preparation_fast import (
+    FastRAGPipeline,
+    PipelineConfigFast,
+    _init_worker,
+    _process_page_range_task,
+)
+
+# ============================================================
+# CONFIGURATION
+# ============================================================
+
+DOCUMENTS_DIR = Path(r"C:\Users\KABA\rag_anstat\pro\documents")
+REPORT_FILE   = emb.OUTPUT_DIR / "pipeline_report.json"
+
+QUEUE_SIZE    = 4    # Éléments en attente entre deux étapes (plages de pages ou lots de chunks)
+IN_FLIGHT     = 2    # Plages de pages soumises par processus d'extraction
+
+_DONE = object()     # Fin de flux dans une file
+
+
+class PipelineAborted(Exception):
+    """Une autre étape a échoué: arrêt sans attendre une file qui ne sera plus servie."""
+
+
+# ============================================================
+# FILES BORNÉES INSTRUMENTÉES
+# ============================================================
+
+class StageQueue:
+    """
+    File bornée entre deux étapes. Mesure l'occupation à chaque dépôt, le temps où le producteur
+    est bloqué (file pleine: l'aval est le goulot) et celui où le consommateur attend (file vide:
+    l'amont est le goulot).
+    """
+
+    def __init__(self, name: str, maxsize: int, abort: threading.Event):
+        self.name = name
+        self.maxsize = maxsize
+        self.abort = abort
+        self.queue = queue.Queue(maxsize)
+        self.puts = 0
+        self.occupancy = 0
+        self.producer_blocked = 0.0
+        self.consumer_waiting = 0.0
+
+    def put(self, item):
+        self.occupancy += self.queue.qsize()
+        self.puts += 1
+        start = time.perf_counter()
+        while True:
+            try:
+                self.queue.put(item, timeout=0.1)
+                break
+            except queue.Full:
+                if self.abort.is_set():
+                    raise PipelineAborted(self.name)
+        self.producer_blocked += time.perf_counter() - start
+
+    def close(self):
+        self.queue.put(_DONE)
+
+    def __iter__(self) -> Iterator[Any]:
+        while True:
+            start = time.perf_counter()
+            while True:
+                try:
+                    item = self.queue.get(timeout=0.1)
+                    break
+                except queue.Empty:
+                    if self.abort.is_set():
+                        raise PipelineAborted(self.name)
+            self.consumer_waiting += time.perf_counter() - start
+            if item is _DONE:
+                return
+            yield item
+
+    def report(self) -> Dict[str, Any]:
+        return {
+            "maxsize": self.maxsize,
+            "items": self.puts,
+            "avg_occupancy": self.occupancy / self.puts if self.puts else 0.0,
+            "producer_blocked_s": round(self.producer_blocked, 3),
+            "consumer_waiting_s": round(self.consumer_waiting, 3),
+        }
+
+
+class Stage(threading.Thread):
+    """Étape exécutée dans un thread: ferme sa file de sortie, signale son échec aux autres."""
+
+    def __init__(self, name: str, unit: str, work, output: StageQueue, abort: threading.Event):
+        super().__init__(name=name, daemon=True)
+        self.unit = unit
+        self.work = work
+        self.output = output
+        self.abort = abort
+        self.items = 0
+        self.seconds = 0.0
+        self.error = None
+
+    def run(self):
+        start = time.perf_counter()
+        try:
+            self.work(self)
+            self.output.close()
+        except PipelineAborted:
+            pass
+        except BaseException as e:
+            self.error = e
+            self.abort.set()
+        finally:
+            self.seconds = time.perf_counter() - start
+
+
+# ============================================================
+# ÉTAPES
+# ============================================================
+
+def extraction_stage(pipeline: FastRAGPipeline, units: list, log_queue, parts: StageQueue):
+    """Plages de pages extraites et découpées en chunks par le pool, IN_FLIGHT par processus au plus."""
+    config = pipeline.config
+
+    def work(stage: Stage):
+        with ProcessPoolExecutor(max_workers=config.max_workers, initializer=_init_worker,
+                                 initargs=(config, log_queue)) as executor:
+            todo = iter(units)
+            pending = {}
+            while True:
+                for pdf, start, end in islice(todo, config.max_workers * IN_FLIGHT - len(pending)):
+                    pending[executor.submit(_process_page_range_task, pdf, start, end)] = (pdf, start, end)
+                if not pending:
+                    break
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    pdf, start, end = pending.pop(future)
+                    parts.put((pdf, future.result()))
+                    stage.items += end - start
+
+    return work
+
+
+def documents_stage(pipeline: FastRAGPipeline, units: list, parts: StageQueue, batches: StageQueue,
+                    corpus, results: list, dedup: emb.NearDuplicateIndex,
+                    fingerprints: emb.DocumentFingerprints, batch_size: int):
+    """
+    Plages fusionnées par document (ajout au corpus), puis chunks filtrés comme dans
+    anstat_embedding_and_faiss.py (empreintes par document), quasi-doublons écartés et
+    regroupés en lots.
+    """
+    expected = {}
+    for pdf, _, _ in units:
+        expected[pdf] = expected.get(pdf, 0) + 1
+
+    def iter_chunks() -> Iterator[Dict[str, Any]]:
+        pending = {pdf: [] for pdf in expected}
+        for pdf, part in parts:
+            pending[pdf].append(part)
+            if len(pending[pdf]) < expected[pdf]:
+                continue
+
+            document_parts = sorted(pending.pop(pdf), key=lambda p: p["start"])
+            result = pipeline.merge_page_ranges(pdf, document_parts, corpus)
+            results.append((pdf, result))
+            if not result["output_file"]:
+                continue
+            for document_part in document_parts:
+                for chunk in document_part["chunks"]:
+                    filtered = emb.chunk_from_corpus_row(pipeline.corpus_row(chunk, result["output_file"]))
+                    if filtered:
+                        yield filtered
+
+    def work(stage: Stage):
+        chunks = emb.iter_unique_chunks(iter_chunks(), verbose=False, dedup=dedup, fingerprints=fingerprints)
+        for batch in emb.iter_batches(chunks, batch_size):
+            batches.put(batch)
+            stage.items += len(batch)
+
+    return work
+
+
+def embedding_stage(batches: StageQueue, embedded: StageQueue):
+    """Lots embeddés (cache d'embeddings, encodage des seuls textes absents)."""
+    cache = emb.EmbeddingCache(emb.EMBEDDING_MODEL_NAME)
+
+    def work(stage: Stage):
+        for batch in batches:
+            embeddings, hits = emb.embed_with_cache([c["content"] for c in batch], cache, show_progress=False)
+            embedded.put((batch, embeddings, hits))
+            stage.items += len(batch)
+
+    return work
+
+
+# ============================================================
+# ORCHESTRATION
+# ============================================================
+
+def run_pipeline(config: PipelineConfigFast, batch_size: int = emb.BUILD_BATCH_SIZE,
+                 index_type: str = emb.INDEX_TYPE, queue_size: int = QUEUE_SIZE) -> Dict[str, Any]:
+    pipeline = FastRAGPipeline(config)
+    log_queue, listener = pipeline.start_log_writer()
+    try:
+        return _run_pipeline(pipeline, log_queue, batch_size, index_type, queue_size)
+    finally:
+        pipeline.stop_log_writer(listener)
+
+
+def _run_pipeline(pipeline: FastRAGPipeline, log_queue, batch_size: int, index_type: str,
+                  queue_size: int) -> Dict[str, Any]:
+    config = pipeline.config
+    pdf_files = pipeline.find_pdfs()
+    print(f"📚 Documents trouvés: {len(pdf_files)}")
+    units, failed = pipeline.plan_page_ranges(pdf_files)
+    total_pages = sum(end - start for _, start, end in units)
+    if not units:
+        print("❌ Aucun PDF lisible")
+        return {"error": "Aucun PDF lisible"}
+    print(f"📄 {total_pages} pages en {len(units)} plages, {config.max_workers} processus d'extraction")
+
+    abort = threading.Event()
+    parts = StageQueue("pages -> documents", queue_size * config.max_workers, abort)
+    batches = StageQueue("documents -> embeddings", queue_size, abort)
+    embedded = StageQueue("embeddings -> index", queue_size, abort)
+
+    results = []
+    dedup = emb.NearDuplicateIndex()
+    fingerprints = emb.DocumentFingerprints()
+    corpus = pipeline.open_corpus(set())
+    stages = [
+        Stage("extraction", "pages", extraction_stage(pipeline, units, log_queue, parts), parts, abort),
+        Stage("documents", "chunks", documents_stage(pipeline, units, parts, batches, corpus, results,
+                                                     dedup, fingerprints, batch_size), batches, abort),
+        Stage("embeddings", "chunks", embedding_stage(batches, embedded), embedded, abort),
+    ]
+
+    start_time = time.perf_counter()
+    for stage in stages:
+        stage.start()
+
+    # Étape index dans le thread principal (écriture en flux, puis IVF/SQ8/PQ éventuel)
+    try:
+        index, stats = emb.build_index_streaming(None, batch_size, index_type, embedded=embedded, dedup=dedup,
+                                                  fingerprints=fingerprints)
+    except BaseException:
+        abort.set()
+        corpus.close()
+        for stage in stages:
+            stage.join()
+        error = next((stage for stage in stages if stage.error), None)
+        if error:
+            raise RuntimeError(f"Étape {error.name}: {error.error}") from error.error
+        raise
+    index_seconds = time.perf_counter() - start_time
+    for stage in stages:
+        stage.join()
+
+    pipeline.commit_corpus(corpus)
+
+    # Manifeste de la préparation, cohérent avec le corpus reconstruit
+    documents = {}
+    for pdf, result in results:
+        if result["success"]:
+            documents[str(pdf.relative_to(config.documents_dir))] = pipeline.manifest_entry(pdf, result)
+    pipeline.save_manifest({"config_fingerprint": pipeline.config_fingerprint(), "documents": documents})
+
+    total_time = time.perf_counter() - start_time
+    stage_report = {
+        stage.name: {"unit": stage.unit, "items": stage.items, "seconds": round(stage.seconds, 3),
+                     "per_second": stage.items / stage.seconds if stage.seconds else 0.0}
+        for stage in stages
+    }
+    stage_report["index"] = {"unit": "chunks", "items": stats["total_chunks"], "seconds": round(index_seconds, 3),
+                             "per_second": stats["total_chunks"] / index_seconds if index_seconds else 0.0}
+
+    report = {
+        "documents": len(pdf_files),
+        "successful_documents": sum(1 for _, result in results if result["success"]),
+        "failed_files": [{"file": r["file"], "error": r["error"]} for r in failed]
+                        + [{"file": r["file"], "error": r["error"]} for _, r in results if not r["success"]],
+        "pages": total_pages,
+        "chunks_indexed": stats["total_chunks"],
+        "near_duplicates_removed": stats["near_duplicates"],
+        "cache_hits": stats["cache_hits"],
+        "index_type": index_type,
+        "total_seconds": round(total_time, 3),
+        "stages": stage_report,
+        "queues": {q.name: q.report() for q in (parts, batches, embedded)},
+    }
+    with open(REPORT_FILE, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+
+    print_report(report)
+    return report
+
+
+def print_report(report: Dict[str, Any]):
+    print("\n" + "=" * 60)
+    print("RAPPORT DU PIPELINE")
+    print("=" * 60)
+    print(f"✅ Documents: {report['successful_documents']}/{report['documents']} | Pages: {report['pages']} | "
+          f"Chunks indexés: {report['chunks_indexed']} | Temps total: {report['total_seconds']:.1f}s")
+    print(f"♻️ Cache embeddings: {report['cache_hits']} | Quasi-doublons écartés: {report['near_duplicates_removed']}")
+
+    print("\n⏱️ Étapes (durée de vie du thread, attentes comprises):")
+    for name, stage in report["stages"].items():
+        print(f"   • {name:<11} {stage['items']:>8} {stage['unit']:<6} en {stage['seconds']:>7.1f}s "
+              f"({stage['per_second']:.1f} {stage['unit']}/s)")
+
+    print("\n📦 Files (producteur bloqué = aval trop lent, consommateur en attente = amont trop lent):")
+    for name, q in report["queues"].items():
+        print(f"   • {name:<24} occupation moyenne {q['avg_occupancy']:.1f}/{q['maxsize']} | "
+              f"producteur bloqué {q['producer_blocked_s']:.1f}s | consommateur en attente {q['consumer_waiting_s']:.1f}s")
+
+    if report["failed_files"]:
+        print(f"\n❌ Documents échoués: {len(report['failed_files'])}")
+        for failed in report["failed_files"][:5]:
+            print(f"   • {failed['file']}: {str(failed['error'])[:50]}...")
+
+    print(f"\n📁 Index: {emb.OUTPUT_DIR} | Rapport: {REPORT_FILE.name}")
+
+
+# ============================================================
+# POINT D'ENTRÉE
+# ============================================================
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Pipeline complet PDF -> chunks -> embeddings -> index FAISS")
+    parser.add_argument("--documents", type=Path, default=DOCUMENTS_DIR, help="Dossier des PDF")
+    parser.add_argument("--chunks-dir", type=Path, default=emb.CHUNKS_DIR,
+                        help="Dossier du corpus (corpus.jsonl) et du manifeste")
+    parser.add_argument("--workers", type=int, default=None, help="Processus d'extraction (défaut: coeurs - 1)")
+    parser.add_argument("--chunking-mode", choices=["chars", "tokens"], default="chars",
+                        help="tokens: chunks alignés sur la fenêtre du modèle d'embedding")
+    parser.add_argument("--taxonomy", type=Path, default=None,
+                        help="Taxonomie des domaines (JSON {domaine: [mots-clés]}) pour l'annotation des chunks")
+    parser.add_argument("--batch-size", type=int, default=emb.BUILD_BATCH_SIZE, help="Chunks par lot d'embeddings")
+    parser.add_argument("--queue-size", type=int, default=QUEUE_SIZE, help="Capacité des files entre étapes")
+    parser.add_argument("--index-type", choices=["flat", "sq8", "pq"], default=emb.INDEX_TYPE,
+                        help="Codage des vecteurs de l'index (sq8/pq: re-scoring exact dans l'API)")
+    parser.add_argument("--encode-workers", type=int, default=emb.ENCODE_WORKERS,
+                        help="Processus d'encodage (0 = thread de l'étape embeddings)")
+    parser.add_argument("--encode-threads", type=int, default=emb.ENCODE_THREADS,
+                        help="Threads torch par processus d'encodage")
+    args = parser.parse_args()
+    emb.ENCODE_WORKERS, emb.ENCODE_THREADS = args.encode_workers, args.encode_threads
+
+    if not args.documents.exists():
+        print(f"❌ Répertoire introuvable: {args.documents}")
+    else:
+        # Mêmes paramètres de chunking que main_fast()
+        run_pipeline(
+            PipelineConfigFast(
+                documents_dir=args.documents,
+                output_dir=args.chunks_dir,
+                chunk_size=1200,
+                chunk_overlap=200,
+                min_chunk_size=200,
+                max_chunk_size=2000,
+                max_workers=args.workers,
+                chunking_mode=args.chunking_mode,
+                taxonomy_file=args.taxonomy,
+            ),
+            batch_size=args.batch_size,
+            index_type=args.index_type,
+            queue_size=args.queue_size,
+        )
@@ -8,19 +8,67 @@ import os
 import json
 import time
 import hashlib
+import logging
+import logging.handlers
+import pickle
 import traceback
 import re
+from collections import Counter
 from pathlib import Path
 from typing import List, Dict, Any, Tuple
 from datetime import datetime, timezone
 from concurrent.futures import ProcessPoolExecutor, as_completed
 from dataclasses import dataclass, field
+from functools import lru_cache
 import multiprocessing
 
 import fitz  # PyMuPDF
 import pandas as pd
 import numpy as np
 
+from anstat_annotation import load_annotator
+
+# Version de l'extraction/chunking : a incrementer quand le code change la sortie,
+# pour invalider le manifeste et retraiter tous les documents
+CHUNKING_VERSION = "fast_chunking-3"
+
+# Extraction par blocs (get_text("dict")): texte sans images, marges haute/basse où chercher les
+# en-têtes/pieds de page répétés, part minimale des pages d'une plage où un bloc de marge doit
+# revenir pour être retiré, et taille de police relative au corps de texte d'un titre
+TEXT_FLAGS = fitz.TEXTFLAGS_DICT & ~fitz.TEXT_PRESERVE_IMAGES
+MARGIN_RATIO = 0.08
+REPEATED_BLOCK_SHARE = 0.4
+HEADING_SIZE_RATIO = 1.2
+PAGE_NUMBER = re.compile(r'^\W*(page\s*)?#(\s*(/|sur|of)\s*#)?\W*$')
+
+# Corpus: une ligne JSON par chunk, colonnes à plat toujours présentes (None si absente) et typées,
+# lisible en flux ou par colonnes (pandas.read_json(lines=True)). source_file garde le nom de
+# l'ancien fichier par document ([nom]_chunks.json), identifiant du document dans l'index.
+CORPUS_FILE_NAME = "corpus.jsonl"
+CORPUS_COLUMNS = {
+    "chunk_id": str,
+    "source_file": str,
+    "document_name": str,
+    "document_path": str,
+    "page_number": int,
+    "chunk_index": int,
+    "text": str,
+    "content_type": str,
+    "domains": list,
+    "primary_domain": str,
+    "word_count": int,
+    "char_count": int,
+    "sentence_count": int,
+    "token_count": int,
+    "extraction_method": str,
+    "created_at": str
+}
+
+# Logs: tous les processus envoient leurs messages dans une file, un seul écrivain
+# (processus principal) les écrit par paquets de LOG_BUFFER_SIZE
+LOGGER_NAME = "anstat_preparation"
+LOG_BUFFER_SIZE = 200
+
 # ============================================================================
 # CONFIGURATION OPTIMISÉE
 # ============================================================================
@@ -40,7 +88,16 @@ class PipelineConfigFast:
         use_semantic_chunking: bool = False,  # DÉSACTIVÉ pour la vitesse
         use_spacy: bool = False,  # DÉSACTIVÉ par défaut
         max_workers: int = None,  # Auto-détection
-        log_level: str = "INFO"
+        log_level: str = "INFO",
+        incremental: bool = True,  # Ne retraiter que les PDFs modifiés (manifest.json)
+        pages_per_task: int = 50,  # Les gros PDFs sont découpés en plages de pages parallèles
+        chunking_mode: str = "chars",  # "tokens": longueurs mesurées avec le tokenizer du modèle d'embedding
+        tokenizer_name: str = "sentence-transformers/paraphrase-multilingual-MiniLM-L12-v2",
+        max_tokens: int = 128,  # Fenêtre du modèle (max_seq_length), tokens spéciaux compris
+        token_overlap: int = 32,  # Recouvrement entre chunks consécutifs, en tokens
+        measure_truncation: bool = False,  # Mode tokens: rapport de troncature avant/après (re-chunking en caractères)
+        measure_overhead: bool = False,  # Rapport du surcoût IPC + logs avant/après (micro-benchmarks en fin de run)
+        taxonomy_file: Path = None  # Taxonomie des domaines (JSON), défaut: DEFAULT_TAXONOMY d'anstat_annotation
     ):
         self.documents_dir = documents_dir
         self.output_dir = output_dir
@@ -52,11 +109,29 @@ class PipelineConfigFast:
         self.use_spacy = use_spacy
         self.max_workers = max_workers or max(1, multiprocessing.cpu_count() - 1)
         self.log_level = log_level
+        self.incremental = incremental
+        self.pages_per_task = pages_per_task
+        self.chunking_mode = chunking_mode
+        self.tokenizer_name = tokenizer_name
+        self.max_tokens = max_tokens
+        self.token_overlap = token_overlap
+        self.measure_truncation = measure_truncation
+        self.measure_overhead = measure_overhead
+        self.taxonomy_file = taxonomy_file
         
         # Créer les répertoires
         self.output_dir.mkdir(parents=True, exist_ok=True)
         (self.output_dir / "logs").mkdir(exist_ok=True)
 
+@lru_cache(maxsize=2)
+def load_tokenizer(name: str):
+    """Tokenizer du modèle d'embedding (chargé une fois par processus)"""
+    try:
+        from transformers import AutoTokenizer
+    except ImportError as e:
+        raise RuntimeError("chunking_mode='tokens' nécessite le paquet transformers") from e
+    return AutoTokenizer.from_pretrained(name)
+
 # ============================================================================
 # PIPELINE OPTIMISÉ
 # ============================================================================
@@ -71,10 +146,17 @@ class FastRAGPipeline:
         # Expressions régulières optimisées
         self.sentence_endings = re.compile(r'[.!?]+[\s\n]+')
         self.paragraph_separator = re.compile(r'\n\s*\n')
-        self.juridical_patterns = {
-            'article': re.compile(r'^(Article|ART\.?)\s*\d+', re.IGNORECASE),
-            'loi': re.compile(r'^(Loi|Décret|Arrêté)\s', re.IGNORECASE),
-        }
+        # Textes juridiques (article, loi/décret/arrêté): une seule expression
+        self.juridical_pattern = re.compile(r'^(?:(?:Article|ART\.?)\s*\d+|(?:Loi|Décret|Arrêté)\s)', re.IGNORECASE)
+        
+        # Annotation par domaine statistique (taxonomie compilée une fois par processus)
+        self.annotator = load_annotator(config.taxonomy_file)
+        
+        # Manifeste des documents déjà traités
+        self.manifest_file = self.output_dir / "manifest.json"
+        self.corpus_file = self.output_dir / CORPUS_FILE_NAME
+        # Point de reprise: documents déjà écrits dans le corpus temporaire du traitement en cours
+        self.checkpoint_file = self.output_dir / "checkpoint.json"
         
         # Log file
         self.log_file = self.output_dir / "logs" / f"fast_pipeline_{datetime.now().strftime('%Y%m%d_%H%M%S')}.log"
@@ -82,72 +164,175 @@ class FastRAGPipeline:
         # Stats globales
         self.total_pages = 0
         self.total_chunks = 0
+        self.log_count = 0
         self.start_time = time.time()
     
     def log(self, message: str, level: str = "INFO"):
-        """Journalisation rapide"""
-        timestamp = datetime.now().strftime("%H:%M:%S")
-        
-        with open(self.log_file, 'a', encoding='utf-8') as f:
-            f.write(f"[{timestamp}] [{level}] {message}\n")
+        """Journalisation rapide (fichier via la file de logs, voir start_log_writer)"""
+        logging.getLogger(LOGGER_NAME).log(getattr(logging, level, logging.INFO), message)
+        self.log_count += 1
         
         if level == "ERROR" or self.config.log_level == "INFO":
             print(f"[{level}] {message}")
     
+    def start_log_writer(self):
+        """
+        Écrivain unique du fichier de log: les messages de tous les processus arrivent par une
+        file et sont écrits par paquets. Renvoie (file, listener) ; arrêter le listener pour vider.
+        """
+        log_queue = multiprocessing.Queue()
+        file_handler = logging.FileHandler(self.log_file, encoding="utf-8")
+        file_handler.setFormatter(logging.Formatter("[%(asctime)s] [%(levelname)s] %(message)s", "%H:%M:%S"))
+        buffered = logging.handlers.MemoryHandler(LOG_BUFFER_SIZE, flushLevel=logging.ERROR, target=file_handler)
+        listener = logging.handlers.QueueListener(log_queue, buffered)
+        listener.start()
+        _attach_log_queue(log_queue)
+        return log_queue, listener
+    
+    @staticmethod
+    def stop_log_writer(listener: logging.handlers.QueueListener):
+        listener.stop()
+        for handler in listener.handlers:
+            target = handler.target
+            handler.close()  # MemoryHandler: vide le tampon dans le fichier
+            target.close()
+    
     # ------------------------------------------------------------------------
     # EXTRACTION RAPIDE
     # ------------------------------------------------------------------------
     
-    def extract_text_fast(self, pdf_path: Path) -> Tuple[List[Dict[str, Any]], Dict[str, Any]]:
-        """Extraction rapide sans analyse structurelle lourde"""
-        self.log(f"Extraction: {pdf_path.name}")
+    def extract_text_fast(self, pdf_path: Path, start: int = 0, end: int = None) -> Tuple[List[Dict[str, Any]], Dict[str, Any]]:
+        """
+        Extraction par blocs (pages [start, end), tout le document par défaut): paragraphes, titres
+        et zones de tableau restent séparés, les en-têtes/pieds de page répétés sont retirés.
+        Lève RuntimeError si le PDF ou une page est illisible.
+        """
+        self.log(f"Extraction: {pdf_path.name}" + (f" (pages {start + 1}-{end})" if end is not None else ""))
         
         try:
             doc = fitz.open(pdf_path)
-            pages_data = []
+            end = len(doc) if end is None else min(end, len(doc))
             
-            for page_num, page in enumerate(doc, start=1):
-                # Extraction simple et rapide
-                text = page.get_text("text").strip()
-                
-                if not text:
+            # Une seule lecture par page: blocs + clés des blocs de marge
+            pages_blocks = []
+            for page_num in range(start + 1, end + 1):
+                blocks = self.page_blocks(doc[page_num - 1])
+                if blocks:
+                    pages_blocks.append((page_num, blocks))
+            
+            doc.close()
+            
+            # En-têtes/pieds de page: blocs de marge qui reviennent sur une bonne part des pages
+            counts = Counter(key for _, blocks in pages_blocks for key in {b["margin_key"] for b in blocks} if key)
+            min_count = max(2, REPEATED_BLOCK_SHARE * len(pages_blocks))
+            repeated = {key for key, count in counts.items() if count >= min_count or PAGE_NUMBER.match(key)}
+            
+            pages_data = []
+            removed_blocks = 0
+            for page_num, blocks in pages_blocks:
+                kept = [b for b in blocks if b["margin_key"] not in repeated]
+                removed_blocks += len(blocks) - len(kept)
+                if not kept:
                     continue
                 
-                # Nettoyage rapide
-                text = re.sub(r'\s+', ' ', text)  # Espaces multiples
-                text = re.sub(r'\n{3,}', '\n\n', text)  # Sauts de ligne multiples
-                
+                # Paragraphes séparés par une ligne vide (paragraph_separator)
+                text = "\n\n".join(b["text"] for b in kept)
                 pages_data.append({
                     "page_number": page_num,
                     "text": text,
+                    "blocks": [{"type": b["type"], "text": b["text"]} for b in kept],
                     "char_count": len(text),
                     "word_count": len(text.split())
                 })
             
-            doc.close()
-            
             # Métadonnées basiques
             metadata = {
                 "document_name": pdf_path.name,
                 "document_path": str(pdf_path),
                 "document_size": pdf_path.stat().st_size,
                 "total_pages": len(pages_data),
+                "repeated_blocks_removed": removed_blocks,
                 "extraction_date": datetime.now(timezone.utc).isoformat()
             }
             
             return pages_data, metadata
             
         except Exception as e:
-            self.log(f"Erreur extraction {pdf_path.name}: {str(e)}", "ERROR")
-            return [], {}
+            # Propagée: une plage en échec fait échouer tout le document (repris au prochain lancement)
+            pages = f" (pages {start + 1}-{end})" if end is not None else ""
+            raise RuntimeError(f"Erreur extraction{pages}: {str(e)}") from e
+    
+    def page_blocks(self, page) -> List[Dict[str, Any]]:
+        """
+        Blocs de texte d'une page: type (paragraphe, titre, tableau), texte nettoyé et clé de
+        comparaison (chiffres masqués) pour les blocs situés dans la marge haute ou basse
+        """
+        data = page.get_text("dict", flags=TEXT_FLAGS)
+        height = data["height"]
+        blocks = []
+        
+        for block in data["blocks"]:
+            if block.get("type", 0) != 0:
+                continue
+            
+            lines, cells, sizes, bold, columnar = [], [], [], True, 0
+            for line in block["lines"]:
+                spans = [span for span in line["spans"] if span["text"].strip()]
+                if not spans:
+                    continue
+                lines.append(" ".join(span["text"].strip() for span in spans))
+                cells.append(" | ".join(span["text"].strip() for span in spans))
+                sizes.extend((span["size"], len(span["text"])) for span in spans)
+                bold = bold and all(span["flags"] & 16 for span in spans)
+                # Cellules: spans d'une même ligne séparés par un large blanc horizontal
+                columnar += any(b["bbox"][0] - a["bbox"][2] > a["size"] for a, b in zip(spans, spans[1:]))
+            if not lines:
+                continue
+            
+            if len(lines) >= 2 and columnar * 2 >= len(lines):
+                block_type, text = "tableau", "\n".join(cells)
+            else:
+                block_type, text = "paragraphe", lines[0]
+                for line in lines[1:]:
+                    # Mot coupé en fin de ligne: recoller sans le tiret
+                    if text.endswith("-") and line[:1].islower():
+                        text = text[:-1] + line
+                    else:
+                        text = f"{text} {line}"
+                text = re.sub(r'[ \t]+', ' ', text)
+            
+            y0, y1 = block["bbox"][1], block["bbox"][3]
+            in_margin = y1 <= height * MARGIN_RATIO or y0 >= height * (1 - MARGIN_RATIO)
+            blocks.append({
+                "type": block_type,
+                "text": text.strip(),
+                "size": max(size for size, _ in sizes),
+                "bold": bold,
+                "chars": sizes,
+                "margin_key": re.sub(r'\d+', '#', text.lower()).strip() if in_margin else None
+            })
+        
+        # Titres: blocs courts en gras ou en police nettement plus grande que le corps du texte
+        weights = Counter()
+        for block in blocks:
+            for size, chars in block.pop("chars"):
+                weights[round(size, 1)] += chars
+        body_size = weights.most_common(1)[0][0] if weights else 0
+        for block in blocks:
+            if (block["type"] == "paragraphe" and len(block["text"]) < 200 and
+                    (block["size"] >= body_size * HEADING_SIZE_RATIO or block["bold"])):
+                block["type"] = "titre"
+        
+        return blocks
     
     # ------------------------------------------------------------------------
     # CHUNKING RAPIDE (SANS spaCy)
     # ------------------------------------------------------------------------
     
-    def fast_chunking(self, pages_data: List[Dict[str, Any]], metadata: Dict[str, Any]) -> List[Dict[str, Any]]:
-        """Chunking rapide basé sur paragraphes et taille fixe"""
+    def fast_chunking(self, pages_data: List[Dict[str, Any]], metadata: Dict[str, Any], mode: str = None) -> List[Dict[str, Any]]:
+        """Chunking rapide basé sur paragraphes et taille fixe (ou sur la fenêtre du tokenizer)"""
         all_chunks = []
+        mode = mode or self.config.chunking_mode
         
         for page in pages_data:
             text = page["text"]
@@ -166,11 +351,20 @@ class FastRAGPipeline:
                         all_chunks.append(chunk)
                 continue
             
-            # Méthode 1: D'abord par paragraphes
-            paragraphs = [p.strip() for p in self.paragraph_separator.split(text) if p.strip()]
+            if mode == "tokens":
+                all_chunks.extend(self._chunk_by_tokens(text, page_num, metadata))
+                continue
+            
+            # Méthode 1: D'abord par paragraphes (blocs de l'extraction: titres et tableaux ouvrent un chunk)
+            if page.get("blocks"):
+                paragraphs = [block["text"] for block in page["blocks"]]
+                boundaries = {i for i, block in enumerate(page["blocks"]) if block["type"] != "paragraphe"}
+            else:
+                paragraphs = [p.strip() for p in self.paragraph_separator.split(text) if p.strip()]
+                boundaries = set()
             
             if paragraphs:
-                chunks_from_paragraphs = self._chunk_by_paragraphs(paragraphs, page_num, metadata)
+                chunks_from_paragraphs = self._chunk_by_paragraphs(paragraphs, page_num, metadata, boundaries)
                 all_chunks.extend(chunks_from_paragraphs)
             else:
                 # Méthode 2: Par taille fixe avec overlap intelligent
@@ -179,19 +373,94 @@ class FastRAGPipeline:
         
         return all_chunks
     
-    def _chunk_by_paragraphs(self, paragraphs: List[str], page_num: int, metadata: Dict[str, Any]) -> List[Dict[str, Any]]:
-        """Chunking basé sur paragraphes (plus naturel)"""
+    def _chunk_by_tokens(self, text: str, page_num: int, metadata: Dict[str, Any]) -> List[Dict[str, Any]]:
+        """
+        Fenêtres de tokens qui tiennent dans max_tokens (tokens spéciaux compris), coupées de
+        préférence en fin de phrase, avec token_overlap tokens de recouvrement
+        """
+        tokenizer = load_tokenizer(self.config.tokenizer_name)
+        budget = self.config.max_tokens - tokenizer.num_special_tokens_to_add()
+        overlap = min(self.config.token_overlap, budget // 2)
+        offsets = tokenizer(text, add_special_tokens=False, return_offsets_mapping=True)["offset_mapping"]
+        
+        # Tokens qui commencent une phrase: points de coupure préférés
+        sentence_ends = [m.end() for m in self.sentence_endings.finditer(text)]
+        boundaries, k = set(), 0
+        for i, (token_start, _) in enumerate(offsets):
+            while k < len(sentence_ends) and sentence_ends[k] <= token_start:
+                boundaries.add(i)
+                k += 1
+        
+        chunks = []
+        chunk_index = 0
+        start = 0
+        while start < len(offsets):
+            end = min(start + budget, len(offsets))
+            if end < len(offsets):
+                cut = next((i for i in range(end, start + budget // 2, -1) if i in boundaries), None)
+                end = cut or end
+            
+            chunk = self._create_chunk_fast(
+                text=text[offsets[start][0]:offsets[end - 1][1]],
+                page_num=page_num,
+                metadata=metadata,
+                chunk_index=chunk_index,
+                token_count=end - start
+            )
+            if chunk:
+                chunks.append(chunk)
+                chunk_index += 1
+            
+            if end == len(offsets):
+                break
+            start = max(end - overlap, start + 1)
+        
+        return chunks
+    
+    def token_truncation(self, texts: List[str]) -> Dict[str, int]:
+        """Tokens de chaque texte au-dela de la fenêtre du modèle (tronqués à l'encodage, jamais vus)"""
+        stats = {"chunks": len(texts), "tokens": 0, "tokens_beyond_window": 0, "truncated_chunks": 0}
+        if not texts:
+            return stats
+        tokenizer = load_tokenizer(self.config.tokenizer_name)
+        for ids in tokenizer(texts, add_special_tokens=True)["input_ids"]:
+            stats["tokens"] += len(ids)
+            beyond = max(0, len(ids) - self.config.max_tokens)
+            stats["tokens_beyond_window"] += beyond
+            stats["truncated_chunks"] += beyond > 0
+        return stats
+    
+    def _chunk_by_paragraphs(self, paragraphs: List[str], page_num: int, metadata: Dict[str, Any],
+                             boundaries: set = frozenset()) -> List[Dict[str, Any]]:
+        """Chunking basé sur paragraphes (plus naturel); un paragraphe de boundaries ouvre un nouveau chunk"""
         chunks = []
         current_chunk = []
         current_length = 0
         chunk_index = 0
         
-        for para in paragraphs:
+        def flush():
+            nonlocal chunk_index
+            chunk_text = "\n\n".join(current_chunk)
+            if len(chunk_text) >= self.config.min_chunk_size:
+                chunk = self._create_chunk_fast(
+                    text=chunk_text,
+                    page_num=page_num,
+                    metadata=metadata,
+                    chunk_index=chunk_index
+                )
+                if chunk:
+                    chunks.append(chunk)
+                    chunk_index += 1
+        
+        for i, para in enumerate(paragraphs):
             para_length = len(para)
+            # Titre ou tableau: nouveau chunk si le courant est déjà exploitable
+            new_section = i in boundaries and current_length >= self.config.min_chunk_size
             
-            # Si le paragraphe seul est trop long, on le divise
+            # Si le paragraphe seul est trop long, on le divise (après avoir émis le chunk courant)
             if para_length > self.config.max_chunk_size:
-                # Diviser le paragraphe trop long
+                if current_chunk:
+                    flush()
                 sub_chunks = self._split_long_paragraph(para, page_num, metadata, chunk_index)
                 chunks.extend(sub_chunks)
                 chunk_index += len(sub_chunks)
@@ -199,41 +468,26 @@ class FastRAGPipeline:
                 current_length = 0
                 continue
             
-            # Ajouter au chunk courant si possible
-            if current_length + para_length <= self.config.chunk_size:
+            # Ajouter au chunk courant si possible (un chunk encore trop court absorbe le paragraphe
+            # jusqu'à max_chunk_size plutôt que d'être perdu)
+            fits = current_length + para_length <= self.config.chunk_size and not new_section
+            too_short = current_length < self.config.min_chunk_size and current_length + para_length <= self.config.max_chunk_size
+            if fits or too_short:
                 current_chunk.append(para)
                 current_length += para_length
             else:
                 # Créer un chunk avec les paragraphes accumulés
                 if current_chunk:
-                    chunk_text = "\n\n".join(current_chunk)
-                    if len(chunk_text) >= self.config.min_chunk_size:
-                        chunk = self._create_chunk_fast(
-                            text=chunk_text,
-                            page_num=page_num,
-                            metadata=metadata,
-                            chunk_index=chunk_index
-                        )
-                        if chunk:
-                            chunks.append(chunk)
-                            chunk_index += 1
+                    flush()
                 
-                # Pour l'overlap, garder le dernier paragraphe
-                current_chunk = [para] if para_length <= self.config.chunk_overlap else []
-                current_length = para_length
+                # Pour l'overlap, garder le dernier paragraphe s'il est court (pas entre deux sections)
+                overlap = [] if new_section else [p for p in current_chunk[-1:] if len(p) <= self.config.chunk_overlap]
+                current_chunk = overlap + [para]
+                current_length = sum(len(p) for p in current_chunk)
         
         # Dernier chunk
         if current_chunk:
-            chunk_text = "\n\n".join(current_chunk)
-            if len(chunk_text) >= self.config.min_chunk_size:
-                chunk = self._create_chunk_fast(
-                    text=chunk_text,
-                    page_num=page_num,
-                    metadata=metadata,
-                    chunk_index=chunk_index
-                )
-                if chunk:
-                    chunks.append(chunk)
+            flush()
         
         return chunks
     
@@ -375,7 +629,8 @@ class FastRAGPipeline:
         
         return chunks
     
-    def _create_chunk_fast(self, text: str, page_num: int, metadata: Dict[str, Any], chunk_index: int) -> Dict[str, Any]:
+    def _create_chunk_fast(self, text: str, page_num: int, metadata: Dict[str, Any], chunk_index: int,
+                           token_count: int = None) -> Dict[str, Any]:
         """Création rapide d'un chunk"""
         try:
             if not text or len(text.strip()) < self.config.min_chunk_size:
@@ -394,22 +649,9 @@ class FastRAGPipeline:
             content_type = "paragraphe"
             if len(text) < 200 and (text.isupper() or text.endswith(':')):
                 content_type = "titre"
-            elif any(pattern.search(text) for pattern in self.juridical_patterns.values()):
+            elif self.juridical_pattern.search(text):
                 content_type = "article"
             
-            # Thèmes simples
-            themes = []
-            text_lower = text.lower()
-            theme_keywords = {
-                'statistique': ['statistique', 'donnée', 'pourcentage', 'enquête', 'échantillon'],
-                'financier': ['budget', 'finance', 'coût', 'euro', 'dépense'],
-                'social': ['pauvreté', 'social', 'ménage', 'revenu', 'population']
-            }
-            
-            for theme, keywords in theme_keywords.items():
-                if any(keyword in text_lower for keyword in keywords):
-                    themes.append(theme)
-            
             chunk_data = {
                 "chunk_id": chunk_id,
                 "text": text,
@@ -419,7 +661,7 @@ class FastRAGPipeline:
                     "page_number": page_num,
                     "chunk_index": chunk_index,
                     "content_type": content_type,
-                    "themes": themes[:2],
+                    **self.annotator.annotate(text),
                     "word_count": word_count,
                     "char_count": char_count,
                     "sentence_count": text.count('.') + text.count('!') + text.count('?'),
@@ -427,6 +669,8 @@ class FastRAGPipeline:
                     "created_at": datetime.now(timezone.utc).isoformat()
                 }
             }
+            if token_count is not None:
+                chunk_data["metadata"]["token_count"] = token_count
             
             return chunk_data
             
@@ -448,66 +692,281 @@ class FastRAGPipeline:
             
             text = chunk.get("text", "")
             
-            # Critères simples
+            # Critères simples (en mode tokens, la fenêtre du tokenizer remplace la limite en caractères)
+            if "token_count" in chunk["metadata"]:
+                within_limit = chunk["metadata"]["token_count"] <= self.config.max_tokens
+            else:
+                within_limit = len(text) <= self.config.max_chunk_size
             if (len(text) >= self.config.min_chunk_size and 
-                len(text) <= self.config.max_chunk_size and
+                within_limit and
                 text.strip()):
                 valid_chunks.append(chunk)
         
         return valid_chunks
     
     # ------------------------------------------------------------------------
-    # TRAITEMENT PAR DOCUMENT
+    # MANIFESTE (TRAITEMENT INCRÉMENTAL)
     # ------------------------------------------------------------------------
     
-    def process_single_document(self, pdf_path: Path) -> Dict[str, Any]:
-        """Traiter un seul document (fonction pour parallélisation)"""
-        doc_start = time.time()
-        result = {
-            "file": pdf_path.name,
-            "success": False,
-            "chunks_count": 0,
-            "processing_time": 0,
-            "error": None
+    def config_fingerprint(self) -> str:
+        """Empreinte des paramètres qui déterminent les chunks produits"""
+        params = {
+            "version": CHUNKING_VERSION,
+            "chunk_size": self.config.chunk_size,
+            "chunk_overlap": self.config.chunk_overlap,
+            "min_chunk_size": self.config.min_chunk_size,
+            "max_chunk_size": self.config.max_chunk_size,
+            "use_semantic_chunking": self.config.use_semantic_chunking,
+            "use_spacy": self.config.use_spacy,
+            "taxonomy": self.annotator.fingerprint()
         }
+        if self.config.chunking_mode == "tokens":
+            params.update({
+                "chunking_mode": "tokens",
+                "tokenizer_name": self.config.tokenizer_name,
+                "max_tokens": self.config.max_tokens,
+                "token_overlap": self.config.token_overlap
+            })
+        return hashlib.sha256(json.dumps(params, sort_keys=True).encode()).hexdigest()[:16]
+    
+    @staticmethod
+    def file_hash(path: Path) -> str:
+        digest = hashlib.sha256()
+        with open(path, "rb") as f:
+            for block in iter(lambda: f.read(1 << 20), b""):
+                digest.update(block)
+        return digest.hexdigest()
+    
+    def load_manifest(self) -> Dict[str, Any]:
+        """Manifeste précédent ; tous les documents sont à retraiter si la configuration de chunking a changé"""
+        empty = {"config_fingerprint": self.config_fingerprint(), "documents": {}}
+        if not self.manifest_file.exists():
+            return empty
+        try:
+            with open(self.manifest_file, "r", encoding="utf-8") as f:
+                manifest = json.load(f)
+        except (OSError, ValueError) as e:
+            self.log(f"Manifeste illisible, retraitement complet: {e}", "WARNING")
+            return empty
+        changed = manifest.get("config_fingerprint") != empty["config_fingerprint"]
+        if changed or not self.config.incremental:
+            if changed:
+                self.log("Configuration de chunking modifiée: retraitement de tous les documents")
+            # Les anciennes sorties seront remplacées ou supprimées
+            empty["documents"] = {
+                key: {**entry, "sha256": None} for key, entry in manifest.get("documents", {}).items()
+            }
+        else:
+            empty["documents"] = manifest.get("documents", {})
+        return empty
+    
+    @staticmethod
+    def write_json_atomic(path: Path, data: Any):
+        """Écriture atomique et durable (temporaire + fsync + rename): jamais de fichier partiel"""
+        tmp_file = path.with_suffix(path.suffix + ".tmp")
+        with open(tmp_file, "w", encoding="utf-8") as f:
+            json.dump(data, f, ensure_ascii=False, indent=2)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_file, path)
+    
+    def save_manifest(self, manifest: Dict[str, Any]):
+        self.write_json_atomic(self.manifest_file, manifest)
+    
+    def is_unchanged(self, pdf_path: Path, entry: Dict[str, Any], require_output: bool = True) -> bool:
+        """
+        Document identique à celui du manifeste et dont le corpus existe encore (require_output).
+        Taille + mtime inchangées suffisent ; sinon le hash tranche (et met l'entrée à jour).
+        """
+        if not entry or not entry.get("sha256"):
+            return False
+        if require_output and entry.get("output") and not self.corpus_file.exists():
+            return False
+        stat = pdf_path.stat()
+        if stat.st_size == entry.get("size") and stat.st_mtime_ns == entry.get("mtime_ns"):
+            return True
+        if stat.st_size != entry.get("size") or self.file_hash(pdf_path) != entry["sha256"]:
+            return False
+        entry["mtime_ns"] = stat.st_mtime_ns  # Fichier touché mais identique
+        return True
+    
+    def manifest_entry(self, pdf_path: Path, result: Dict[str, Any]) -> Dict[str, Any]:
+        """Entrée du manifeste d'un document traité avec succès"""
+        stat = pdf_path.stat()
+        return {
+            "sha256": self.file_hash(pdf_path),
+            "size": stat.st_size,
+            "mtime_ns": stat.st_mtime_ns,
+            "output": result["output_file"],
+            "chunks_count": result["chunks_count"],
+            "pages_count": result.get("pages_count", 0),
+            "repeated_blocks_removed": result["repeated_blocks_removed"]
+        }
+    
+    def remove_output(self, output: str):
+        """Supprime l'ancien fichier [nom]_chunks.json d'un document (avant le corpus unique)"""
+        if output and (self.output_dir / output).exists():
+            (self.output_dir / output).unlink()
+    
+    # ------------------------------------------------------------------------
+    # CORPUS (JSONL)
+    # ------------------------------------------------------------------------
+    
+    @staticmethod
+    def corpus_row(chunk: Dict[str, Any], source_file: str) -> Dict[str, Any]:
+        """Ligne du corpus: colonnes de CORPUS_COLUMNS, dans cet ordre et de ce type"""
+        values = {**chunk["metadata"], "chunk_id": chunk["chunk_id"], "text": chunk["text"], "source_file": source_file}
+        return {
+            column: None if values.get(column) is None else kind(values[column])
+            for column, kind in CORPUS_COLUMNS.items()
+        }
+    
+    def open_corpus(self, keep: set):
+        """
+        Nouveau corpus (fichier temporaire, remplacé à la fin par commit_corpus): les lignes des
+        documents de keep (source_file inchangés) sont recopiées en flux depuis le corpus actuel
+        """
+        tmp_file = self.corpus_file.with_suffix(".jsonl.tmp")
+        corpus = open(tmp_file, "w", encoding="utf-8")
+        if keep and self.corpus_file.exists():
+            with open(self.corpus_file, "r", encoding="utf-8") as f:
+                for line in f:
+                    if json.loads(line)["source_file"] in keep:
+                        corpus.write(line)
+        return corpus
+    
+    def commit_corpus(self, corpus):
+        corpus.flush()
+        os.fsync(corpus.fileno())
+        corpus.close()
+        os.replace(corpus.name, self.corpus_file)
+    
+    # ------------------------------------------------------------------------
+    # POINT DE REPRISE (TRAITEMENT INTERROMPU)
+    # ------------------------------------------------------------------------
+    
+    def save_checkpoint(self, corpus, done: Dict[str, Any]):
+        """Après chaque document: corpus temporaire sur disque, puis sa taille et les documents qu'il contient"""
+        corpus.flush()
+        os.fsync(corpus.fileno())
+        self.write_json_atomic(self.checkpoint_file, {
+            "config_fingerprint": self.config_fingerprint(),
+            "corpus_bytes": os.fstat(corpus.fileno()).st_size,
+            "documents": done
+        })
+    
+    def resume_checkpoint(self, pdf_files: List[Path], keys: Dict[Path, str]) -> Tuple[Any, Dict[str, Any]]:
+        """
+        Reprise d'un traitement interrompu: corpus temporaire ramené au dernier document complet
+        (les lignes d'un document inachevé sont coupées) et documents déjà traités.
+        (None, {}) si pas de point de reprise valable: configuration, corpus ou PDFs modifiés.
+        """
+        if not self.checkpoint_file.exists():
+            return None, {}
+        tmp_file = self.corpus_file.with_suffix(".jsonl.tmp")
+        try:
+            with open(self.checkpoint_file, "r", encoding="utf-8") as f:
+                checkpoint = json.load(f)
+        except (OSError, ValueError):
+            return None, {}
+        
+        done = checkpoint.get("documents", {})
+        pdf_by_key = {key: pdf for pdf, key in keys.items()}
+        valid = (
+            checkpoint.get("config_fingerprint") == self.config_fingerprint()
+            and tmp_file.exists() and tmp_file.stat().st_size >= checkpoint.get("corpus_bytes", 0)
+            and all(key in pdf_by_key and self.is_unchanged(pdf_by_key[key], entry, require_output=False)
+                    for key, entry in done.items())
+        )
+        if not valid:
+            self.log("Point de reprise obsolète: traitement complet", "WARNING")
+            return None, {}
+        
+        os.truncate(tmp_file, checkpoint["corpus_bytes"])
+        return open(tmp_file, "a", encoding="utf-8"), done
+    
+    # ------------------------------------------------------------------------
+    # TRAITEMENT PAR DOCUMENT
+    # ------------------------------------------------------------------------
+    
+    def process_page_range(self, pdf_path: Path, start: int = 0, end: int = None) -> Dict[str, Any]:
+        """Extraction + chunking des pages [start, end) d'un document (unité de travail parallèle)"""
+        range_start = time.time()
+        log_count = self.log_count
+        part = {"start": start, "pages_count": 0, "chunks": [], "metadata": {}, "error": None}
         
         try:
             # 1. Extraction
-            pages_data, metadata = self.extract_text_fast(pdf_path)
-            
-            if not pages_data:
-                result["error"] = "Aucun texte extrait"
-                return result
+            pages_data, metadata = self.extract_text_fast(pdf_path, start, end)
             
-            # 2. Chunking
-            chunks = self.fast_chunking(pages_data, metadata)
+            # 2. Chunking (page par page: indices de chunks stables quel que soit le découpage)
+            chunks = self.fast_chunking(pages_data, metadata) if pages_data else []
             
             # 3. Validation
-            chunks = self.validate_chunks_fast(chunks)
+            part.update({
+                "pages_count": len(pages_data),
+                "chunks": self.validate_chunks_fast(chunks),
+                "metadata": metadata
+            })
             
-            # 4. Sauvegarde
-            if chunks:
-                output_file = self.output_dir / f"{pdf_path.stem.replace(' ', '_')}_chunks.json"
-                
-                output_data = {
-                    "metadata": metadata,
-                    "chunks_count": len(chunks),
-                    "processing_date": datetime.now(timezone.utc).isoformat(),
-                    "chunks": chunks
+            # 4. Troncature à l'encodage: chunks en caractères (avant) / en tokens (après).
+            #    Mesure seulement sur demande: double chunking et tokenisation de chaque plage
+            if self.config.chunking_mode == "tokens" and self.config.measure_truncation and pages_data:
+                baseline = self.validate_chunks_fast(self.fast_chunking(pages_data, metadata, mode="chars"))
+                part["truncation"] = {
+                    "before": self.token_truncation([chunk["text"] for chunk in baseline]),
+                    "after": self.token_truncation([chunk["text"] for chunk in part["chunks"]])
                 }
-                
-                with open(output_file, "w", encoding="utf-8") as f:
-                    json.dump(output_data, f, ensure_ascii=False, indent=2)
+        except Exception as e:
+            part["error"] = str(e)
+        
+        part["processing_time"] = time.time() - range_start
+        part["log_messages"] = self.log_count - log_count
+        return part
+    
+    def merge_page_ranges(self, pdf_path: Path, parts: List[Dict[str, Any]], corpus) -> Dict[str, Any]:
+        """Fusionne les plages d'un document dans l'ordre des pages et ajoute ses chunks au corpus"""
+        parts = sorted(parts, key=lambda part: part["start"])
+        pages_count = sum(part["pages_count"] for part in parts)
+        chunks = [chunk for part in parts for chunk in part["chunks"]]
+        result = {
+            "file": pdf_path.name,
+            "success": False,
+            "chunks_count": 0,
+            "processing_time": sum(part["processing_time"] for part in parts),
+            "output_file": None,
+            "error": next((part["error"] for part in parts if part["error"]), None)
+        }
+        
+        if result["error"]:
+            self.log(f"✗ {pdf_path.name}: {result['error']}", "ERROR")
+            return result
+        
+        if not pages_count:
+            result["error"] = "Aucun texte extrait"
+            return result
+        
+        try:
+            # 4. Ajout au corpus (document complet, vidé sur disque dès qu'il est fini)
+            if chunks:
+                source_file = f"{pdf_path.stem.replace(' ', '_')}_chunks.json"
+                corpus.writelines(
+                    json.dumps(self.corpus_row(chunk, source_file), ensure_ascii=False) + "\n" for chunk in chunks
+                )
+                corpus.flush()
+                result["output_file"] = source_file
             
             # 5. Mise à jour du résultat
             result.update({
                 "success": True,
                 "chunks_count": len(chunks),
-                "processing_time": time.time() - doc_start,
-                "pages_count": len(pages_data)
+                "pages_count": pages_count,
+                "repeated_blocks_removed": sum(part["metadata"].get("repeated_blocks_removed", 0)
+                                               for part in parts if part["metadata"])
             })
             
-            self.log(f"✓ {pdf_path.name}: {len(chunks)} chunks en {result['processing_time']:.1f}s")
+            self.log(f"✓ {pdf_path.name}: {len(chunks)} chunks en {result['processing_time']:.1f}s "
+                     f"({len(parts)} plage(s) de pages)")
             
         except Exception as e:
             result["error"] = str(e)
@@ -515,50 +974,161 @@ class FastRAGPipeline:
         
         return result
     
+    def process_single_document(self, pdf_path: Path, corpus) -> Dict[str, Any]:
+        """Traiter un seul document d'un bloc (sans découpage en plages)"""
+        return self.merge_page_ranges(pdf_path, [self.process_page_range(pdf_path)], corpus)
+    
+    def find_pdfs(self) -> List[Path]:
+        """PDFs du dossier source (sous-dossiers si aucun à la racine)"""
+        pdf_files = list(self.config.documents_dir.glob("*.pdf"))
+        if not pdf_files:
+            pdf_files = list(self.config.documents_dir.glob("**/*.pdf"))
+        return pdf_files
+    
+    def plan_page_ranges(self, pdf_files: List[Path]) -> Tuple[List[Tuple[Path, int, int]], List[Dict[str, Any]]]:
+        """
+        Unités de travail: plages d'au plus pages_per_task pages, les plus longues d'abord
+        pour équilibrer la charge des workers par nombre de pages.
+        Renvoie aussi les documents illisibles (résultats en échec).
+        """
+        units, failed = [], []
+        
+        for pdf_path in pdf_files:
+            try:
+                doc = fitz.open(pdf_path)
+                page_count = len(doc)
+                doc.close()
+            except Exception as e:
+                self.log(f"✗ {pdf_path.name}: {str(e)}", "ERROR")
+                failed.append({"file": pdf_path.name, "success": False, "chunks_count": 0,
+                               "processing_time": 0, "output_file": None, "error": str(e)})
+                continue
+            
+            # Plages de tailles égales: pas de petite plage finale (détection des en-têtes/pieds de page par plage)
+            ranges = -(-page_count // max(1, self.config.pages_per_task))
+            step = -(-page_count // ranges) if ranges else 1
+            units.extend((pdf_path, start, min(start + step, page_count)) for start in range(0, page_count, step))
+            if not page_count:
+                units.append((pdf_path, 0, 0))
+        
+        units.sort(key=lambda unit: unit[2] - unit[1], reverse=True)
+        return units, failed
+    
     # ------------------------------------------------------------------------
     # TRAITEMENT BATCH PARALLÈLE
     # ------------------------------------------------------------------------
     
     def process_all_documents_parallel(self) -> Dict[str, Any]:
         """Traiter tous les documents en parallèle"""
+        log_queue, listener = self.start_log_writer()
+        try:
+            return self._process_all_documents(log_queue)
+        finally:
+            self.stop_log_writer(listener)
+    
+    def _process_all_documents(self, log_queue) -> Dict[str, Any]:
         self.log("=== DÉMARRAGE TRAITEMENT PARALLÈLE ===")
         
         # Trouver les PDFs
-        pdf_files = list(self.config.documents_dir.glob("*.pdf"))
-        if not pdf_files:
-            pdf_files = list(self.config.documents_dir.glob("**/*.pdf"))
+        pdf_files = self.find_pdfs()
         
         total_files = len(pdf_files)
-        self.log(f"📚 Documents à traiter: {total_files}")
+        self.log(f"📚 Documents trouvés: {total_files}")
         
         if total_files == 0:
             return {"error": "Aucun PDF trouvé"}
         
-        # Traitement parallèle
-        all_results = []
+        # Manifeste: documents inchangés réutilisés, documents disparus supprimés
+        manifest = self.load_manifest()
+        documents = manifest["documents"]
+        keys = {pdf: str(pdf.relative_to(self.config.documents_dir)) for pdf in pdf_files}
+        
+        # Traitement interrompu: reprise après le dernier document écrit dans le corpus temporaire
+        corpus, done = self.resume_checkpoint(pdf_files, keys)
+        if corpus:
+            documents.update(done)
+            to_process = [pdf for pdf in pdf_files if keys[pdf] not in done]
+            self.log(f"⏯️ Reprise: {len(done)} documents déjà dans le corpus en cours")
+        else:
+            to_process = [pdf for pdf in pdf_files if not self.is_unchanged(pdf, documents.get(keys[pdf]))]
+        skipped = total_files - len(to_process)
+        
+        removed = [key for key in documents if key not in keys.values()]
+        for key in removed:
+            self.remove_output(documents.pop(key).get("output"))
+            self.log(f"🗑️ {key}: document supprimé, chunks retirés")
+        
+        self.log(f"♻️ Inchangés: {skipped} | À traiter: {len(to_process)} | Supprimés: {len(removed)}")
+        
+        # Traitement parallèle par plages de pages
         start_time = time.time()
+        units, all_results = self.plan_page_ranges(to_process)
+        total_pages = sum(end - start for _, start, end in units)
+        expected = {}
+        for pdf, _, _ in units:
+            expected[pdf] = expected.get(pdf, 0) + 1
+        parts = {pdf: [] for pdf in expected}
+        worker_messages = 0
+        truncation = None
         
-        # Utiliser ProcessPoolExecutor pour vrai parallélisme
-        with ProcessPoolExecutor(max_workers=self.config.max_workers) as executor:
-            # Soumettre tous les jobs
-            future_to_doc = {executor.submit(self.process_single_document, pdf): pdf for pdf in pdf_files}
-            
-            # Suivi de progression
-            completed = 0
-            for future in as_completed(future_to_doc):
-                completed += 1
-                result = future.result()
-                all_results.append(result)
-                
-                # Afficher progression
-                progress = (completed / total_files) * 100
-                elapsed = time.time() - start_time
-                eta = (elapsed / completed) * (total_files - completed) if completed > 0 else 0
+        # Corpus reconstruit en flux: lignes des documents inchangés, puis chaque document traité
+        # (point de reprise après chaque document)
+        if not corpus:
+            unchanged = [pdf for pdf in pdf_files if pdf not in to_process]
+            corpus = self.open_corpus({documents[keys[pdf]].get("output") for pdf in unchanged})
+            done = {keys[pdf]: documents[keys[pdf]] for pdf in unchanged}
+            self.save_checkpoint(corpus, done)
+        try:
+            # Utiliser ProcessPoolExecutor pour vrai parallélisme
+            # (fonctions de niveau module: seule la config est transmise, une fois par worker)
+            if units:
+                with ProcessPoolExecutor(max_workers=self.config.max_workers, initializer=_init_worker,
+                                         initargs=(self.config, log_queue)) as executor:
+                    # Soumettre tous les jobs
+                    future_to_unit = {
+                        executor.submit(_process_page_range_task, pdf, start, end): (pdf, start, end)
+                        for pdf, start, end in units
+                    }
+                    
+                    # Suivi de progression (en pages)
+                    completed = 0
+                    for future in as_completed(future_to_unit):
+                        pdf, start, end = future_to_unit[future]
+                        completed += end - start
+                        parts[pdf].append(future.result())
+                        worker_messages += parts[pdf][-1]["log_messages"]
+                        if parts[pdf][-1].get("truncation"):
+                            truncation = self._add_truncation(truncation, parts[pdf][-1]["truncation"])
+                        if len(parts[pdf]) < expected[pdf]:
+                            self._print_progress(completed, total_pages, start_time)
+                            continue
+                        
+                        # Toutes les plages du document sont prêtes: fusion dans l'ordre des pages
+                        result = self.merge_page_ranges(pdf, parts.pop(pdf), corpus)
+                        all_results.append(result)
+                        
+                        # Manifeste mis à jour pour les documents traités avec succès
+                        previous = documents.get(keys[pdf], {})
+                        if result["success"]:
+                            self.remove_output(previous.get("output"))
+                            documents[keys[pdf]] = self.manifest_entry(pdf, result)
+                            done[keys[pdf]] = documents[keys[pdf]]
+                            self.save_checkpoint(corpus, done)
+                        
+                        self._print_progress(completed, total_pages, start_time)
                 
-                print(f"\r📊 Progression: {completed}/{total_files} ({progress:.1f}%) - "
-                      f"Temps: {elapsed:.0f}s - ETA: {eta:.0f}s", end="", flush=True)
+                print()  # Nouvelle ligne après la barre de progression
+        
+        except BaseException:
+            corpus.close()  # Corpus précédent intact, reprise possible depuis le point de reprise
+            raise
         
-        print()  # Nouvelle ligne après la barre de progression
+        self.commit_corpus(corpus)
+        self.save_manifest(manifest)
+        self.checkpoint_file.unlink(missing_ok=True)
+        # Mesure seulement sur demande: pickles répétés du pipeline, fichier et file de log de test
+        overhead = (self.measure_overhead(units, self.log_count + worker_messages)
+                    if units and self.config.measure_overhead else None)
         
         # Analyse des résultats
         successful = [r for r in all_results if r["success"]]
@@ -571,6 +1141,9 @@ class FastRAGPipeline:
         report = {
             "timestamp": datetime.now(timezone.utc).isoformat(),
             "total_documents": total_files,
+            "processed_documents": len(all_results),
+            "skipped_documents": skipped,
+            "removed_documents": len(removed),
             "successful_documents": len(successful),
             "failed_documents": len(failed),
             "total_chunks_generated": total_chunks,
@@ -579,13 +1152,15 @@ class FastRAGPipeline:
             "documents_per_minute": (len(successful) / total_time) * 60 if total_time > 0 else 0,
             "chunks_per_minute": (total_chunks / total_time) * 60 if total_time > 0 else 0,
             "successful_files": [r["file"] for r in successful],
+            "removed_files": removed,
+            "overhead": overhead,
+            "truncation": truncation,
             "failed_files": [{"file": r["file"], "error": r["error"]} for r in failed]
         }
         
         # Sauvegarder le rapport
         report_file = self.output_dir / "fast_processing_report.json"
-        with open(report_file, "w", encoding="utf-8") as f:
-            json.dump(report, f, ensure_ascii=False, indent=2)
+        self.write_json_atomic(report_file, report)
         
         # Sauvegarder CSV de résumé
         if successful:
@@ -600,7 +1175,8 @@ class FastRAGPipeline:
             
             df = pd.DataFrame(summary_data)
             csv_file = self.output_dir / "fast_processing_summary.csv"
-            df.to_csv(csv_file, index=False, encoding='utf-8-sig')
+            df.to_csv(csv_file.with_suffix(".csv.tmp"), index=False, encoding='utf-8-sig')
+            os.replace(csv_file.with_suffix(".csv.tmp"), csv_file)
             report["summary_csv"] = str(csv_file)
         
         # Afficher le rapport
@@ -608,17 +1184,95 @@ class FastRAGPipeline:
         
         return report
     
+    def measure_overhead(self, units: List[Tuple[Path, int, int]], log_messages: int) -> Dict[str, Any]:
+        """
+        Surcoût IPC + logs de ce traitement, estimé avant/après:
+        - par tâche: sérialisation de la méthode liée (tout le pipeline) / de la fonction de module
+        - par message: ouverture + ajout + fermeture du fichier de log / dépôt dans la file
+        """
+        def time_per_call(fn, repeat: int = 200) -> float:
+            start = time.perf_counter()
+            for _ in range(repeat):
+                fn()
+            return (time.perf_counter() - start) / repeat
+        
+        task_before = (self.process_page_range, units[0])
+        task_after = (_process_page_range_task, units[0])
+        pickle_before = time_per_call(lambda: pickle.dumps(task_before))
+        pickle_after = time_per_call(lambda: pickle.dumps(task_after))
+        
+        line = f"[{datetime.now().strftime('%H:%M:%S')}] [INFO] {'x' * 80}\n"
+        probe_file = self.output_dir / "logs" / ".overhead_probe.log"
+        def append_line():
+            with open(probe_file, "a", encoding="utf-8") as f:
+                f.write(line)
+        log_before = time_per_call(append_line)
+        probe_file.unlink()
+        
+        probe_queue = multiprocessing.Queue()
+        handler = logging.handlers.QueueHandler(probe_queue)
+        record = logging.LogRecord(LOGGER_NAME, logging.INFO, __file__, 0, "x" * 80, None, None)
+        log_after = time_per_call(lambda: handler.emit(record))
+        probe_queue.cancel_join_thread()
+        probe_queue.close()
+        
+        return {
+            "tasks": len(units),
+            "task_bytes_before": len(pickle.dumps(task_before)),
+            "task_bytes_after": len(pickle.dumps(task_after)),
+            "log_messages": log_messages,
+            "log_us_per_message_before": round(log_before * 1e6, 1),
+            "log_us_per_message_after": round(log_after * 1e6, 1),
+            "estimated_seconds_before": len(units) * pickle_before + log_messages * log_before,
+            "estimated_seconds_after": len(units) * pickle_after + log_messages * log_after
+        }
+    
+    @staticmethod
+    def _add_truncation(total: Dict[str, Any], part: Dict[str, Any]) -> Dict[str, Any]:
+        """Cumule les statistiques de troncature d'une plage de pages"""
+        if total is None:
+            return {when: dict(stats) for when, stats in part.items()}
+        for when, stats in part.items():
+            for key, value in stats.items():
+                total[when][key] += value
+        return total
+    
+    def _print_progress(self, completed: int, total: int, start_time: float):
+        """Afficher progression (en pages)"""
+        progress = (completed / total) * 100 if total else 100.0
+        elapsed = time.time() - start_time
+        eta = (elapsed / completed) * (total - completed) if completed > 0 else 0
+        
+        print(f"\r📊 Progression: {completed}/{total} pages ({progress:.1f}%) - "
+              f"Temps: {elapsed:.0f}s - ETA: {eta:.0f}s", end="", flush=True)
+    
     def _print_summary(self, report: Dict[str, Any]):
         """Afficher un résumé clair"""
         print("\n" + "="*60)
         print("RAPPORT DE TRAITEMENT RAPIDE")
         print("="*60)
         
-        print(f"✅ Documents réussis: {report['successful_documents']}/{report['total_documents']}")
+        print(f"✅ Documents réussis: {report['successful_documents']}/{report['processed_documents']} traités "
+              f"({report['total_documents']} trouvés)")
+        print(f"♻️  Inchangés (chunks réutilisés): {report['skipped_documents']}")
+        print(f"🗑️  Supprimés (chunks retirés): {report['removed_documents']}")
         print(f"📊 Total chunks générés: {report['total_chunks_generated']}")
         print(f"⏱️  Temps total: {report['total_processing_time']:.1f} secondes")
         print(f"🚀 Vitesse: {report['documents_per_minute']:.1f} documents/minute")
         print(f"📈 Chunks/minute: {report['chunks_per_minute']:.1f}")
+        if report.get("overhead"):
+            overhead = report["overhead"]
+            print(f"⚙️  Surcoût IPC + logs estimé: {overhead['estimated_seconds_before']:.3f}s avant, "
+                  f"{overhead['estimated_seconds_after']:.3f}s après ({overhead['tasks']} tâches de "
+                  f"{overhead['task_bytes_before']} -> {overhead['task_bytes_after']} octets, "
+                  f"{overhead['log_messages']} messages)")
+        if report.get("truncation"):
+            print(f"✂️  Tokens hors fenêtre du modèle ({self.config.max_tokens} tokens, tokenisés puis ignorés):")
+            for when, label in (("before", "chunks en caractères"), ("after", "chunks en tokens")):
+                stats = report["truncation"][when]
+                share = stats["tokens_beyond_window"] / stats["tokens"] * 100 if stats["tokens"] else 0
+                print(f"   • {label}: {stats['tokens_beyond_window']}/{stats['tokens']} tokens ({share:.1f}%), "
+                      f"{stats['truncated_chunks']}/{stats['chunks']} chunks tronqués")
         
         if report['failed_documents'] > 0:
             print(f"\n❌ Documents échoués: {report['failed_documents']}")
@@ -628,9 +1282,32 @@ class FastRAGPipeline:
         print(f"\n📁 Résultats dans: {self.output_dir}")
         print(f"   • Rapport: fast_processing_report.json")
         print(f"   • Résumé: fast_processing_summary.csv")
-        print(f"   • Chunks: [nom]_chunks.json")
+        print(f"   • Chunks: {CORPUS_FILE_NAME} (une ligne JSON par chunk)")
+        print(f"   • Manifeste: manifest.json")
         print("="*60)
 
+# ============================================================================
+# WORKERS (niveau module: la config est transmise une fois par processus)
+# ============================================================================
+
+_worker_pipeline = None
+
+def _attach_log_queue(log_queue):
+    """Envoie les logs du processus courant dans la file de l'écrivain unique"""
+    logger = logging.getLogger(LOGGER_NAME)
+    logger.handlers[:] = [logging.handlers.QueueHandler(log_queue)]
+    logger.setLevel(logging.INFO)
+    logger.propagate = False
+
+def _init_worker(config: PipelineConfigFast, log_queue):
+    """Initialisation d'un processus du pool: pipeline local, logs vers la file"""
+    global _worker_pipeline
+    _attach_log_queue(log_queue)
+    _worker_pipeline = FastRAGPipeline(config)
+
+def _process_page_range_task(pdf_path: Path, start: int, end: int) -> Dict[str, Any]:
+    return _worker_pipeline.process_page_range(pdf_path, start, end)
+
 # ============================================================================
 # EXECUTION PRINCIPALE OPTIMISÉE
 # ============================================================================
@@ -653,6 +1330,10 @@ def main_fast():
         max_chunk_size=2000,       # Limite haute
         use_semantic_chunking=False,  # DÉSACTIVÉ = 10x plus rapide
         use_spacy=False,           # DÉSACTIVÉ = 100x plus rapide
+        chunking_mode="chars",     # "tokens" = chunks alignés sur la fenêtre du modèle d'embedding
+        measure_truncation=False,  # Mode tokens: mesurer la troncature avant/après (plus lent)
+        measure_overhead=False,    # Mesurer le surcoût IPC + logs avant/après (micro-benchmarks)
+        taxonomy_file=None,        # Taxonomie des domaines (JSON) ; None = DEFAULT_TAXONOMY
         max_workers=None,          # Auto-détection (utilise tous les cœurs)
         log_level="INFO"
     )
@@ -768,6 +1449,106 @@ def quick_chunking():
     
     print(f"\n✅ Terminé! Résultats dans: {output_dir}")
 
+# ============================================================================
+# OUTILS DE VÉRIFICATION
+# ============================================================================
+
+def iter_corpus(corpus_file: Path, columns: List[str] = None):
+    """Lignes du corpus en flux, réduites aux colonnes demandées"""
+    with open(corpus_file, "r", encoding="utf-8") as f:
+        for line in f:
+            row = json.loads(line)
+            yield {column: row[column] for column in columns} if columns else row
+
+def inspect_chunks(corpus_file: Path = Path("./chunks_output_fast") / CORPUS_FILE_NAME, document_name: str = "EHCVM_2018.pdf"):
+    """Vérifier la qualité des chunks d'un document du corpus"""
+    # Charger les chunks du document
+    chunks = [row for row in iter_corpus(corpus_file) if row["document_name"] == document_name]
+    print(f"Nombre de chunks: {len(chunks)}")
+    
+    # Afficher quelques chunks
+    for i, chunk in enumerate(chunks[:3]):
+        print(f"\n=== Chunk {i+1} ===")
+        print(f"Taille: {len(chunk['text'])} caractères")
+        print(f"Type: {chunk['content_type']}")
+        print(f"Domaines: {chunk['domains']}")
+        print(f"Extrait: {chunk['text'][:200]}...")
+
+def benchmark_corpus_loading(output_dir: Path = Path("./chunks_output_fast")):
+    """
+    Temps de chargement du corpus JSONL comparé à l'ancien format (un JSON indenté par document,
+    regénéré dans un dossier temporaire): lecture complète, et projection sur chunk_id + text
+    """
+    import tempfile
+    
+    corpus_file = output_dir / CORPUS_FILE_NAME
+    documents = {}
+    for row in iter_corpus(corpus_file):
+        documents.setdefault(row["source_file"], []).append(row)
+    
+    def timed(fn) -> Tuple[float, int]:
+        start = time.perf_counter()
+        count = fn()
+        return time.perf_counter() - start, count
+    
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        legacy_dir = Path(tmp_dir)
+        for source_file, rows in documents.items():
+            chunks = [{"chunk_id": row["chunk_id"], "text": row["text"],
+                       "metadata": {k: v for k, v in row.items() if k not in ("chunk_id", "text", "source_file")}}
+                      for row in rows]
+            with open(legacy_dir / source_file, "w", encoding="utf-8") as f:
+                json.dump({"metadata": {"document_name": rows[0]["document_name"]},
+                           "chunks_count": len(chunks), "chunks": chunks}, f, ensure_ascii=False, indent=2)
+        
+        def load_legacy() -> int:
+            count = 0
+            for chunk_file in sorted(legacy_dir.glob("*_chunks.json")):
+                with open(chunk_file, "r", encoding="utf-8") as f:
+                    count += len(json.load(f)["chunks"])
+            return count
+        
+        results = {
+            "json_par_document": timed(load_legacy),
+            "jsonl_complet": timed(lambda: sum(1 for _ in iter_corpus(corpus_file))),
+            "jsonl_chunk_id_text": timed(lambda: sum(1 for _ in iter_corpus(corpus_file, ["chunk_id", "text"]))),
+            "pandas_jsonl_chunk_id_text": timed(lambda: len(pd.read_json(corpus_file, lines=True)[["chunk_id", "text"]]))
+        }
+        sizes = {"json_par_document": sum(f.stat().st_size for f in legacy_dir.glob("*_chunks.json")),
+                 "jsonl": corpus_file.stat().st_size}
+    
+    print(f"\n📏 Chargement de {len(documents)} documents")
+    print(f"   • Taille: {sizes['json_par_document'] / 1e6:.1f} Mo (JSON par document) / {sizes['jsonl'] / 1e6:.1f} Mo (JSONL)")
+    for name, (seconds, count) in results.items():
+        print(f"   • {name}: {seconds:.3f}s ({count} chunks)")
+    return results
+
+# Post-traitement optionnel pour améliorer la qualité
+def postprocess_chunks(chunks_dir: Path):
+    """Amélioration légère après traitement rapide (corpus réécrit en flux)"""
+    import hashlib
+    
+    corpus_file = chunks_dir / CORPUS_FILE_NAME
+    tmp_file = corpus_file.with_suffix(".jsonl.tmp")
+    unique_texts = {}
+    
+    with open(tmp_file, "w", encoding="utf-8") as out:
+        for row in iter_corpus(corpus_file):
+            # 1. Supprimer les doublons exacts (par document)
+            seen = unique_texts.setdefault(row["source_file"], set())
+            if row["text"] in seen:
+                continue
+            seen.add(row["text"])
+            
+            # 2. Mettre à jour les IDs
+            row["chunk_id"] = hashlib.md5(
+                f"{row['document_name']}_{len(seen) - 1}".encode()
+            ).hexdigest()
+            out.write(json.dumps(row, ensure_ascii=False) + "\n")
+    
+    # Sauvegarder
+    os.replace(tmp_file, corpus_file)
+
 # ============================================================================
 # CHOIX DU MODE
 # ============================================================================
@@ -777,11 +1558,14 @@ if __name__ == "__main__":
     print("1. ⚡ Mode ULTRA RAPIDE (recommandé pour 40+ documents)")
     print("2. 🚀 Mode Express (le plus rapide, basique)")
     print("3. 🐌 Mode Complet (avec analyse avancée)")
+    print("4. 📏 Benchmark chargement du corpus (JSONL vs JSON par document)")
     
-    choice = input("\nVotre choix [1-3] (défaut: 1): ").strip()
+    choice = input("\nVotre choix [1-4] (défaut: 1): ").strip()
     
     if choice == "2":
         quick_chunking()
+    elif choice == "4":
+        benchmark_corpus_loading()
     elif choice == "3":
         # Importer et exécuter la version complète
         print("Mode Complet non disponible dans cette version rapide.")
@@ -789,70 +1573,3 @@ if __name__ == "__main__":
         main_fast()  # Fallback sur fast
     else:
         main_fast()  # Défaut: mode ultra rapide
-        
-        
-        
-        
-        
-        
-# Vérifier la qualité des chunks
-import json
-from pathlib import Path
-
-# Charger un fichier de chunks
-chunk_file = Path("./chunks_output_fast/EHCVM_2018_chunks.json")
-with open(chunk_file, 'r', encoding='utf-8') as f:
-    data = json.load(f)
-
-chunks = data.get("chunks", [])
-print(f"Nombre de chunks: {len(chunks)}")
-
-# Afficher quelques chunks
-for i, chunk in enumerate(chunks[:3]):
-    print(f"\n=== Chunk {i+1} ===")
-    print(f"Taille: {len(chunk['text'])} caractères")
-    print(f"Type: {chunk['metadata']['content_type']}")
-    print(f"Thèmes: {chunk['metadata']['themes']}")
-    print(f"Extrait: {chunk['text'][:200]}...")
-    
-    
-    
-    
-    
-    
-    
-
-
-# Post-traitement optionnel pour améliorer la qualité
-def postprocess_chunks(chunks_dir: Path):
-    """Amélioration légère après traitement rapide"""
-    import hashlib
-    
-    for chunk_file in chunks_dir.glob("*_chunks.json"):
-        with open(chunk_file, 'r', encoding='utf-8') as f:
-            data = json.load(f)
-        
-        chunks = data.get("chunks", [])
-        
-        # 1. Supprimer les doublons exacts
-        unique_texts = set()
-        unique_chunks = []
-        
-        for chunk in chunks:
-            text = chunk["text"]
-            if text not in unique_texts:
-                unique_texts.add(text)
-                unique_chunks.append(chunk)
-        
-        # 2. Mettre à jour les IDs
-        for i, chunk in enumerate(unique_chunks):
-            chunk["chunk_id"] = hashlib.md5(
-                f"{chunk['metadata']['document_name']}_{i}".encode()
-            ).hexdigest()
-        
-        # Sauvegarder
-        data["chunks"] = unique_chunks
-        data["chunks_count"] = len(unique_chunks)
-        
-        with open(chunk_file, 'w', encoding='utf-8') as f:
-            json.dump(data, f, ensure_ascii=False, indent=2)
\ No newline at end of file
@@ -114,9 +114,23 @@ def call_ollama(text: str) -> Optional[dict]:
 # ============================================================
 
 def load_all_chunks() -> list:
-    """Charge tous les chunks depuis les fichiers JSON."""
+    """Charge tous les chunks depuis le corpus JSONL (ou, à défaut, les fichiers JSON par document)."""
     all_chunks = []
 
+    # Corpus: lecture en flux, seules les colonnes utiles sont gardées
+    corpus_file = CHUNKS_DIR / "corpus.jsonl"
+    if corpus_file.exists():
+        with open(corpus_file, "r", encoding="utf-8") as f:
+            for line in f:
+                row = json.loads(line)
+                all_chunks.append({
+                    "chunk_id": row["chunk_id"],
+                    "content":  row["text"],
+                    "doc":      row["document_name"],
+                    "page":     row["page_number"],
+                })
+        return all_chunks
+
     for chunk_file in sorted(CHUNKS_DIR.glob("*_chunks.json")):
         try:
             with open(chunk_file, "r", encoding="utf-8") as f:
@@ -3,16 +3,21 @@
 # Service de recherche uniquement (FAISS + reranking)
 # Le LLM est gere par le Pipe OpenWebUI
 # =====================================
+import asyncio
 import json
 import os
+import re
 import hashlib
+import hmac
+import unicodedata
 from functools import lru_cache
 from pathlib import Path
-from typing import List, Dict
+from typing import List, Dict, Optional, Tuple
 
 import numpy as np
 import faiss
-from fastapi import FastAPI
+from fastapi import Depends, FastAPI, Header, HTTPException
+from fastapi.concurrency import run_in_threadpool
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel
 from sentence_transformers import SentenceTransformer, CrossEncoder
@@ -23,15 +28,32 @@ from sentence_transformers import SentenceTransformer, CrossEncoder
 DATA_DIR = Path(os.getenv("DATA_DIR", "/app/data"))
 FAISS_PATH = DATA_DIR / "embeddings" / "faiss_index.bin"
 CHUNK_MAP_PATH = DATA_DIR / "embeddings" / "chunk_map.json"
+# Position FAISS -> chunk_id (null = chunk supprime, en attente de compaction)
+INDEX_IDS_PATH = DATA_DIR / "embeddings" / "index_ids.json"
+# Vecteurs float32 exacts, alignes sur les positions de l'index (lus en memmap)
+EMBEDDINGS_PATH = DATA_DIR / "embeddings" / "embeddings.npy"
+# Quasi-doublons ecartes a la construction (chunk_id -> chunk garde + entree chunk_map)
+DROPPED_PATH = DATA_DIR / "embeddings" / "dropped_chunks.json"
+# Journal des mises a jour (une ligne JSON par operation) et vecteurs float32 des ajouts : une
+# mise a jour n'ecrit que sa modification, les fichiers ci-dessus ne sont reecrits qu'a la compaction
+JOURNAL_PATH = DATA_DIR / "embeddings" / "index_journal.jsonl"
+JOURNAL_VECTORS_PATH = DATA_DIR / "embeddings" / "journal_vectors.f32"
 
 TOP_K_SEARCH = int(os.getenv("TOP_K_SEARCH", "10"))
 TOP_K_RERANK = int(os.getenv("TOP_K_RERANK", "5"))
+# Index compresse (SQ8/PQ) : liste courte de top_k_search x RESCORE_FACTOR, re-scoree exactement
+RESCORE_FACTOR = int(os.getenv("RESCORE_FACTOR", "4"))
 
 RERANKER_MODEL_NAME = os.getenv("RERANKER_MODEL", "cross-encoder/ms-marco-MiniLM-L-2-v2")
 RERANKER_MAX_LENGTH = int(os.getenv("RERANKER_MAX_LENGTH", "512"))
 
 CORS_ORIGINS = os.getenv("CORS_ORIGINS", "*").split(",")
 
+# Endpoints /admin (mises a jour incrementales) : desactives si vide
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN", "")
+# Compaction de l'index au-dela de cette proportion de positions supprimees
+COMPACT_RATIO = float(os.getenv("COMPACT_RATIO", "0.2"))
+
 # =====================================
 # CHARGEMENT DES DONNEES
 # =====================================
@@ -39,18 +61,238 @@ print("=" * 60)
 print("RAG SEARCH API - ANSTAT")
 print("=" * 60)
 
-print(f"Loading FAISS index from {FAISS_PATH}...")
-index = faiss.read_index(str(FAISS_PATH))
-print(f"  FAISS: {index.ntotal} vecteurs, {index.d} dimensions")
-
 FAISS_THREADS = int(os.getenv("OMP_NUM_THREADS", "4"))
 faiss.omp_set_num_threads(FAISS_THREADS)
 
-print(f"Loading chunk_map from {CHUNK_MAP_PATH}...")
-with open(CHUNK_MAP_PATH, "r", encoding="utf-8") as f:
-    chunk_map = json.load(f)
-chunk_ids = list(chunk_map.keys())
-print(f"  {len(chunk_ids)} chunks charges")
+
+def compute_index_version() -> str:
+    """
+    Empreinte courte de l'index charge (taille + date des fichiers),
+    prefixee par INDEX_VERSION si defini. Change a chaque mise a jour.
+    """
+    paths = [FAISS_PATH, CHUNK_MAP_PATH] + ([JOURNAL_PATH] if JOURNAL_PATH.exists() else [])
+    stamp = "|".join(
+        f"{p.name}:{p.stat().st_size}:{p.stat().st_mtime_ns}" for p in paths
+    )
+    digest = hashlib.md5(stamp.encode()).hexdigest()[:12]
+    prefix = os.getenv("INDEX_VERSION")
+    return f"{prefix}-{digest}" if prefix else digest
+
+
+def base_files_stamp(ntotal: int) -> str:
+    """Fichiers de base auxquels s'applique le journal (meme calcul que le script)."""
+    return f"{ntotal}:{FAISS_PATH.stat().st_size}:{CHUNK_MAP_PATH.stat().st_size}"
+
+
+def journal_size() -> int:
+    return JOURNAL_PATH.stat().st_size if JOURNAL_PATH.exists() else 0
+
+
+def load_index():
+    """(Re)charge l'index FAISS, chunk_map et la table position -> chunk_id, puis rejoue le journal."""
+    global index, chunk_map, chunk_ids, index_stamp, vectors, rescore, dropped_chunks
+    global base_stamp, journal_offset, journal_rows, journal_vectors, journal_seen
+
+    print(f"Loading FAISS index from {FAISS_PATH}...")
+    index_stamp = FAISS_PATH.stat().st_mtime_ns
+    index = faiss.read_index(str(FAISS_PATH))
+    print(f"  FAISS: {index.ntotal} vecteurs, {index.d} dimensions")
+
+    vectors = None
+    if EMBEDDINGS_PATH.exists():
+        vectors = np.load(EMBEDDINGS_PATH, mmap_mode="r")
+        if vectors.shape[0] != index.ntotal:
+            print(f"  {EMBEDDINGS_PATH.name} non aligne sur l'index ({vectors.shape[0]} vecteurs), ignore")
+            vectors = None
+    # Flat / IVFFlat : scores deja exacts
+    rescore = is_compressed() and vectors is not None
+    if rescore:
+        print(f"  Index compresse : re-scoring exact de top_k x {RESCORE_FACTOR} candidats")
+
+    print(f"Loading chunk_map from {CHUNK_MAP_PATH}...")
+    with open(CHUNK_MAP_PATH, "r", encoding="utf-8") as f:
+        chunk_map = json.load(f)
+    if INDEX_IDS_PATH.exists():
+        with open(INDEX_IDS_PATH, "r", encoding="utf-8") as f:
+            chunk_ids = json.load(f)
+    else:
+        # Index construit avant les mises a jour incrementales : ordre de chunk_map
+        chunk_ids = list(chunk_map.keys())
+    dropped_chunks = {}
+    if DROPPED_PATH.exists():
+        with open(DROPPED_PATH, "r", encoding="utf-8") as f:
+            dropped_chunks = json.load(f)
+    install_positions(*position_tables(chunk_ids))
+
+    base_stamp = base_files_stamp(index.ntotal)
+    journal_offset, journal_rows, journal_vectors, journal_seen = 0, 0, None, 0
+    replay_journal()
+    print(f"  {len(chunk_map)} chunks charges ({tombstone_count} positions supprimees)")
+    print(f"  Version de l'index: {index_version}")
+
+
+def position_tables(ids: List) -> Tuple[Dict[str, int], Dict[str, set]]:
+    """
+    Tables chunk_id -> position et document (source_file et document_id) -> chunk_ids des
+    positions vivantes : seul parcours complet, au chargement et a la compaction.
+    """
+    positions, documents = {}, {}
+    for pos, chunk_id in enumerate(ids):
+        if chunk_id is not None:
+            positions[chunk_id] = pos
+            for name in document_names(chunk_map.get(chunk_id, {})):
+                documents.setdefault(name, set()).add(chunk_id)
+    return positions, documents
+
+
+def install_positions(positions: Dict[str, int], documents: Dict[str, set]):
+    global chunk_positions, document_chunks, tombstone_count
+    chunk_positions, document_chunks = positions, documents
+    tombstone_count = len(chunk_ids) - len(positions)
+
+
+def document_names(data: Dict) -> set:
+    return {data.get("source_file"), data.get("document_id")} - {None, ""}
+
+
+def replay_journal():
+    """
+    Applique les operations du journal ecrites depuis le dernier passage (au chargement, apres
+    une ecriture de ce worker ou d'un autre) : cout proportionnel aux nouvelles lignes. Journal
+    d'un autre index : ignore ; derniere ligne incomplete (ecriture interrompue) : ignoree.
+    """
+    global journal_offset, journal_rows, journal_vectors, journal_seen, index_version
+    journal_seen = journal_size()
+    rows = journal_rows
+    if journal_seen:
+        with open(JOURNAL_PATH, "rb") as f:
+            f.seek(journal_offset)
+            for line in f:
+                if not line.endswith(b"\n"):
+                    break
+                op = json.loads(line)
+                if journal_offset == 0 and op != {"op": "base", "stamp": base_stamp}:
+                    print(f"  {JOURNAL_PATH.name} ecrit pour un autre index, ignore")
+                    break
+                apply_journal_op(op)
+                if op["op"] == "add":
+                    rows += len(op["ids"])
+                journal_offset += len(line)
+    if rows > journal_rows:
+        journal_vectors = np.memmap(JOURNAL_VECTORS_PATH, dtype=np.float32, mode="r", shape=(rows, index.d))
+        index.add(np.asarray(journal_vectors[journal_rows:rows]))
+        journal_rows = rows
+    index_version = compute_index_version()
+    domain_positions.cache_clear()
+
+
+def apply_journal_op(op: Dict):
+    """Applique une operation du journal a l'etat en memoire (sauf les vecteurs, voir replay_journal)."""
+    if op["op"] == "add":
+        for chunk_id in op["ids"]:
+            if chunk_id in chunk_positions:
+                remove_position(chunk_positions[chunk_id])
+            chunk_map[chunk_id] = op["chunks"][chunk_id]
+            chunk_ids.append(chunk_id)
+            chunk_positions[chunk_id] = len(chunk_ids) - 1
+            for name in document_names(chunk_map[chunk_id]):
+                document_chunks.setdefault(name, set()).add(chunk_id)
+    elif op["op"] == "remove":
+        for pos in op["positions"]:
+            remove_position(pos)
+    elif op["op"] == "dropped":
+        for chunk_id, entry in op["changes"].items():
+            if entry is None:
+                dropped_chunks.pop(chunk_id, None)
+            else:
+                dropped_chunks[chunk_id] = entry
+
+
+def remove_position(pos: int):
+    """Supprime le chunk de cette position ; l'index garde la position jusqu'a la compaction."""
+    global tombstone_count
+    chunk_id = chunk_ids[pos]
+    if chunk_id is None:
+        return
+    chunk_ids[pos] = None
+    tombstone_count += 1
+    if chunk_positions.get(chunk_id) == pos:
+        del chunk_positions[chunk_id]
+        for name in document_names(chunk_map.pop(chunk_id, {})):
+            chunks = document_chunks.get(name)
+            if chunks is not None:
+                chunks.discard(chunk_id)
+                if not chunks:
+                    del document_chunks[name]
+
+
+def is_compressed() -> bool:
+    """Index SQ8/PQ : vecteurs stockes avec perte (Flat / IVFFlat : exacts)."""
+    return not isinstance(faiss.downcast_index(index), (faiss.IndexFlat, faiss.IndexIVFFlat))
+
+
+def fold_domain(name: str) -> str:
+    """Nom de domaine sans casse ni accents ("Sante" == "santé")."""
+    return unicodedata.normalize("NFKD", name).encode("ascii", "ignore").decode("ascii").lower().strip()
+
+
+@lru_cache(maxsize=64)
+def domain_positions(domains: tuple) -> np.ndarray:
+    """
+    Positions FAISS des chunks annotes d'au moins un des domaines (colonne "domains" du
+    corpus) ; les positions supprimees n'y figurent pas. Vide a chaque (re)chargement.
+    """
+    wanted = {fold_domain(d) for d in domains}
+    return np.array([
+        pos for pos, chunk_id in enumerate(chunk_ids)
+        if chunk_id is not None
+        and any(fold_domain(d) in wanted for d in chunk_map.get(chunk_id, {}).get("domains", []))
+    ], dtype=np.int64)
+
+
+def search_params(positions: np.ndarray):
+    """Restreint la recherche FAISS a ces positions (IVF : meme nprobe que l'index)."""
+    selector = faiss.IDSelectorBatch(positions)
+    base = faiss.downcast_index(index)
+    if isinstance(base, faiss.IndexIVF):
+        return faiss.SearchParametersIVF(sel=selector, nprobe=base.nprobe)
+    return faiss.SearchParameters(sel=selector)
+
+
+def exact_vectors(positions: np.ndarray) -> np.ndarray:
+    """Vecteurs exacts de ces positions : embeddings.npy (memmap), puis vecteurs du journal."""
+    base = vectors.shape[0]
+    out = np.empty((len(positions), index.d), dtype=np.float32)
+    in_base = positions < base
+    out[in_base] = vectors[positions[in_base]]
+    if not in_base.all():
+        out[~in_base] = journal_vectors[positions[~in_base] - base]
+    return out
+
+
+# Ecritures (endpoints /admin) une a la fois, voir update_documents
+write_lock = asyncio.Lock()
+
+
+def reload_if_changed():
+    """Met a jour l'index depuis le disque (sync_index), sauf pendant une ecriture de ce worker."""
+    if not write_lock.locked():
+        sync_index()
+
+
+def sync_index():
+    """
+    Recharge l'index si un autre worker (ou le script) a reecrit les fichiers de base, ou
+    rejoue seulement la fin du journal s'il a grandi.
+    """
+    if FAISS_PATH.stat().st_mtime_ns != index_stamp:
+        print("Index modifie sur disque, rechargement...")
+        load_index()
+    elif journal_size() != journal_seen:
+        replay_journal()
+
+
+load_index()
 
 # =====================================
 # MODELE D'EMBEDDING
@@ -73,7 +315,7 @@ print(f"Loading reranker: {RERANKER_MODEL_NAME}...")
 reranker = CrossEncoder(RERANKER_MODEL_NAME, max_length=RERANKER_MAX_LENGTH)
 print(f"  Reranker charge (max_length={RERANKER_MAX_LENGTH})")
 
-print(f"\nSearch API pret: {len(chunk_ids)} chunks, {index.ntotal} vecteurs")
+print(f"\nSearch API pret: {len(chunk_map)} chunks, {index.ntotal} vecteurs")
 print("=" * 60)
 
 # =====================================
@@ -97,31 +339,62 @@ def get_query_embedding(query: str) -> np.ndarray:
 # =====================================
 # RECHERCHE FAISS + RERANKING
 # =====================================
-def search(query: str, top_k_search: int = None, top_k_rerank: int = None) -> List[Dict]:
+def search(query: str, top_k_search: int = None, top_k_rerank: int = None,
+           domains: List[str] = None) -> List[Dict]:
     if top_k_search is None:
         top_k_search = TOP_K_SEARCH
     if top_k_rerank is None:
         top_k_rerank = TOP_K_RERANK
 
     query_emb = get_query_embedding(query)
-    scores, indices = index.search(np.array([query_emb]), top_k_search)
+    shortlist = top_k_search * RESCORE_FACTOR if rescore else top_k_search
+    if domains:
+        # Filtre par domaine dans FAISS : seuls les chunks annotes sont parcourus
+        positions = domain_positions(tuple(sorted(domains)))
+        if not len(positions):
+            return []
+        params = search_params(positions)
+        scores, indices = index.search(np.array([query_emb]), min(shortlist, len(positions)), params=params)
+    else:
+        # Les positions supprimees sont ignorees : on en demande d'autant plus a FAISS
+        fetch = min(shortlist + tombstone_count, index.ntotal)
+        scores, indices = index.search(np.array([query_emb]), fetch)
+    if rescore:
+        # Produits scalaires exacts pour la seule liste courte
+        found = indices[0][indices[0] >= 0]
+        exact_scores = exact_vectors(found) @ query_emb
+        order = np.argsort(-exact_scores)
+        scores, indices = exact_scores[order][None], found[order][None]
 
     candidates = []
     for score, idx in zip(scores[0], indices[0]):
         if idx < 0 or idx >= len(chunk_ids):
             continue
         chunk_id = chunk_ids[idx]
+        if chunk_id is None:
+            continue
         chunk = chunk_map.get(chunk_id, {})
         if not chunk:
             continue
+        if len(candidates) >= top_k_search:
+            break
         candidates.append({
+            "chunk_id": chunk_id,
             "faiss_score": float(score),
             "content": chunk.get("content", ""),
             "doc": chunk.get("document_id", ""),
             "page": chunk.get("page_number", 0),
             "source": chunk.get("source_file", ""),
+            "domains": chunk.get("domains", []),
         })
 
+    return rerank(query, candidates, top_k_rerank)
+
+
+def rerank(query: str, candidates: List[Dict], top_k_rerank: int = None) -> List[Dict]:
+    """Classe des candidats (dicts avec "content") par score du cross-encoder."""
+    if top_k_rerank is None:
+        top_k_rerank = TOP_K_RERANK
     if not candidates:
         return []
 
@@ -137,17 +410,234 @@ def search(query: str, top_k_search: int = None, top_k_rerank: int = None) -> Li
     results = []
     for candidate, rr_score in ranked[:top_k_rerank]:
         results.append({
+            "chunk_id": candidate.get("chunk_id", ""),
             "score": float(rr_score),
-            "faiss_score": candidate["faiss_score"],
+            "faiss_score": candidate.get("faiss_score", 0.0),
             "content": candidate["content"],
-            "doc": candidate["doc"],
-            "page": candidate["page"],
-            "source": candidate["source"],
+            "doc": candidate.get("doc", ""),
+            "page": candidate.get("page", 0),
+            "source": candidate.get("source", ""),
+            "domains": candidate.get("domains", []),
         })
 
     return results
 
 
+# =====================================
+# MISES A JOUR INCREMENTALES
+# =====================================
+def clean_text(text: str) -> str:
+    """Meme nettoyage que clean_text_enhanced du script de construction de l'index."""
+    if not text or not isinstance(text, str):
+        return ""
+    text = unicodedata.normalize("NFKC", text)
+    text = text.replace("\n", " ").replace("\r", " ").replace("\t", " ")
+    text = " ".join(text.split())
+    text = re.sub(r'https?://\S+', '', text)
+    text = re.sub(r'\S+@\S+', '', text)
+    text = re.sub(r'\b\d{1,3}\s*/\s*\d{1,3}\b', '', text)
+    return text.strip()
+
+
+def document_entries(source_file: str, document_id: str, chunks: List[Dict]) -> Dict[str, Dict]:
+    """Entrees chunk_map des chunks d'un document (format du script de preparation)."""
+    entries = {}
+    for chunk in chunks:
+        raw = chunk.get("content") or chunk.get("text") or ""
+        text = clean_text(raw)
+        if len(text) < 100:
+            continue
+        if len(text) > 3000:
+            text = text[:3000] + "..."
+        metadata = chunk.get("metadata") or {}
+        chunk_id = chunk.get("chunk_id") or hashlib.md5(text.encode()).hexdigest()[:16]
+        entries[chunk_id] = {
+            "document_id": document_id or metadata.get("document_name") or source_file,
+            "page_number": chunk.get("page_number", metadata.get("page_number", -1)),
+            "content": text,
+            "source_file": source_file,
+            "word_count": len(text.split()),
+            "domains": chunk.get("domains") or metadata.get("domains") or [],
+            "original_preview": raw[:200],
+        }
+    return entries
+
+
+def document_positions(names: set) -> List[int]:
+    """Positions des chunks des documents (document_id ou source_file), sans parcourir l'index."""
+    return sorted({chunk_positions[chunk_id] for name in names for chunk_id in document_chunks.get(name, ())})
+
+
+def plan_readmission(names: set, removed_ids: set, entries: Dict[str, Dict]) -> Tuple[Dict[str, Dict], Dict]:
+    """
+    Quasi-doublons ecartes a la construction (dropped_chunks.json) : ceux des documents names
+    sont oublies, ceux dont le chunk garde ne sera plus indexe sont a reindexer (sinon absents
+    de l'index jusqu'au prochain build). Renvoie (entrees a reindexer, changements de dropped_chunks).
+    """
+    readmitted, changes = {}, {}
+    for chunk_id, entry in dropped_chunks.items():
+        kept = entry.get("kept")
+        if entry.get("source_file") in names or entry.get("document_id") in names:
+            changes[chunk_id] = None
+        elif kept not in entries and (kept in removed_ids or kept not in chunk_map):
+            changes[chunk_id] = None
+            if chunk_id not in chunk_map and chunk_id not in entries:
+                readmitted[chunk_id] = {k: v for k, v in entry.items() if k != "kept"}
+    if readmitted:
+        print(f"  {len(readmitted)} quasi-doublons reindexes (chunk garde supprime)")
+    return readmitted, changes
+
+
+def encode_entries(entries: Dict[str, Dict]) -> np.ndarray:
+    return embed_model.encode(
+        [data["content"] for data in entries.values()],
+        batch_size=32, normalize_embeddings=True, show_progress_bar=False,
+    ).astype(np.float32)
+
+
+def append_journal(ops: List[Dict], embeddings: Optional[np.ndarray] = None):
+    """
+    Ajoute des operations au journal : vecteurs des ajouts d'abord (apres les lignes deja
+    journalisees), puis les lignes JSON, synchronises sur disque. Un journal vide (ou d'un
+    autre index) est recree, precede de sa ligne de base. Appele dans un thread, sous write_lock.
+    """
+    fresh = journal_offset == 0
+    if embeddings is not None and len(embeddings):
+        mode = "r+b" if JOURNAL_VECTORS_PATH.exists() and not fresh else "wb"
+        with open(JOURNAL_VECTORS_PATH, mode) as f:
+            f.seek(journal_rows * index.d * 4)
+            f.write(np.ascontiguousarray(embeddings, dtype=np.float32).tobytes())
+            f.truncate()
+            f.flush()
+            os.fsync(f.fileno())
+    lines = ([{"op": "base", "stamp": base_stamp}] if fresh else []) + ops
+    data = "".join(json.dumps(op, ensure_ascii=False) + "\n" for op in lines).encode("utf-8")
+    with open(JOURNAL_PATH, "wb" if fresh else "r+b") as f:
+        f.seek(journal_offset)
+        f.write(data)
+        f.truncate()
+        f.flush()
+        os.fsync(f.fileno())
+
+
+async def update_documents(names: set, entries: Dict[str, Dict]) -> Dict:
+    """
+    Supprime les documents names et ajoute les entrees, sous write_lock. Encodage et ecriture
+    du journal (seule la modification) dans un thread : les recherches continuent sur l'etat
+    precedent, puis replay_journal l'applique d'un coup dans la boucle.
+    """
+    removed = document_positions(names)
+    removed_ids = {chunk_ids[pos] for pos in removed}
+    # chunk_id deja indexe (autre document, ou meme texte sans chunk_id) : une seule position
+    # vivante par chunk_id, la nouvelle version remplace l'ancienne
+    replaced = [chunk_positions[chunk_id] for chunk_id in entries
+                if chunk_id in chunk_positions and chunk_id not in removed_ids]
+    if replaced:
+        print(f"  {len(replaced)} chunk_id deja indexes remplaces")
+    readmitted, dropped_changes = plan_readmission(names, removed_ids, entries)
+    added = {**entries, **readmitted}
+
+    ops, embeddings = [], None
+    if removed or replaced:
+        ops.append({"op": "remove", "positions": sorted(removed + replaced)})
+    if added:
+        embeddings = await run_in_threadpool(encode_entries, added)
+        ops.append({"op": "add", "ids": list(added), "chunks": added})
+    if dropped_changes:
+        ops.append({"op": "dropped", "changes": dropped_changes})
+    if ops:
+        await run_in_threadpool(append_journal, ops, embeddings)
+        replay_journal()
+    compacted = await compact()
+    return {"added": len(entries), "removed": len(removed), "readmitted": len(readmitted), "compacted": compacted}
+
+
+async def compact(force: bool = False) -> bool:
+    """
+    Compaction au-dela de COMPACT_RATIO positions supprimees (ou forcee), sous write_lock :
+    seule reecriture complete des fichiers de base, dans un thread (compact_index).
+    """
+    if not tombstone_count or (not force and tombstone_count / max(len(chunk_ids), 1) <= COMPACT_RATIO):
+        return False
+    if vectors is None and is_compressed():
+        print("Index compresse sans embeddings.npy : compaction ignoree (reconstruction complete necessaire)")
+        return False
+    tombstones = tombstone_count
+    install_compacted(*(await run_in_threadpool(compact_index)))
+    print(f"Index compacte: {tombstones} positions supprimees, {index.ntotal} vecteurs")
+    return True
+
+
+def compact_index() -> Tuple:
+    """
+    Reconstruit l'index sans les positions supprimees, sans re-embedding : a partir
+    des vecteurs exacts (embeddings.npy et journal) s'ils sont charges, sinon relus dans l'index
+    (Flat / IVFFlat seulement : reencoder des vecteurs SQ8/PQ decodes cumulerait l'erreur
+    de quantification a chaque compaction). Ecrit les nouveaux fichiers de base (save_index) ;
+    l'etat en memoire ne change qu'ensuite, dans la boucle (install_compacted).
+    """
+    keep = np.array([pos for pos, chunk_id in enumerate(chunk_ids) if chunk_id is not None], dtype=np.int64)
+    if vectors is not None:
+        kept_vectors = exact_vectors(keep)
+    else:
+        source = faiss.clone_index(index)  # l'index en service reste intact pendant les recherches
+        if hasattr(source, "make_direct_map"):
+            source.make_direct_map()  # IVF : necessaire pour reconstruct_n
+        kept_vectors = source.reconstruct_n(0, source.ntotal)[keep]
+    compacted = faiss.clone_index(index)  # garde l'entrainement IVF/SQ8/PQ
+    compacted.reset()
+    compacted.add(kept_vectors)
+    kept_ids = [chunk_ids[pos] for pos in keep]
+    stored = save_index(compacted, kept_ids, kept_vectors if vectors is not None else None)
+    return compacted, kept_ids, stored, position_tables(kept_ids)
+
+
+def save_index(new_index, ids: List, new_vectors: Optional[np.ndarray]) -> Optional[np.ndarray]:
+    """
+    Reecriture complete des fichiers de base (compaction) : ecriture atomique (fichier
+    temporaire + rename), l'index en dernier pour sync_index, puis journal supprime.
+    Renvoie les vecteurs exacts relus en memmap.
+    """
+    for path, data in ((CHUNK_MAP_PATH, chunk_map), (INDEX_IDS_PATH, ids), (DROPPED_PATH, dropped_chunks)):
+        tmp_path = path.with_suffix(path.suffix + ".tmp")
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(data, f, ensure_ascii=False)
+        os.replace(tmp_path, path)
+    if new_vectors is not None:
+        tmp_path = EMBEDDINGS_PATH.with_suffix(".tmp.npy")
+        np.save(tmp_path, new_vectors)
+        os.replace(tmp_path, EMBEDDINGS_PATH)
+        new_vectors = np.load(EMBEDDINGS_PATH, mmap_mode="r")
+    tmp_path = FAISS_PATH.with_suffix(FAISS_PATH.suffix + ".tmp")
+    faiss.write_index(new_index, str(tmp_path))
+    os.replace(tmp_path, FAISS_PATH)
+    JOURNAL_PATH.unlink(missing_ok=True)
+    JOURNAL_VECTORS_PATH.unlink(missing_ok=True)
+    return new_vectors
+
+
+def install_compacted(new_index, ids: List, new_vectors: Optional[np.ndarray], tables: Tuple):
+    """Remplace d'un coup (dans la boucle, entre deux recherches) l'etat par l'index compacte."""
+    global index, chunk_ids, vectors, base_stamp, index_stamp, index_version
+    global journal_offset, journal_rows, journal_vectors, journal_seen
+    index, chunk_ids, vectors = new_index, ids, new_vectors
+    install_positions(*tables)
+    base_stamp = base_files_stamp(index.ntotal)
+    index_stamp = FAISS_PATH.stat().st_mtime_ns
+    journal_offset, journal_rows, journal_vectors, journal_seen = 0, 0, None, 0
+    index_version = compute_index_version()
+    domain_positions.cache_clear()
+
+
+def index_stats() -> Dict:
+    return {
+        "chunks": len(chunk_map),
+        "vectors": index.ntotal,
+        "tombstones": tombstone_count,
+        "index_version": index_version,
+    }
+
+
 # =====================================
 # FASTAPI
 # =====================================
@@ -166,14 +656,55 @@ class SearchRequest(BaseModel):
     query: str
     top_k_search: int = None
     top_k_rerank: int = None
+    # Domaines statistiques (annotation du corpus, voir /domains) : au moins un en commun
+    domains: List[str] = None
+    # Renvoie aussi l'embedding de la requete (comme /embed, sans second appel)
+    return_embedding: bool = False
+
+
+class EmbedRequest(BaseModel):
+    query: str
+
+
+class RerankCandidate(BaseModel):
+    # Format des resultats de /search ; seul le texte est requis
+    content: str
+    chunk_id: Optional[str] = ""
+    faiss_score: Optional[float] = 0.0
+    doc: Optional[str] = ""
+    page: Optional[int] = 0
+    source: Optional[str] = ""
+    domains: Optional[List[str]] = []
+
+
+class RerankRequest(BaseModel):
+    query: str
+    candidates: List[RerankCandidate]
+    top_k_rerank: int = None
+
+
+class DocumentRequest(BaseModel):
+    source_file: str
+    document_id: str = None
+    chunks: List[Dict]
+
+
+def require_admin(authorization: str = Header(default="")):
+    if not ADMIN_TOKEN:
+        raise HTTPException(status_code=403, detail="Administration desactivee (ADMIN_TOKEN non defini)")
+    if not hmac.compare_digest(authorization, f"Bearer {ADMIN_TOKEN}"):
+        raise HTTPException(status_code=401, detail="Token d'administration invalide")
 
 
 @app.get("/health")
 async def health():
     return {
         "status": "ok",
-        "chunks": len(chunk_ids),
+        "chunks": len(chunk_map),
         "vectors": index.ntotal,
+        "tombstones": tombstone_count,
+        "index_version": index_version,
+        "rescore": rescore,
         "embedding_model": EMBED_MODEL_NAME,
         "reranker": RERANKER_MODEL_NAME,
     }
@@ -181,10 +712,80 @@ async def health():
 
 @app.post("/search")
 async def search_endpoint(req: SearchRequest):
-    results = search(req.query, req.top_k_search, req.top_k_rerank)
+    reload_if_changed()
+    results = search(req.query, req.top_k_search, req.top_k_rerank, req.domains)
+    response = {
+        "query": req.query,
+        "results": results,
+        "count": len(results),
+        "index_version": index_version,
+    }
+    if req.return_embedding:
+        # Deja calcule par search() : lu dans le cache des embeddings de requete
+        response["embedding"] = get_query_embedding(req.query).tolist()
+    return response
+
+
+@app.get("/domains")
+async def domains_endpoint():
+    """Domaines annotes dans l'index et nombre de chunks (valeurs du filtre "domains" de /search)."""
+    reload_if_changed()
+    counts = {}
+    for chunk in chunk_map.values():
+        for domain in chunk.get("domains", []):
+            counts[domain] = counts.get(domain, 0) + 1
+    return {"domains": dict(sorted(counts.items(), key=lambda item: -item[1])), "index_version": index_version}
+
+
+@app.post("/embed")
+async def embed_endpoint(req: EmbedRequest):
+    """Embedding normalise de la requete (meme cache que /search)."""
+    return {"query": req.query, "embedding": get_query_embedding(req.query).tolist()}
+
+
+@app.post("/rerank")
+async def rerank_endpoint(req: RerankRequest):
+    """Re-classe des sources deja retrouvees (questions de suivi du pipe), sans FAISS."""
+    results = rerank(req.query, [c.model_dump() for c in req.candidates], req.top_k_rerank)
     return {"query": req.query, "results": results, "count": len(results)}
 
 
+# Ecritures une a une (write_lock) ; encodage et ecritures disque dans un thread, les
+# recherches continuent pendant ce temps sur l'etat precedent (voir update_documents).
+@app.post("/admin/documents", dependencies=[Depends(require_admin)])
+async def upsert_document(req: DocumentRequest):
+    """Ajoute un document, ou remplace toutes ses versions precedentes (meme source_file)."""
+    async with write_lock:
+        sync_index()
+        entries = document_entries(req.source_file, req.document_id, req.chunks)
+        result = await update_documents({req.source_file}, entries)
+    print(f"Admin: {req.source_file} -> {result['added']} chunks ajoutes, {result['removed']} supprimes")
+    return {"source_file": req.source_file, **result, **index_stats()}
+
+
+@app.delete("/admin/documents/{name}", dependencies=[Depends(require_admin)])
+async def delete_document(name: str):
+    """Supprime un document (document_id ou source_file)."""
+    async with write_lock:
+        sync_index()
+        if not document_positions({name}):
+            raise HTTPException(status_code=404, detail=f"Document inconnu: {name}")
+        result = await update_documents({name}, {})
+    print(f"Admin: {name} -> {result['removed']} chunks supprimes")
+    return {"document": name, "removed": result["removed"], "readmitted": result["readmitted"],
+            "compacted": result["compacted"], **index_stats()}
+
+
+@app.post("/admin/compact", dependencies=[Depends(require_admin)])
+async def compact_endpoint():
+    async with write_lock:
+        sync_index()
+        if vectors is None and is_compressed():
+            raise HTTPException(status_code=409, detail="Index compresse sans embeddings.npy : compaction impossible")
+        compacted = await compact(force=True)
+    return {"compacted": compacted, **index_stats()}
+
+
 # =====================================
 # LANCEMENT
 # =====================================